@@ -2,102 +2,185 @@
 # app/ai_coach.py
 # =====================================
 import os
-import openai
-from typing import Optional
+import asyncio
+import time
+from typing import TYPE_CHECKING, List, Optional
+from collections import defaultdict
 import logging
 from datetime import datetime, timedelta
-from .database import get_db_sync
-from .models import User, Invoice, Conversation, PendingMessage
+from .database import get_async_db
+from .cache import ResponseCache
+from .llm_guard import CircuitOpen, LLMGuard, QueueTimeout
+from .coordination import SharedCacheStore
+from .intent import IntentClassifier
+from .users import UserProfile, UserStore
+from .conversation_log import ConversationLogWriter
+from .context import ConversationContextBuilder, depends_on_history
+from .summaries import get_summary
+from .media import MediaTooLarge
+from .metrics import HANDLER_SECONDS, LLM_SECONDS, STAGE_SECONDS
+from .models import Invoice, PendingMessage
 import json
 import re
 
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
 logger = logging.getLogger(__name__)
 
 class FacturationCoach:
-    def __init__(self):
+    def __init__(self, media_pipeline=None):
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        if self.openai_api_key:
-            openai.api_key = self.openai_api_key
-        else:
+        
+        # Réception des photos de factures (MediaPipeline), optionnelle
+        self.media = media_pipeline
+        
+        # Appels LLM non bloquants : nombre d'appels simultanés et délai du SDK
+        # (filet de sécurité : le délai strict est LLM_DEADLINE, voir llm_guard)
+        self.llm_timeout = float(os.getenv("OPENAI_TIMEOUT", "20"))
+        self.llm_max_concurrency = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+        self._llm_slots = asyncio.Semaphore(self.llm_max_concurrency)
+        self.llm_in_flight = 0
+        # Délai strict par requête et disjoncteur : repli immédiat quand OpenAI est lent ou en panne
+        self.llm_guard = LLMGuard()
+        # Client OpenAI créé au premier appel (import du SDK coûteux au démarrage)
+        self._llm_client: Optional["AsyncOpenAI"] = None
+        
+        # Profils utilisateurs en cache, last_active écrit en différé
+        self.users = UserStore()
+        self.conversation_log = ConversationLogWriter()
+        
+        # Classifieur d'intention compilé une fois au démarrage
+        self.intent_classifier = IntentClassifier.from_env()
+        
+        # Cache des conseils LLM (questions quasi identiques, même activité)
+        # (second niveau en base partagé entre processus, LLM_CACHE_SHARED)
+        self.advice_cache = ResponseCache(
+            max_size=int(os.getenv("LLM_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "21600")),
+            shared=SharedCacheStore() if os.getenv("LLM_CACHE_SHARED", "true").lower() == "true" else None
+        )
+        
+        if not self.openai_api_key:
             logger.warning("Clé API OpenAI non configurée")
+        
+        # Historique borné pour les prompts (résumé glissant + derniers échanges)
+        self.context = ConversationContextBuilder(
+            self.conversation_log,
+            summarize=self._summarize_exchanges if self.openai_api_key else None
+        )
+    
+    def _llm(self) -> "AsyncOpenAI":
+        """Client OpenAI partagé, créé au premier appel"""
+        if self._llm_client is None:
+            from openai import AsyncOpenAI
+            self._llm_client = AsyncOpenAI(
+                api_key=self.openai_api_key,
+                timeout=self.llm_timeout,
+                max_retries=0
+            )
+        return self._llm_client
+    
+    async def start(self):
+        """Démarre les tâches de fond du coach"""
+        await self.users.start()
+        await self.conversation_log.start()
+    
+    async def aclose(self):
+        """Écrit les données en attente et ferme le client OpenAI"""
+        await self.context.stop()
+        await self.users.stop()
+        await self.conversation_log.stop()
+        if self._llm_client is not None:
+            await self._llm_client.close()
     
     async def process_message(self, user_phone: str, message: str, media_url: Optional[str] = None) -> str:
         """Traite un message utilisateur et génère une réponse de coaching"""
+        responses = await self.process_messages([
+            {"user_phone": user_phone, "message": message, "media_url": media_url}
+        ])
+        return responses[0]
+    
+    async def process_messages(self, messages: List[dict], raise_errors: bool = False) -> List[str]:
+        """Traite un lot de messages : utilisateurs chargés en une requête, conversations écrites par lots
+
+        Par défaut, un message en erreur reçoit un message d'excuse. Avec
+        raise_errors, l'erreur (base indisponible...) est propagée pour que la
+        file durable reprenne le lot ; l'excuse est réservée à la dernière
+        tentative (voir MessageWorkerPool).
+        """
+        fallback = "Désolé, j'ai rencontré un problème technique. Pouvez-vous réessayer ?"
+        responses = [fallback] * len(messages)
         try:
-            db = get_db_sync()
+            # Obtenir ou créer tous les utilisateurs du lot (cache, puis une requête) ;
+            # la connexion est rendue au pool avant les appels LLM
+            async with get_async_db() as db:
+                with STAGE_SECONDS.time(stage="user_lookup"):
+                    users = await self.users.get_many(db, {m["user_phone"] for m in messages})
+            
+            # Dernière activité : fusionnée en mémoire, écrite par lots
+            self.users.touch(users.keys())
             
-            # Obtenir ou créer l'utilisateur
-            user = self._get_or_create_user(db, user_phone)
+            # Messages d'un même utilisateur dans l'ordre, utilisateurs différents en parallèle
+            lanes = defaultdict(list)
+            for index, item in enumerate(messages):
+                lanes[item["user_phone"]].append(index)
             
-            # Mettre à jour la dernière activité
-            user.last_active = datetime.now()
-            db.commit()
+            async def run_lane(phone: str, indexes: List[int]):
+                for index in indexes:
+                    item = messages[index]
+                    try:
+                        responses[index] = await self._generate_response(users[phone], item["message"], item.get("media_url"))
+                    except Exception as e:
+                        logger.error(f"Erreur traitement message: {str(e)}")
+                        if raise_errors:
+                            raise
             
-            # Analyser le message
-            message_intent = self._analyze_message_intent(message)
+            await asyncio.gather(*(run_lane(phone, indexes) for phone, indexes in lanes.items()))
+            
+            # Sauvegarder les conversations (écriture groupée en arrière-plan)
+            for item, response in zip(messages, responses):
+                self.conversation_log.add(
+                    user_phone=item["user_phone"],
+                    message=item["message"],
+                    response=response,
+                    message_type="image" if item.get("media_url") else "text"
+                )
             
-            # Générer la réponse selon l'intention
-            if message_intent == "greeting":
-                response = self._handle_greeting(user, message)
+        except Exception as e:
+            logger.error(f"Erreur traitement lot de messages: {str(e)}")
+            if raise_errors:
+                raise
+        
+        return responses
+    
+    async def _generate_response(self, user: UserProfile, message: str, media_url: Optional[str] = None) -> str:
+        """Génère la réponse selon l'intention du message"""
+        # Une photo est toujours traitée comme une facture, quelle que soit sa légende
+        message_intent = "invoice_image" if media_url else self._analyze_message_intent(message)
+        
+        with HANDLER_SECONDS.time(handler=message_intent):
+            if message_intent == "invoice_image":
+                return await self._handle_invoice_image(user, message, media_url)
+            elif message_intent == "greeting":
+                return self._handle_greeting(user, message)
+            elif message_intent == "invoice_summary":
+                return await self._handle_invoice_summary(user, message)
             elif message_intent == "invoice_help":
-                response = self._handle_invoice_help(user, message)
+                return await self._handle_invoice_help(user, message)
             elif message_intent == "payment_reminder":
-                response = self._handle_payment_reminder(user, message)
+                return self._handle_payment_reminder(user, message)
             elif message_intent == "business_advice":
-                response = self._handle_business_advice(user, message)
-            elif media_url:
-                response = await self._handle_invoice_image(user, message, media_url)
+                return self._handle_business_advice(user, message)
             else:
-                response = self._handle_general_question(user, message)
-            
-            # Sauvegarder la conversation
-            conversation = Conversation(
-                user_phone=user_phone,
-                message=message,
-                response=response,
-                message_type="image" if media_url else "text"
-            )
-            db.add(conversation)
-            db.commit()
-            db.close()
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"Erreur traitement message: {str(e)}")
-            return "Désolé, j'ai rencontré un problème technique. Pouvez-vous réessayer ?"
-    
-    def _get_or_create_user(self, db, phone: str) -> User:
-        """Obtient ou crée un utilisateur"""
-        user = db.query(User).filter(User.phone == phone).first()
-        if not user:
-            user = User(phone=phone, business_type="unknown")
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        return user
+                return self._handle_general_question(user, message)
     
     def _analyze_message_intent(self, message: str) -> str:
         """Analyse l'intention du message"""
-        message_lower = message.lower()
-        
-        greeting_patterns = ["salut", "bonjour", "bonsoir", "hello", "coucou", "hey"]
-        invoice_patterns = ["facture", "devis", "facturation", "client", "paiement", "relance"]
-        reminder_patterns = ["rappel", "relance", "retard", "impayé", "relancer"]
-        advice_patterns = ["conseil", "aide", "comment", "que faire", "stratégie"]
-        
-        if any(pattern in message_lower for pattern in greeting_patterns):
-            return "greeting"
-        elif any(pattern in message_lower for pattern in reminder_patterns):
-            return "payment_reminder"
-        elif any(pattern in message_lower for pattern in invoice_patterns):
-            return "invoice_help"
-        elif any(pattern in message_lower for pattern in advice_patterns):
-            return "business_advice"
-        else:
-            return "general"
+        with STAGE_SECONDS.time(stage="intent"):
+            return self.intent_classifier.classify(message)
     
-    def _handle_greeting(self, user: User, message: str) -> str:
+    def _handle_greeting(self, user: UserProfile, message: str) -> str:
         """Gère les messages de salutation"""
         current_hour = datetime.now().hour
         
@@ -123,39 +206,134 @@ Pour commencer, dis-moi ton prénom et ton activité (ex: "Je m'appelle Marie, j
 
 Comment puis-je t'aider aujourd'hui ?
 • Envoie-moi une photo de facture pour l'analyser
+• Demande-moi ton récap : ce qu'on te doit, ce qui est en retard
 • Pose-moi une question sur la facturation
 • Demande-moi des conseils de relance
 
 Que veux-tu faire ?"""
     
-    def _handle_invoice_help(self, user: User, message: str) -> str:
+    async def _complete(self, prompt: str, max_tokens: int = 300) -> str:
+        """Appel LLM asynchrone, limité en concurrence et borné par le délai du garde (attente incluse)
+
+        Lève CircuitOpen sans appeler OpenAI quand le disjoncteur est ouvert,
+        QueueTimeout si aucune place d'appel ne s'est libérée à temps.
+        """
+        async def call():
+            # Place obtenue par le garde (llm_slots) : seul l'appel compte pour le disjoncteur
+            self.llm_in_flight += 1
+            try:
+                return await self._llm().chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    temperature=0.7
+                )
+            finally:
+                self.llm_in_flight -= 1
+        
+        outcome = "error"
+        started = time.perf_counter()
+        try:
+            response = await self.llm_guard.run(call, slots=self._llm_slots)
+            outcome = "ok"
+        except CircuitOpen:
+            outcome = "rejected"
+            raise
+        except QueueTimeout:
+            outcome = "queue_timeout"
+            raise
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        finally:
+            if outcome != "rejected":
+                LLM_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+        return response.choices[0].message.content.strip()
+    
+    async def _summarize_exchanges(self, previous_summary: str, exchanges: List[dict]) -> str:
+        """Intègre des échanges au résumé glissant d'un utilisateur"""
+        history = "\n".join(f"- Utilisateur: {e['message']}\n  Coach: {e['response'][:300]}" for e in exchanges)
+        prompt = f"""Mets à jour le résumé d'une conversation entre un entrepreneur et son coach facturation.
+
+Résumé actuel:
+{previous_summary or '(aucun)'}
+
+Nouveaux échanges:
+{history}
+
+Écris le nouveau résumé en maximum 120 mots : activité, clients, factures et problèmes évoqués, conseils déjà donnés.
+"""
+        return await self._complete(prompt, max_tokens=200)
+    
+    async def _handle_invoice_help(self, user: UserProfile, message: str) -> str:
         """Gère les questions sur la facturation"""
-        prompt = f"""Tu es un expert-comptable bienveillant qui conseille un entrepreneur.
+        try:
+            if not self.openai_api_key:
+                return self._get_default_invoice_advice()
+            
+            # Historique seulement pour une question qui y renvoie : sinon réponse
+            # générique, servie par le cache même à un utilisateur connu.
+            # Disjoncteur ouvert : pas d'historique à construire, seul le cache peut encore répondre
+            history = None
+            if self.llm_guard.available() and depends_on_history(message):
+                history = await self.context.build(user.phone)
+            prompt = f"""Tu es un expert-comptable bienveillant qui conseille un entrepreneur.
 
 Contexte utilisateur:
 - Activité: {user.business_type or 'indépendant'}
 - Message: "{message}"
-
+"""
+            if history:
+                prompt += f"""
+Historique de la conversation:
+{history}
+"""
+            prompt += """
 Donne un conseil pratique et actionnable sur la facturation en maximum 200 mots.
 Sois chaleureux, professionnel et donne des exemples concrets.
 """
-        
-        try:
-            if self.openai_api_key:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=300,
-                    temperature=0.7
-                )
-                return response.choices[0].message.content.strip()
-            else:
-                return self._get_default_invoice_advice()
+            if history:
+                # Réponse propre à l'historique : pas de cache partagé
+                return await self._complete(prompt)
+            cache_key = ResponseCache.make_key(message, user.business_type)
+            return await self.advice_cache.get_or_compute(cache_key, lambda: self._complete(prompt))
+        except CircuitOpen:
+            return self._get_default_invoice_advice()
+        except QueueTimeout:
+            logger.warning(f"Appels OpenAI saturés, conseil par défaut ({self.llm_max_concurrency} places)")
+            return self._get_default_invoice_advice()
+        except asyncio.TimeoutError:
+            logger.error(f"Délai OpenAI dépassé ({self.llm_guard.deadline}s)")
+            return self._get_default_invoice_advice()
         except Exception as e:
             logger.error(f"Erreur OpenAI: {str(e)}")
             return self._get_default_invoice_advice()
     
-    def _handle_payment_reminder(self, user: User, message: str) -> str:
+    async def _handle_invoice_summary(self, user: UserProfile, message: str) -> str:
+        """Gère les questions "combien on me doit / qu'est-ce qui est en retard" (une ligne lue)"""
+        summary = await get_summary(user.phone)
+        if summary is None or not summary["invoice_count"]:
+            return """📊 Je n'ai encore aucune facture enregistrée pour toi.
+
+Envoie-moi une photo de ta prochaine facture et je t'aiderai à suivre son paiement ! 📸"""
+        
+        lines = [
+            "📊 **Ton point facturation :**",
+            f"• À encaisser : {summary['outstanding_amount']:.2f} € ({summary['outstanding_count']} facture(s))",
+        ]
+        if summary["overdue_count"]:
+            lines.append(f"• ⏰ En retard : {summary['overdue_amount']:.2f} € ({summary['overdue_count']} facture(s))")
+        else:
+            lines.append("• ✅ Aucune facture en retard")
+        if summary["next_due_date"]:
+            lines.append(f"• Prochaine échéance : {summary['next_due_date'].strftime('%d/%m/%Y')}")
+        if summary["draft_count"]:
+            lines.append(f"• 📝 Brouillons à compléter : {summary['draft_count']}")
+        if summary["overdue_count"]:
+            lines.append("\n💡 Demande-moi une stratégie de relance pour tes factures en retard !")
+        return "\n".join(lines)
+    
+    def _handle_payment_reminder(self, user: UserProfile, message: str) -> str:
         """Gère les questions sur les relances"""
         return """💪 Voici ma stratégie de relance efficace :
 
@@ -172,7 +350,7 @@ Sois chaleureux, professionnel et donne des exemples concrets.
 
 Veux-tu que je t'aide à rédiger une relance spécifique ?"""
     
-    def _handle_business_advice(self, user: User, message: str) -> str:
+    def _handle_business_advice(self, user: UserProfile, message: str) -> str:
         """Gère les demandes de conseils business"""
         conseils = [
             "💰 Fixe toujours un acompte de 30-50% avant de commencer",
@@ -192,8 +370,30 @@ Veux-tu que je t'aide à rédiger une relance spécifique ?"""
 
 Dis-moi en quelques mots et je te donnerai des conseils personnalisés !"""
     
-    async def _handle_invoice_image(self, user: User, message: str, media_url: str) -> str:
+    async def _handle_invoice_image(self, user: UserProfile, message: str, media_url: str) -> str:
         """Gère l'analyse d'images de factures"""
+        if self.media is not None:
+            try:
+                result = await self.media.ingest(user.phone, media_url)
+            except MediaTooLarge:
+                return "📸 Ton image est trop lourde pour être analysée. Peux-tu l'envoyer en qualité standard ?"
+            except Exception as e:
+                logger.error(f"Erreur réception média {media_url}: {str(e)}")
+                return "📸 Je n'ai pas réussi à récupérer ton image. Peux-tu la renvoyer ?"
+            
+            if result.duplicate:
+                return f"""📸 Tu m'as déjà envoyé cette facture (enregistrée sous le n°{result.invoice_id}) 👍
+
+Dis-moi si quelque chose a changé : montant, échéance, paiement reçu ?"""
+            return f"""📸 Facture bien reçue et enregistrée (brouillon n°{result.invoice_id}) !
+
+Pour suivre son paiement, peux-tu me dire :
+• Le montant de cette facture ?
+• La date d'échéance ?
+• Le nom du client ?
+
+Je pourrai t'aider à planifier tes relances ! 👍"""
+        
         return """📸 J'ai bien reçu ton image !
 
 🔄 **Analyse en cours...** (fonctionnalité bientôt disponible)
@@ -205,7 +405,7 @@ En attendant, peux-tu me dire :
 
 Je pourrai t'aider à planifier tes relances ! 👍"""
     
-    def _handle_general_question(self, user: User, message: str) -> str:
+    def _handle_general_question(self, user: UserProfile, message: str) -> str:
         """Gère les questions générales"""
         return """🤔 Je suis spécialisé dans la facturation et la gestion commerciale.
 
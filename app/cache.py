@@ -0,0 +1,159 @@
+# =====================================
+# app/cache.py
+# =====================================
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """Normalise un message pour la comparaison (casse, accents, ponctuation, espaces)"""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+class LRUCache:
+    """Cache LRU borné avec expiration (TTL)"""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+class ResponseCache(LRUCache):
+    """Cache de réponses avec dédoublonnage des appels simultanés
+
+    Plusieurs demandes identiques en parallèle partagent un seul calcul amont
+    (singleflight). Les erreurs ne sont jamais mises en cache. Un second
+    niveau partagé (`shared`, objet async get/set) est consulté avant tout
+    calcul : les autres processus profitent des réponses déjà obtenues.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 3600, shared=None):
+        super().__init__(max_size, ttl)
+        self.shared = shared
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        self._compute_count = 0
+        self._compute_seconds = 0.0
+
+    @staticmethod
+    def make_key(message: str, business_type: Optional[str]) -> str:
+        """Clé de cache : message normalisé + type d'activité"""
+        return f"{normalize_text(business_type or '')}|{normalize_text(message)}"
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """Retourne la valeur en cache ou la calcule une seule fois pour tous les demandeurs"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._compute(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # shield : l'annulation d'un demandeur n'annule pas l'appel partagé
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        if self.shared is not None:
+            try:
+                value = await self.shared.get(key)
+            except Exception as e:
+                logger.warning("Cache partagé indisponible: %s", e)
+                value = None
+            if value is not None:
+                self.shared_hits += 1
+                self.set(key, value)
+                return value
+
+        started = time.monotonic()
+        value = await compute()
+        self._compute_count += 1
+        self._compute_seconds += time.monotonic() - started
+        self.set(key, value)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                logger.warning("Écriture du cache partagé impossible: %s", e)
+        return value
+
+    def stats(self) -> dict:
+        """Compteurs d'efficacité du cache"""
+        lookups = self.hits + self.misses + self.coalesced
+        saved_calls = self.hits + self.coalesced + self.shared_hits
+        avg_compute = self._compute_seconds / self._compute_count if self._compute_count else 0.0
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions,
+            "hit_ratio": round(saved_calls / lookups, 4) if lookups else 0.0,
+            "avg_upstream_seconds": round(avg_compute, 4),
+            "estimated_seconds_saved": round(saved_calls * avg_compute, 2),
+        }
+
+class RecentIdSet:
+    """Ensemble borné des derniers identifiants vus (les plus anciens sont oubliés)"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, item_id: str):
+        self._ids[item_id] = None
+        self._ids.move_to_end(item_id)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
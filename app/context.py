@@ -0,0 +1,192 @@
+# =====================================
+# app/context.py
+# =====================================
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Set
+from sqlalchemy import select, update
+from .cache import normalize_text
+from .database import get_async_db, insert_ignore_conflicts
+from .models import Conversation, ConversationSummary
+
+logger = logging.getLogger(__name__)
+
+# Mots et tournures d'une question qui renvoie à la conversation (reprise,
+# pronom de rappel, relance d'une réponse précédente), sur le texte normalisé
+FOLLOW_UP_WORDS = {
+    "ca", "cela", "ceci", "celle", "celui", "celles", "ceux", "lui", "eux", "leur",
+    "aussi", "encore", "pareil", "idem", "sinon", "alors", "donc", "precedent",
+    "precedente", "dernier", "derniere", "suite", "pourquoi", "exemple",
+}
+FOLLOW_UP_OPENERS = ("et ", "mais ", "ok ", "oui ", "non ", "d accord ", "du coup ", "dans ce cas ")
+FOLLOW_UP_PHRASES = (
+    " tu m as dit ", " tu disais ", " comme tu ", " ta reponse ", " ton conseil ", " ton message ",
+    " tout a l heure ", " plus haut ", " la meme ", " le meme ", " les memes ", " cette facture ",
+    " ce client ", " cette cliente ", " ce devis ",
+)
+
+def depends_on_history(message: str) -> bool:
+    """La question renvoie-t-elle aux échanges précédents ?
+
+    Sinon, la réponse générique (prompt sans historique) convient et peut
+    être servie par le cache des conseils, même à un utilisateur connu.
+    Une question très courte ("et pour un artisan ?", "pourquoi ?") est
+    considérée comme une suite.
+    """
+    text = normalize_text(message)
+    words = text.split()
+    if len(words) <= 2:
+        return True
+    padded = f" {text} "
+    return (
+        not FOLLOW_UP_WORDS.isdisjoint(words)
+        or (text + " ").startswith(FOLLOW_UP_OPENERS)
+        or any(phrase in padded for phrase in FOLLOW_UP_PHRASES)
+    )
+
+def estimate_tokens(text: str) -> int:
+    """Estimation grossière du nombre de tokens (~4 caractères par token en français)"""
+    return len(text) // 4 + 1
+
+def _clip(text: Optional[str], max_chars: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+class ConversationContextBuilder:
+    """Contexte de conversation borné pour les prompts LLM
+
+    Le prompt reçoit le résumé glissant de l'utilisateur puis ses derniers
+    échanges non résumés, lus en une requête bornée sur l'index
+    (user_phone, created_at) et complétés par les échanges encore en tampon.
+    Le tout tient dans CONTEXT_TOKEN_BUDGET tokens : les échanges les plus
+    anciens sont retirés en premier.
+
+    Dès que summary_batch échanges sortent de la fenêtre, ils sont intégrés
+    au résumé en tâche de fond (hors du chemin de réponse). Le coût d'un
+    prompt ne dépend donc pas de l'ancienneté de l'utilisateur.
+    """
+
+    def __init__(self, conversation_log, summarize: Optional[Callable[[str, List[dict]], Awaitable[str]]] = None):
+        self.conversation_log = conversation_log
+        self.summarize = summarize
+        self.history_exchanges = int(os.getenv("CONTEXT_HISTORY_EXCHANGES", "6"))
+        self.summary_batch = int(os.getenv("CONTEXT_SUMMARY_BATCH", "4"))
+        self.token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+        self.exchange_max_chars = int(os.getenv("CONTEXT_EXCHANGE_MAX_CHARS", "400"))
+        self.summary_max_chars = int(os.getenv("CONTEXT_SUMMARY_MAX_CHARS", "1200"))
+        self._folding: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def stop(self):
+        """Attend la fin des mises à jour de résumé en cours"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def build(self, user_phone: str) -> str:
+        """Retourne le contexte à insérer dans le prompt ("" pour un nouvel utilisateur)"""
+        async with get_async_db() as db:
+            summary = (await db.execute(
+                select(ConversationSummary.summary, ConversationSummary.summarized_until, ConversationSummary.exchange_count)
+                .where(ConversationSummary.user_phone == user_phone)
+            )).first()
+            conditions = [Conversation.user_phone == user_phone]
+            if summary is not None and summary.summarized_until is not None:
+                conditions.append(Conversation.created_at > summary.summarized_until)
+            # Fenêtre + un lot : assez pour savoir s'il faut résumer, jamais plus
+            rows = (await db.execute(
+                select(Conversation.message, Conversation.response, Conversation.created_at)
+                .where(*conditions)
+                .order_by(Conversation.created_at.desc())
+                .limit(self.history_exchanges + self.summary_batch)
+            )).all()
+
+        exchanges = [row._asdict() for row in reversed(rows)]
+        if len(rows) == self.history_exchanges + self.summary_batch:
+            self._schedule_fold(user_phone, exchanges[:self.summary_batch], summary)
+            exchanges = exchanges[self.summary_batch:]
+        exchanges += self.conversation_log.pending_for(user_phone)
+        return self._render(summary.summary if summary is not None else "", exchanges)
+
+    def _render(self, summary: str, exchanges: List[dict]) -> str:
+        budget = self.token_budget
+        parts = []
+        if summary:
+            # Le résumé prend au plus la moitié du budget
+            summary = _clip(summary, max(0, budget // 2) * 4)
+            parts.append(f"Résumé des échanges précédents :\n{summary}")
+            budget -= estimate_tokens(parts[0])
+
+        lines = []
+        for exchange in reversed(exchanges):
+            line = (
+                f"Utilisateur : {_clip(exchange['message'], self.exchange_max_chars)}\n"
+                f"Coach : {_clip(exchange['response'], self.exchange_max_chars)}"
+            )
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            budget -= cost
+            lines.append(line)
+        if lines:
+            parts.append("Derniers échanges :\n" + "\n".join(reversed(lines)))
+        return "\n\n".join(parts)
+
+    # ---------- Résumé glissant ----------
+
+    def _schedule_fold(self, user_phone: str, exchanges: List[dict], summary):
+        if user_phone in self._folding:
+            return
+        self._folding.add(user_phone)
+        task = asyncio.create_task(self._fold(user_phone, exchanges, summary))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, user_phone: str, exchanges: List[dict], summary):
+        try:
+            previous = summary.summary if summary is not None else ""
+            text = None
+            if self.summarize is not None:
+                try:
+                    text = await self.summarize(previous, exchanges)
+                except Exception as e:
+                    logger.error(f"Erreur résumé LLM, résumé extractif utilisé: {str(e)}")
+            if not text:
+                text = self._extractive_summary(previous, exchanges)
+            await self._store(user_phone, text, exchanges, summary)
+        except Exception as e:
+            logger.error(f"Erreur mise à jour du résumé de conversation: {str(e)}")
+        finally:
+            self._folding.discard(user_phone)
+
+    def _extractive_summary(self, previous: str, exchanges: List[dict]) -> str:
+        """Résumé sans LLM : questions de l'utilisateur, les plus anciennes tronquées en premier"""
+        asked = "; ".join(_clip(exchange["message"], 160) for exchange in exchanges if exchange["message"])
+        text = f"{previous}\n{asked}".strip() if previous else asked
+        return text[-self.summary_max_chars:]
+
+    async def _store(self, user_phone: str, text: str, exchanges: List[dict], summary):
+        previous_until = summary.summarized_until if summary is not None else None
+        count = (summary.exchange_count or 0) if summary is not None else 0
+        async with get_async_db() as db:
+            if summary is None:
+                await db.execute(
+                    insert_ignore_conflicts(ConversationSummary, ["user_phone"]),
+                    [{"user_phone": user_phone, "summary": "", "exchange_count": 0}]
+                )
+            # Écriture conditionnelle : un résumé avancé entre-temps par un autre worker est conservé
+            await db.execute(
+                update(ConversationSummary)
+                .where(
+                    ConversationSummary.user_phone == user_phone,
+                    ConversationSummary.summarized_until == previous_until if previous_until is not None
+                    else ConversationSummary.summarized_until.is_(None)
+                )
+                .values(
+                    summary=text[:self.summary_max_chars],
+                    summarized_until=exchanges[-1]["created_at"],
+                    exchange_count=count + len(exchanges)
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
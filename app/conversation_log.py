@@ -0,0 +1,110 @@
+# =====================================
+# app/conversation_log.py
+# =====================================
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import insert
+from .database import get_async_db
+from .models import Conversation
+
+logger = logging.getLogger(__name__)
+
+class ConversationLogWriter:
+    """Historique des conversations écrit par lots, hors du chemin de réponse
+
+    Les échanges sont mis en tampon puis insérés en une seule requête dès que
+    flush_rows lignes sont en attente ou toutes les flush_interval_ms millisecondes.
+    Le tampon est vidé à l'arrêt.
+    """
+
+    def __init__(self):
+        self.flush_rows = int(os.getenv("CONVERSATION_FLUSH_ROWS", "100"))
+        self.flush_interval = float(os.getenv("CONVERSATION_FLUSH_INTERVAL_MS", "500")) / 1000
+        self.max_buffered = int(os.getenv("CONVERSATION_BUFFER_MAX", "10000"))
+        self._buffer: List[dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.dropped = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Nombre d'échanges en attente d'écriture"""
+        return len(self._buffer)
+
+    async def start(self):
+        """Démarre l'écriture périodique"""
+        if self._task is None:
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Arrête l'écriture périodique et vide le tampon
+
+        La boucle n'est pas annulée : une écriture en cours se termine, puis
+        les échanges arrivés entre-temps sont écrits.
+        """
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def add(self, user_phone: str, message: str, response: str, message_type: str = "text"):
+        """Met un échange en attente d'écriture"""
+        self._buffer.append({
+            "user_phone": user_phone,
+            "message": message,
+            "response": response,
+            "message_type": message_type,
+            "created_at": datetime.now(),
+        })
+        if len(self._buffer) > self.max_buffered:
+            # Base indisponible trop longtemps : on sacrifie les plus anciens
+            overflow = len(self._buffer) - self.max_buffered
+            del self._buffer[:overflow]
+            self.dropped += overflow
+            logger.error(f"Tampon des conversations plein, {overflow} échanges perdus")
+        if len(self._buffer) >= self.flush_rows and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending_for(self, user_phone: str) -> List[dict]:
+        """Échanges d'un utilisateur pas encore écrits en base (ordre chronologique)"""
+        return [row for row in self._buffer if row["user_phone"] == user_phone]
+
+    async def flush(self) -> int:
+        """Insère tout le tampon en une requête"""
+        if not self._buffer:
+            return 0
+        rows, self._buffer = self._buffer, []
+        try:
+            await self._insert(rows)
+            return len(rows)
+        except Exception as e:
+            # Remis en tête du tampon pour le prochain essai
+            self._buffer[:0] = rows
+            logger.error(f"Erreur écriture de {len(rows)} conversations: {str(e)}")
+            return 0
+        except BaseException:
+            # Annulation pendant l'écriture : rien n'est perdu, l'appelant décide
+            self._buffer[:0] = rows
+            raise
+
+    async def _insert(self, rows: List[dict]):
+        async with get_async_db() as db:
+            await db.execute(insert(Conversation), rows)
+            await db.commit()
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
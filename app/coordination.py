@@ -0,0 +1,242 @@
+# =====================================
+# app/coordination.py
+# =====================================
+import os
+import math
+import time
+import uuid
+import zlib
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, FrozenSet, Iterable, List, Optional, Set
+from sqlalchemy import delete, func, or_, select, update
+from .database import get_async_db, insert_ignore_conflicts
+from .models import Lease, SharedCacheEntry
+
+logger = logging.getLogger(__name__)
+
+def shard_key(phone: str) -> int:
+    """Empreinte stable d'un numéro, identique dans tous les processus"""
+    return zlib.crc32((phone or "").encode()) & 0x7FFFFFFF
+
+class LeaseStore:
+    """Baux expirants en base : un nom n'a qu'un détenteur à la fois"""
+
+    def __init__(self, holder: str):
+        self.holder = holder
+
+    async def acquire(self, names: Iterable[str], ttl: float) -> Set[str]:
+        """Prend (libre ou expiré) ou renouvelle (déjà détenu) des baux ; retourne ceux obtenus"""
+        names = list(names)
+        if not names:
+            return set()
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl)
+        async with get_async_db() as db:
+            await db.execute(
+                insert_ignore_conflicts(Lease, ["name"]),
+                [{"name": name, "holder": self.holder, "expires_at": expires_at} for name in names]
+            )
+            # Condition réévaluée sur la ligne verrouillée : un seul gagnant par bail
+            await db.execute(
+                update(Lease)
+                .where(Lease.name.in_(names), or_(Lease.holder == self.holder, Lease.expires_at < now))
+                .values(holder=self.holder, expires_at=expires_at)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            held = (await db.execute(
+                select(Lease.name).where(Lease.name.in_(names), Lease.holder == self.holder)
+            )).scalars().all()
+        return set(held)
+
+    async def release(self, names: Optional[Iterable[str]] = None):
+        """Rend des baux (tous ceux du processus si names est None)"""
+        query = delete(Lease).where(Lease.holder == self.holder)
+        if names is not None:
+            query = query.where(Lease.name.in_(list(names)))
+        async with get_async_db() as db:
+            await db.execute(query)
+            await db.commit()
+
+    async def held_by_others(self, prefix: str) -> Set[str]:
+        """Baux encore valides détenus par d'autres processus"""
+        async with get_async_db() as db:
+            rows = await db.execute(
+                select(Lease.name).where(
+                    Lease.name.like(f"{prefix}%"),
+                    Lease.holder != self.holder,
+                    Lease.expires_at >= datetime.now()
+                )
+            )
+            return set(rows.scalars().all())
+
+    async def count_live(self, prefix: str) -> int:
+        async with get_async_db() as db:
+            return (await db.execute(
+                select(func.count()).select_from(Lease).where(Lease.name.like(f"{prefix}%"), Lease.expires_at >= datetime.now())
+            )).scalar() or 0
+
+class Coordinator:
+    """Répartition du travail entre processus (gunicorn -w N, plusieurs conteneurs)
+
+    Chaque processus signale sa présence par un bail member:<id> et détient
+    une part égale des WORKER_SHARDS partitions d'utilisateurs (baux
+    shard:<n>). Les messages d'un utilisateur ne sont réservés que par le
+    détenteur de sa partition : ordre de traitement, profil en cache et
+    contexte de conversation restent cohérents sans verrou par message.
+    Une partition cédée lors d'un rééquilibrage n'est plus réservée tout de
+    suite, mais son bail n'est rendu qu'une fois ses messages en cours
+    terminés. Le bail leader désigne le seul processus qui exécute les
+    tâches périodiques (relances, purge).
+    """
+
+    def __init__(self):
+        self.shards = int(os.getenv("WORKER_SHARDS", "32"))
+        self.ttl = float(os.getenv("LEASE_TTL", "30"))
+        self.renew_interval = float(os.getenv("LEASE_RENEW_INTERVAL", str(self.ttl / 3)))
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.leases = LeaseStore(self.process_id)
+
+        self.owned: FrozenSet[int] = frozenset()
+        self.members = 1
+        self.is_leader = False
+        self._draining: Set[int] = set()
+        self._renewed_at = 0.0
+        self._busy_sources: List[Callable[[], Set[int]]] = []
+        self._listeners: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def shard_of(self, phone: str) -> int:
+        return shard_key(phone) % self.shards
+
+    def add_busy_source(self, source: Callable[[], Set[int]]):
+        """Fonction retournant les partitions ayant encore des messages en cours dans ce processus"""
+        self._busy_sources.append(source)
+
+    def on_change(self, callback: Callable[[], None]):
+        """Appelé quand les partitions détenues ou le rôle de leader changent"""
+        self._listeners.append(callback)
+
+    async def start(self):
+        """Obtient une première part des partitions puis renouvelle les baux en tâche de fond"""
+        if self._task is not None:
+            return
+        try:
+            await self.rebalance()
+        except Exception as e:
+            logger.error("Obtention des baux impossible au démarrage: %s", e)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Rend tous les baux : les autres processus reprennent les partitions sans attendre l'expiration"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._update(frozenset(), set(), False)
+        try:
+            await self.leases.release()
+        except Exception as e:
+            logger.warning("Libération des baux impossible (expiration dans %.0fs): %s", self.ttl, e)
+
+    def status(self) -> dict:
+        return {
+            "process_id": self.process_id,
+            "members": self.members,
+            "leader": self.is_leader,
+            "shards_owned": len(self.owned),
+            "shards_draining": len(self._draining),
+            "shards_total": self.shards,
+        }
+
+    async def _loop(self):
+        while True:
+            # Part incomplète (démarrage, autre processus arrêté) : on retente vite
+            target = math.ceil(self.shards / self.members)
+            await asyncio.sleep(self.renew_interval if len(self.owned) + len(self._draining) >= target else min(1.0, self.renew_interval))
+            try:
+                await self.rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Renouvellement des baux impossible: %s", e)
+                if time.monotonic() - self._renewed_at > self.ttl - self.renew_interval:
+                    # Baux sur le point d'expirer : un autre processus peut les prendre
+                    self._update(frozenset(), set(), False)
+
+    async def rebalance(self):
+        """Renouvelle les baux détenus et ajuste la part de partitions au nombre de processus vivants"""
+        await self.leases.acquire([f"member:{self.process_id}"], self.ttl)
+        self.members = max(1, await self.leases.count_live("member:"))
+        target = math.ceil(self.shards / self.members)
+
+        held = set(self.owned) | self._draining
+        kept = {int(name.split(":")[1]) for name in await self.leases.acquire((f"shard:{s}" for s in held), self.ttl)}
+        owned = kept - self._draining
+        draining = kept & self._draining
+
+        # Trop de partitions : les dernières ne sont plus réservées, rendues une fois vides
+        while len(owned) > target:
+            shard = max(owned)
+            owned.discard(shard)
+            draining.add(shard)
+        busy = set().union(*(source() for source in self._busy_sources))
+        idle = {shard for shard in draining if shard not in busy}
+        if idle:
+            await self.leases.release(f"shard:{shard}" for shard in idle)
+            draining -= idle
+
+        missing = target - len(owned) - len(draining)
+        if missing > 0:
+            taken = await self.leases.held_by_others("shard:")
+            free = [s for s in range(self.shards) if f"shard:{s}" not in taken and s not in kept]
+            if free:
+                acquired = await self.leases.acquire((f"shard:{s}" for s in free[:missing]), self.ttl)
+                owned |= {int(name.split(":")[1]) for name in acquired}
+
+        is_leader = bool(await self.leases.acquire(["leader"], self.ttl))
+        self._renewed_at = time.monotonic()
+        self._update(frozenset(owned), draining, is_leader)
+        if is_leader:
+            await self._purge()
+
+    def _update(self, owned: FrozenSet[int], draining: Set[int], is_leader: bool):
+        changed = owned != self.owned or is_leader != self.is_leader
+        self.owned, self._draining, self.is_leader = owned, draining, is_leader
+        if not changed:
+            return
+        logger.info(
+            "Partitions détenues : %d/%d (%d processus)%s",
+            len(owned), self.shards, self.members, ", leader" if is_leader else ""
+        )
+        for callback in self._listeners:
+            callback()
+
+    async def _purge(self):
+        """Leader : supprime les baux morts et les réponses partagées expirées"""
+        now = datetime.now()
+        async with get_async_db() as db:
+            await db.execute(delete(Lease).where(Lease.expires_at < now - timedelta(seconds=self.ttl)))
+            await db.execute(delete(SharedCacheEntry).where(SharedCacheEntry.expires_at < now))
+            await db.commit()
+
+class SharedCacheStore:
+    """Second niveau du cache de réponses, en base : commun à tous les processus"""
+
+    async def get(self, key: str) -> Optional[str]:
+        async with get_async_db() as db:
+            return (await db.execute(
+                select(SharedCacheEntry.value).where(SharedCacheEntry.key == key, SharedCacheEntry.expires_at >= datetime.now())
+            )).scalar()
+
+    async def set(self, key: str, value: str, ttl: float):
+        async with get_async_db() as db:
+            await db.execute(delete(SharedCacheEntry).where(SharedCacheEntry.key == key))
+            await db.execute(
+                insert_ignore_conflicts(SharedCacheEntry, ["key"]),
+                [{"key": key, "value": value, "expires_at": datetime.now() + timedelta(seconds=ttl)}]
+            )
+            await db.commit()
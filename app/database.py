@@ -1,68 +1,365 @@
 # =====================================
 # app/database.py
 # =====================================
-from sqlalchemy import create_engine
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .models import Base
+from .metrics import DB_COMMIT_SECONDS
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+logger = logging.getLogger(__name__)
+
+SQLITE_FALLBACK_URL = "sqlite:///./facturation_coach.db"
+
+def _resolve_database_url() -> str:
+    """URL de la base selon DATABASE_URL (SQLite local par défaut)"""
+    url = os.getenv("DATABASE_URL")
+
+    # Si pas de DATABASE_URL, utiliser SQLite local
+    if not url:
+        logger.info("Utilisation de SQLite local")
+        return SQLITE_FALLBACK_URL
+
+    logger.info("DATABASE_URL détectée: %s...", url[:50])
 
-# Si pas de DATABASE_URL, utiliser SQLite local
-if not DATABASE_URL:
-    DATABASE_URL = "sqlite:///./facturation_coach.db"
-    print("Utilisation de SQLite local")
-else:
-    print(f"DATABASE_URL détectée: {DATABASE_URL[:50]}...")
-    
     # Fix pour Railway/Render PostgreSQL URL
-    if DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-        print("URL PostgreSQL corrigée")
-    
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+        logger.info("URL PostgreSQL corrigée")
+
     # Vérification que l'URL est valide
-    if not (DATABASE_URL.startswith("postgresql://") or DATABASE_URL.startswith("sqlite://")):
-        print(f"ERREUR: URL invalide détectée: {DATABASE_URL}")
-        print("Fallback vers SQLite")
-        DATABASE_URL = "sqlite:///./facturation_coach.db"
-
-# Create engine
-try:
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    if not (url.startswith("postgresql://") or url.startswith("sqlite://")):
+        logger.error("URL invalide détectée, fallback vers SQLite")
+        return SQLITE_FALLBACK_URL
+    return url
+
+def _pool_options(url: str) -> dict:
+    """Réglages explicites du pool : taille, vérification avant usage, recyclage"""
+    if ":memory:" in url:
+        return {}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
+def _async_url(url: str) -> str:
+    """URL équivalente avec un pilote asynchrone (asyncpg / aiosqlite)"""
+    if url.startswith("postgresql://"):
+        # asyncpg attend ssl= et non sslmode=
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1).replace("sslmode=", "ssl=")
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+def _sqlite_pragmas() -> list:
+    """Profil SQLite de production (SQLITE_PROFILE=default pour garder les réglages SQLite)"""
+    if os.getenv("SQLITE_PROFILE", "production").lower() != "production":
+        return []
+    return [
+        ("journal_mode", "WAL"),  # les lecteurs ne bloquent plus l'écrivain
+        ("synchronous", os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")),  # sûr en WAL, sans fsync par commit
+        ("cache_size", -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))),
+        ("mmap_size", int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))),
+        ("busy_timeout", int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))),
+        ("temp_store", "MEMORY"),
+    ]
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Appliqué à chaque nouvelle connexion SQLite (pilotes synchrone et asynchrone)"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in _sqlite_pragmas():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def _create_engines(url: str):
+    pool_options = _pool_options(url)
+    sync_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if "sqlite" in url else {},
+        **pool_options
     )
-    print("Engine SQLAlchemy créé avec succès")
-except Exception as e:
-    print(f"Erreur création engine: {e}")
-    # Fallback SQLite
-    DATABASE_URL = "sqlite:///./facturation_coach.db"
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-    print("Fallback SQLite activé")
+    # aiosqlite utiliserait sinon NullPool (une connexion par session)
+    async_pool_options = dict(pool_options, poolclass=AsyncAdaptedQueuePool) if pool_options else {}
+    async_db_engine = create_async_engine(_async_url(url), **async_pool_options)
+    if url.startswith("sqlite"):
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+        event.listen(async_db_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return sync_engine, async_db_engine
+
+class TimedAsyncSession(AsyncSession):
+    """Session asynchrone dont chaque COMMIT est mesuré (métriques)"""
+
+    async def commit(self):
+        started = time.perf_counter()
+        try:
+            await super().commit()
+        finally:
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+# Engines et fabriques de sessions créés au premier usage (aucun effet de bord à l'import) :
+# synchrone pour init/migrations, asynchrone pour le chemin des messages
+DATABASE_URL: Optional[str] = None
+_engine = None
+_async_engine = None
+_session_factory: Optional[sessionmaker] = None
+_async_session_factory: Optional[async_sessionmaker] = None
+
+def _ensure_engines():
+    global DATABASE_URL, _engine, _async_engine, _session_factory, _async_session_factory
+    if _engine is not None:
+        return
+    url = _resolve_database_url()
+    try:
+        sync_engine, async_db_engine = _create_engines(url)
+        logger.info("Engine SQLAlchemy créé avec succès")
+    except Exception as e:
+        logger.error("Erreur création engine: %s", e)
+        # Fallback SQLite
+        url = SQLITE_FALLBACK_URL
+        sync_engine, async_db_engine = _create_engines(url)
+        logger.warning("Fallback SQLite activé")
+    DATABASE_URL = url
+    _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+    _async_session_factory = async_sessionmaker(async_db_engine, class_=TimedAsyncSession, autoflush=False, expire_on_commit=False)
+    _engine, _async_engine = sync_engine, async_db_engine
+
+def get_engine():
+    """Engine synchrone (créé au premier appel)"""
+    _ensure_engines()
+    return _engine
+
+def get_async_engine():
+    """Engine asynchrone (créé au premier appel)"""
+    _ensure_engines()
+    return _async_engine
+
+def __getattr__(name: str):
+    # Compatibilité : database.engine, database.SessionLocal... restent disponibles
+    if name in ("engine", "async_engine", "SessionLocal", "AsyncSessionLocal"):
+        _ensure_engines()
+        return {
+            "engine": _engine,
+            "async_engine": _async_engine,
+            "SessionLocal": _session_factory,
+            "AsyncSessionLocal": _async_session_factory,
+        }[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    """Ajoute une colonne si elle n'existe pas encore"""
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _migration_1(conn):
+    """File d'attente durable : réservation des messages en attente"""
+    _add_column(conn, "pending_messages", "claimed_by", "VARCHAR")
+    _add_column(conn, "pending_messages", "claimed_at", "TIMESTAMP")
+    _add_column(conn, "pending_messages", "attempts", "INTEGER DEFAULT 0")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pending_messages_claimed_by ON pending_messages (claimed_by)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pending_messages_processed_id ON pending_messages (processed, id)"))
+
+def _migration_2(conn):
+    """Idempotence : identifiant WhatsApp unique par message en attente"""
+    _add_column(conn, "pending_messages", "message_id", "VARCHAR")
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_pending_messages_message_id ON pending_messages (message_id)"))
 
-# Create session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _migration_3(conn):
+    """Index composites alignés sur les accès réels"""
+    # Historique récent d'un utilisateur
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_conversations_user_phone_created_at ON conversations (user_phone, created_at)"))
+    # Factures échues par statut (relances)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_status_due_date ON invoices (status, due_date)"))
+
+def _migration_4(conn):
+    """Relances automatiques : niveau de relance envoyé par facture"""
+    _add_column(conn, "invoices", "reminder_level", "INTEGER DEFAULT 0")
+    _add_column(conn, "invoices", "last_reminder_at", "TIMESTAMP")
+    conn.execute(text("UPDATE invoices SET reminder_level = 0 WHERE reminder_level IS NULL"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_reminder_scan ON invoices (status, reminder_level, due_date, id)"))
+
+def _migration_5(conn):
+    """Photos de factures : média WhatsApp rattaché à la facture"""
+    _add_column(conn, "invoices", "media_id", "VARCHAR")
+    _add_column(conn, "invoices", "media_sha256", "VARCHAR")
+    _add_column(conn, "invoices", "media_path", "VARCHAR")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_user_phone_media_sha256 ON invoices (user_phone, media_sha256)"))
+
+def _migration_6(conn):
+    """Déploiement multi-processus : partition des messages en attente par utilisateur"""
+    _add_column(conn, "pending_messages", "shard_key", "INTEGER")
+    from .coordination import shard_key
+    pending = conn.execute(text("SELECT id, user_phone FROM pending_messages WHERE processed = :no AND shard_key IS NULL"), {"no": False}).all()
+    for row_id, phone in pending:
+        conn.execute(text("UPDATE pending_messages SET shard_key = :key WHERE id = :id"), {"key": shard_key(phone), "id": row_id})
+
+def _migration_7(conn):
+    """Résumé de facturation par utilisateur : index et remplissage initial"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_user_phone_status_due_date ON invoices (user_phone, status, due_date)"))
+    from .summaries import rebuild_statements
+    for statement in rebuild_statements():
+        conn.execute(statement)
+
+def _migration_8(conn):
+    """Import de factures : numéros déjà enregistrés retrouvés par utilisateur"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_user_phone_invoice_number ON invoices (user_phone, invoice_number)"))
+
+# Migrations versionnées, appliquées dans l'ordre après create_all
+# (create_all ne modifie jamais une table existante)
+SCHEMA_MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+    (7, _migration_7),
+    (8, _migration_8),
+]
+
+def upgrade_schema():
+    """Applique les migrations de schéma manquantes"""
+    with get_engine().begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        current = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+        for version, migration in SCHEMA_MIGRATIONS:
+            if version <= current:
+                continue
+            migration(conn)
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+            logger.info("Migration de schéma %d appliquée", version)
+
+# Version attendue par le code
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def _inspect_schema(conn) -> dict:
+    tables = set(inspect(conn).get_table_names())
+    missing = sorted(set(Base.metadata.tables) - tables)
+    version = 0
+    if "schema_version" in tables:
+        version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    return {
+        "ok": not missing and version >= SCHEMA_VERSION,
+        "version": version,
+        "expected": SCHEMA_VERSION,
+        "missing_tables": missing,
+    }
+
+async def check_schema() -> dict:
+    """Vérifie tables et version de schéma sans aucun DDL (lecture seule)"""
+    async with get_async_engine().connect() as conn:
+        return await conn.run_sync(_inspect_schema)
+
+async def ping_db(timeout: float = 2.0) -> bool:
+    """La base répond-elle (SELECT 1) dans le délai ?"""
+    async def ping():
+        async with get_async_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    try:
+        await asyncio.wait_for(ping(), timeout=timeout)
+        return True
+    except Exception as e:
+        logger.warning("Base de données injoignable: %s", e)
+        return False
+
+def insert_ignore_conflicts(model, index_elements: list):
+    """INSERT ... ON CONFLICT DO NOTHING selon le dialecte (SQLite ou PostgreSQL)"""
+    _ensure_engines()
+    if DATABASE_URL.startswith("postgresql"):
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model).on_conflict_do_nothing(index_elements=index_elements)
 
 def init_db():
     """Initialise la base de données"""
     try:
-        Base.metadata.create_all(bind=engine)
-        print("Base de données initialisée avec succès")
+        Base.metadata.create_all(bind=get_engine())
+        upgrade_schema()
+        logger.info("Base de données initialisée avec succès")
     except Exception as e:
-        print(f"Erreur initialisation DB: {e}")
+        logger.error("Erreur initialisation DB: %s", e)
         raise
 
 def get_db() -> Session:
     """Dependency pour obtenir une session DB"""
-    db = SessionLocal()
+    _ensure_engines()
+    db = _session_factory()
     try:
         yield db
     finally:
         db.close()
 
 def get_db_sync() -> Session:
-    """Obtenir une session DB synchrone"""
-    return SessionLocal()
+    """Obtenir une session DB synchrone (à fermer par l'appelant, voir session_scope)"""
+    _ensure_engines()
+    return _session_factory()
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Session synchrone toujours fermée, annulée en cas d'erreur"""
+    _ensure_engines()
+    db = _session_factory()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Session asynchrone toujours fermée, annulée en cas d'erreur"""
+    _ensure_engines()
+    async with _async_session_factory() as db:
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            raise
+
+def pool_status() -> dict:
+    """Occupation du pool de connexions asynchrone (chemin des messages)"""
+    if _async_engine is None:
+        return {"class": None}
+    pool = _async_engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"class": type(pool).__name__}
+    capacity = pool.size() + _pool_options(DATABASE_URL).get("max_overflow", 0)
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "capacity": capacity,
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+    }
+
+async def close_db():
+    """Ferme les pools de connexions (recréés au prochain usage)"""
+    global _engine, _async_engine, _session_factory, _async_session_factory
+    if _engine is None:
+        return
+    await _async_engine.dispose()
+    _engine.dispose()
+    _engine = _async_engine = _session_factory = _async_session_factory = None
+
+if __name__ == "__main__":
+    # python -m app.database : crée les tables et applique les migrations (avant déploiement)
+    logging.basicConfig(level=logging.INFO)
+    init_db()
@@ -0,0 +1,66 @@
+# =====================================
+# app/imaging.py
+# =====================================
+# Traitements CPU des photos de factures, exécutés dans un pool de processus :
+# ce module n'importe rien de l'application (démarrage rapide des processus),
+# et Pillow n'est chargé qu'au premier traitement, dans le processus du pool.
+import os
+import shutil
+import hashlib
+from typing import Optional
+
+_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "application/pdf": ".pdf",
+}
+
+def file_sha256(path: str, chunk_size: int = 65536) -> str:
+    """Empreinte SHA-256 d'un fichier, lu par blocs"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def preprocess_image(source_path: str, storage_dir: str, max_dimension: int, mime_type: Optional[str] = None) -> dict:
+    """Empreinte, décodage et réduction d'une image téléchargée
+
+    L'image est rangée dans storage_dir sous son empreinte (une photo déjà
+    reçue n'est pas réécrite). Avec Pillow, elle est décodée à échelle
+    réduite, redressée selon l'EXIF puis réencodée en JPEG de côté
+    max_dimension au plus ; sinon le fichier d'origine est conservé tel quel.
+    """
+    sha256 = file_sha256(source_path)
+    result = {"sha256": sha256, "path": None, "width": None, "height": None, "format": None, "error": None}
+    os.makedirs(storage_dir, exist_ok=True)
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:  # Pillow absent (voir requirements.txt) : empreinte et stockage seulement
+        Image = ImageOps = None
+
+    if Image is not None:
+        try:
+            with Image.open(source_path) as image:
+                result["format"] = image.format
+                # JPEG : décodage directement à une échelle proche de la cible
+                image.draft("RGB", (max_dimension, max_dimension))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((max_dimension, max_dimension))
+                result["width"], result["height"] = image.size
+                target = os.path.join(storage_dir, f"{sha256}.jpg")
+                if not os.path.exists(target):
+                    image.convert("RGB").save(target, "JPEG", quality=85, optimize=True)
+                result["path"] = target
+                return result
+        except Exception as e:
+            # Fichier illisible par Pillow (PDF, format inconnu) : conservé brut
+            result["error"] = str(e)[:200]
+
+    target = os.path.join(storage_dir, sha256 + _EXTENSIONS.get(mime_type or "", ".bin"))
+    if not os.path.exists(target):
+        shutil.move(source_path, target)
+    result["path"] = target
+    return result
@@ -0,0 +1,354 @@
+# =====================================
+# app/imports.py
+# =====================================
+import os
+import re
+import csv
+import json
+import math
+import time
+import codecs
+import asyncio
+import logging
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import insert, select
+from .database import get_async_db
+from .models import Invoice
+from .reminders import OPEN_STATUSES, passed_reminder_level
+from .summaries import InvoiceChange, apply_invoice_changes, overdue_cutoff
+
+logger = logging.getLogger(__name__)
+
+# En-têtes acceptés (normalisés : minuscules, sans accents ni séparateurs) -> colonne
+COLUMN_ALIASES = {
+    "invoice_number": ("invoice_number", "invoice", "number", "numero", "num", "no", "facture", "numero_facture", "ref", "reference"),
+    "client_name": ("client_name", "client", "customer", "nom_client", "societe"),
+    "amount": ("amount", "montant", "total", "montant_ttc", "ttc", "total_ttc"),
+    "invoice_date": ("invoice_date", "date", "date_facture", "emission", "date_emission", "issued"),
+    "due_date": ("due_date", "due", "echeance", "date_echeance", "date_limite"),
+    "status": ("status", "statut", "etat"),
+}
+_ALIASES = {alias: column for column, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+STATUS_ALIASES = {
+    "draft": ("draft", "brouillon"),
+    "sent": ("sent", "envoyee", "envoye", "emise", "a payer", "en attente", "pending", "unpaid", "impayee", "open"),
+    "paid": ("paid", "payee", "paye", "reglee", "regle", "encaissee"),
+    "overdue": ("overdue", "en retard", "retard", "late"),
+    "cancelled": ("cancelled", "canceled", "annulee", "annule", "avoir"),
+}
+_STATUSES = {alias: status for status, aliases in STATUS_ALIASES.items() for alias in aliases}
+
+# JJ/MM/AAAA, JJ-MM-AAAA, JJ.MM.AAAA (année sur 2 chiffres tolérée) : sans strptime, trop lent à 100k lignes
+_DAY_FIRST = re.compile(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})$")
+DATE_FORMATS = ("%Y/%m/%d",)
+
+class ImportAborted(Exception):
+    """Fichier illisible : l'import s'arrête (les lots déjà validés restent enregistrés)"""
+
+def _normalize_key(value: str) -> str:
+    value = unicodedata.normalize("NFKD", (value or "").strip().lower())
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return "_".join(value.replace("-", " ").replace(".", " ").replace("°", "").split())
+
+def parse_amount(value) -> float:
+    """Montant : 1234.5, "1 234,50 €", "1,234.50", "1.234,50" """
+    if isinstance(value, bool):
+        raise ValueError("montant invalide")
+    if isinstance(value, (int, float)):
+        amount = float(value)
+    else:
+        text = str(value or "").strip()
+        for token in ("€", "EUR", "eur", " ", " ", " ", "'"):
+            text = text.replace(token, "")
+        if not text:
+            raise ValueError("montant manquant")
+        if "," in text and "." in text:
+            # Le dernier séparateur est le séparateur décimal
+            thousands = "." if text.rfind(",") > text.rfind(".") else ","
+            text = text.replace(thousands, "").replace(",", ".")
+        elif text.count(",") == 1:
+            text = text.replace(",", ".")
+        elif text.count(",") > 1 or text.count(".") > 1:
+            text = text.replace(",", "").replace(".", "") if text.count(",") > 1 else text.replace(".", "")
+        try:
+            amount = float(text)
+        except ValueError:
+            raise ValueError(f"montant invalide : {value!r}")
+    if not math.isfinite(amount):
+        raise ValueError(f"montant invalide : {value!r}")
+    return round(amount, 2)
+
+def parse_date(value) -> Optional[datetime]:
+    """Date : ISO 8601 (2024-03-31, avec ou sans heure) ou JJ/MM/AAAA, JJ-MM-AAAA, JJ.MM.AAAA"""
+    text = str(value or "").strip()
+    if not text:
+        return None
+    match = _DAY_FIRST.match(text)
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+        try:
+            return datetime(year + 2000 if year < 100 else year, month, day)
+        except ValueError:
+            raise ValueError(f"date invalide : {value!r}")
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        return parsed.replace(tzinfo=None)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"date invalide : {value!r}")
+
+def parse_status(value) -> str:
+    return _parse_status(str(value or ""))
+
+@lru_cache(maxsize=256)
+def _parse_status(value: str) -> str:
+    text = _normalize_key(value).replace("_", " ")
+    if not text:
+        return "sent"
+    status = _STATUSES.get(text)
+    if status is None:
+        raise ValueError(f"statut inconnu : {value!r}")
+    return status
+
+def normalize_row(raw: Dict[str, object]) -> dict:
+    """Valide et normalise une ligne (clés déjà ramenées aux noms de colonnes)"""
+    number = str(raw.get("invoice_number") or "").strip() or None
+    client = str(raw.get("client_name") or "").strip() or None
+    if "amount" not in raw or raw["amount"] in (None, ""):
+        raise ValueError("montant manquant")
+    row = {
+        "invoice_number": number[:100] if number else None,
+        "client_name": client[:200] if client else None,
+        "amount": parse_amount(raw["amount"]),
+        "invoice_date": parse_date(raw.get("invoice_date")),
+        "due_date": parse_date(raw.get("due_date")),
+        "status": parse_status(raw.get("status")),
+    }
+    if row["invoice_date"] and row["due_date"] and row["due_date"] < row["invoice_date"]:
+        raise ValueError("échéance antérieure à la date de facture")
+    return row
+
+class _Lines:
+    """Découpe un flux d'octets en lignes UTF-8 complètes (BOM Excel toléré)"""
+
+    def __init__(self, max_line_bytes: int):
+        self.max_line_bytes = max_line_bytes
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self._buffer = ""
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[str]:
+        self._buffer += self._decoder.decode(chunk, final=final)
+        lines = self._buffer.splitlines(keepends=True)
+        self._buffer = ""
+        if lines and not final and not lines[-1].endswith(("\n", "\r")):
+            self._buffer = lines.pop()
+            if len(self._buffer) > self.max_line_bytes:
+                raise ImportAborted(f"ligne de plus de {self.max_line_bytes} caractères")
+        return lines
+
+class InvoiceImporter:
+    """Import en flux de factures d'un utilisateur (CSV ou NDJSON)
+
+    Le corps de la requête est lu bloc par bloc : seules les lignes du lot en
+    cours sont en mémoire, quelle que soit la taille du fichier. Chaque ligne
+    est validée et normalisée (montants et dates aux formats français ou
+    ISO, statuts FR/EN) ; les lignes invalides sont rapportées avec leur
+    numéro sans interrompre l'import. Les factures valides sont insérées par
+    lots de IMPORT_CHUNK_SIZE, chaque lot validé dans sa propre transaction
+    avec la mise à jour du résumé de l'utilisateur ; le lot suivant est lu
+    et validé pendant l'écriture du précédent (au plus deux lots en mémoire).
+    Un numéro de facture déjà enregistré pour l'utilisateur est ignoré
+    (réimport sans doublon).
+    """
+
+    def __init__(self, user_phone: str, fmt: str = "csv"):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"format inconnu : {fmt}")
+        self.user_phone = user_phone
+        self.format = fmt
+        self.chunk_size = int(os.getenv("IMPORT_CHUNK_SIZE", "2000"))
+        self.max_rows = int(os.getenv("IMPORT_MAX_ROWS", "200000"))
+        self.max_errors = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+        self.max_line_bytes = int(os.getenv("IMPORT_MAX_LINE_BYTES", "65536"))
+
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self.aborted: Optional[str] = None
+
+        self._line_number = 0
+        self._columns: Optional[List[Optional[str]]] = None
+        self._delimiter = ","
+        self._record = ""
+        self._record_start = 0
+
+    def _error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": message})
+
+    # ---------- Découpage ----------
+
+    def _csv_records(self, lines: List[str]) -> Iterator[Tuple[int, str]]:
+        """Enregistrements CSV complets (un champ entre guillemets peut contenir des retours à la ligne)"""
+        for line in lines:
+            self._line_number += 1
+            if not self._record:
+                self._record_start = self._line_number
+            self._record += line
+            if self._record.count('"') % 2 == 0:
+                record, self._record = self._record, ""
+                if record.strip():
+                    yield self._record_start, record
+
+    def _set_header(self, record: str):
+        self._delimiter = ";" if record.count(";") > record.count(",") else ","
+        header = next(csv.reader([record], delimiter=self._delimiter))
+        self._columns = [_ALIASES.get(_normalize_key(name)) for name in header]
+        if "amount" not in self._columns:
+            raise ImportAborted("colonne montant absente de l'en-tête")
+
+    def _parse(self, lines: List[str]) -> Iterator[Tuple[int, Dict[str, object]]]:
+        if self.format == "ndjson":
+            for line in lines:
+                self._line_number += 1
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    self._error(self._line_number, "JSON invalide")
+                    continue
+                if not isinstance(data, dict):
+                    self._error(self._line_number, "objet JSON attendu")
+                    continue
+                yield self._line_number, {_ALIASES.get(_normalize_key(key)): value for key, value in data.items()}
+            return
+
+        records = list(self._csv_records(lines))
+        if records and self._columns is None:
+            self._set_header(records.pop(0)[1])
+        starts = [start for start, _ in records]
+        for start, values in zip(starts, csv.reader((record for _, record in records), delimiter=self._delimiter)):
+            if len(values) > len(self._columns):
+                self._error(start, f"{len(values)} colonnes au lieu de {len(self._columns)}")
+                continue
+            yield start, {column: value for column, value in zip(self._columns, values) if column}
+
+    # ---------- Import ----------
+
+    async def run(self, body: AsyncIterator[bytes]) -> dict:
+        """Lit le flux, insère les factures par lots et retourne le rapport"""
+        started = time.perf_counter()
+        lines = _Lines(self.max_line_bytes)
+        pending: List[Tuple[int, dict]] = []
+        flushing: Optional[asyncio.Task] = None
+        try:
+            try:
+                async for chunk in body:
+                    for line_number, raw in self._parse(lines.feed(chunk)):
+                        self._accept(line_number, raw, pending)
+                        if len(pending) >= self.chunk_size:
+                            # Un seul lot en écriture : le suivant voit ses numéros (doublons)
+                            if flushing is not None:
+                                await flushing
+                            flushing = asyncio.create_task(self._flush(pending))
+                            pending = []
+                for line_number, raw in self._parse(lines.feed(b"", final=True)):
+                    self._accept(line_number, raw, pending)
+                if self._record.strip():
+                    self._error(self._record_start, "guillemet non fermé")
+                if self.format == "csv" and self._columns is None:
+                    raise ImportAborted("fichier vide")
+            except ImportAborted as e:
+                self.aborted = str(e)
+            if flushing is not None:
+                flushing, task = None, flushing
+                await task
+            if pending:
+                await self._flush(pending)
+        except Exception as e:
+            logger.error("Import de factures interrompu: %s", e, extra={"phone": self.user_phone})
+            self.aborted = self.aborted or "erreur d'enregistrement, import interrompu"
+        finally:
+            # Lot en cours d'écriture (client déconnecté...) : terminé avant de rendre la main
+            if flushing is not None:
+                await asyncio.gather(flushing, return_exceptions=True)
+
+        report = {
+            "rows": self.rows,
+            "imported": self.imported,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "aborted": self.aborted,
+            "duration_ms": round((time.perf_counter() - started) * 1000),
+        }
+        logger.info(
+            "Import de factures : %d importées, %d doublons, %d erreurs en %d ms",
+            self.imported, self.duplicates, self.failed, report["duration_ms"],
+            extra={"phone": self.user_phone}
+        )
+        return report
+
+    def _accept(self, line_number: int, raw: Dict[str, object], pending: List[Tuple[int, dict]]):
+        self.rows += 1
+        if self.rows > self.max_rows:
+            raise ImportAborted(f"plus de {self.max_rows} lignes")
+        try:
+            pending.append((line_number, normalize_row(raw)))
+        except ValueError as e:
+            self._error(line_number, str(e))
+
+    async def _flush(self, pending: List[Tuple[int, dict]]):
+        """Insère un lot en une instruction et met à jour le résumé, dans une transaction"""
+        now = datetime.now()
+        today = overdue_cutoff(now)
+        async with get_async_db() as db:
+            numbers = {row["invoice_number"] for _, row in pending if row["invoice_number"]}
+            known = set()
+            if numbers:
+                known = set((await db.execute(
+                    select(Invoice.invoice_number)
+                    .where(Invoice.user_phone == self.user_phone, Invoice.invoice_number.in_(numbers))
+                )).scalars().all())
+
+            values = []
+            for line_number, row in pending:
+                if row["invoice_number"]:
+                    if row["invoice_number"] in known:
+                        self.duplicates += 1
+                        continue
+                    known.add(row["invoice_number"])
+                # Facture déjà échue : enregistrée en retard, relances déjà dépassées
+                # sautées (un import d'historique ne déclenche pas une rafale de relances)
+                status, due_date = row["status"], row["due_date"]
+                if status == "sent" and due_date is not None and due_date < today:
+                    status = "overdue"
+                values.append(dict(
+                    row,
+                    status=status,
+                    user_phone=self.user_phone,
+                    invoice_date=row["invoice_date"] or now,
+                    reminder_level=passed_reminder_level(due_date, now) if status in OPEN_STATUSES else 0
+                ))
+            if not values:
+                return
+            await db.execute(insert(Invoice.__table__), values)
+            await apply_invoice_changes(db, [
+                InvoiceChange(self.user_phone, value["amount"], value["due_date"], None, value["status"]) for value in values
+            ])
+            await db.commit()
+        self.imported += len(values)
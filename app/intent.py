@@ -0,0 +1,135 @@
+# =====================================
+# app/intent.py
+# =====================================
+import os
+import re
+import json
+import logging
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Mots-clés par intention, dans l'ordre de priorité
+DEFAULT_INTENT_PATTERNS: List[Tuple[str, List[str]]] = [
+    ("greeting", ["salut", "bonjour", "bonsoir", "hello", "coucou", "hey"]),
+    ("invoice_summary", ["récap", "résumé", "bilan", "encours", "me doit", "me doivent", "à encaisser"]),
+    ("payment_reminder", ["rappel", "relance", "retard", "impayé", "relancer"]),
+    ("invoice_help", ["facture", "devis", "facturation", "client", "paiement", "relance"]),
+    ("business_advice", ["conseil", "aide", "comment", "que faire", "stratégie"]),
+]
+
+# Formes fléchies reconnues pour les mots-clés par défaut (liste testée dans
+# tests/test_intent.py) : la correspondance par mot entier ne reconnaît que
+# les formes énumérées, là où l'ancienne recherche par sous-chaîne trouvait
+# "aidez" ou "rappelle" par hasard (et "clientèle" par erreur).
+KEYWORD_FORMS: Dict[str, Tuple[str, ...]] = {
+    "récap": ("récaps", "récapitulatif", "récapitulatifs"),
+    "résumé": ("résumés",),
+    "bilan": ("bilans",),
+    "rappel": ("rappels", "rappeler", "rappelle", "rappelles", "rappellent", "rappelez", "rappelons",
+               "rappelé", "rappelée", "rappelés", "rappelées"),
+    "relance": ("relances", "relancer", "relancez", "relançons", "relancent", "relancé", "relancée",
+                "relancés", "relancées"),
+    "relancer": (),
+    "retard": ("retards", "retardé", "retardée", "retardés", "retardées", "retardataire", "retardataires"),
+    "impayé": ("impayés", "impayée", "impayées"),
+    "facture": ("factures", "facturer", "facturez", "facturons", "facturent", "facturé", "facturée",
+                "facturés", "facturées"),
+    "facturation": ("facturations",),
+    "client": ("clients", "cliente", "clientes"),
+    "paiement": ("paiements",),
+    "conseil": ("conseils", "conseiller", "conseilles", "conseille", "conseillez", "conseillé", "conseillée"),
+    "aide": ("aides", "aider", "aidez", "aidé", "aidée", "aidant"),
+    "stratégie": ("stratégies",),
+}
+
+# Mots-clés ajoutés par INTENT_PATTERNS_FILE : forme donnée et son pluriel
+EXTRA_KEYWORD_SUFFIXES = ("", "s")
+
+# Lettres qui suivent un radical (fin du mot à comparer aux formes reconnues)
+_WORD_TAIL = re.compile(r"[^\W\d_]*")
+
+def keyword_forms(keyword: str) -> FrozenSet[str]:
+    """Formes reconnues d'un mot-clé (en minuscules)"""
+    keyword = keyword.strip().lower()
+    if keyword in KEYWORD_FORMS:
+        return frozenset((keyword,) + KEYWORD_FORMS[keyword])
+    return frozenset(keyword + suffix for suffix in EXTRA_KEYWORD_SUFFIXES)
+
+class IntentClassifier:
+    """Classifieur d'intention construit une seule fois
+
+    Chaque mot-clé est ramené au radical commun de ses formes reconnues. Un
+    message est parcouru radical par radical, dans l'ordre de priorité des
+    intentions : test de sous-chaîne (C) puis, seulement si le radical est
+    présent, vérification du mot entier. "client" ne déclenche donc plus rien
+    à l'intérieur de "clientèle", mais "clients" ou "cliente" si.
+
+    Le coût reste celui de l'ancienne fonction (autant de recherches de
+    sous-chaîne, plus la mise en minuscules qui domine sur les messages
+    longs) ; l'apport est la correspondance par mot entier. Une expression
+    régulière unique (alternance ou trie des formes) a été mesurée plus lente
+    sur les messages longs : pour garder la priorité, elle doit parcourir tout
+    le message (benchmarks/bench_intent.py).
+    """
+
+    def __init__(self, patterns: Sequence[Tuple[str, Sequence[str]]] = DEFAULT_INTENT_PATTERNS, default: str = "general"):
+        self.default = default
+        self.intents: List[str] = []
+        stems: Dict[Tuple[int, str], FrozenSet[str]] = {}
+
+        for intent, keywords in patterns:
+            if intent not in self.intents:
+                self.intents.append(intent)
+            priority = self.intents.index(intent)
+            for keyword in keywords:
+                forms = keyword_forms(keyword)
+                stem = os.path.commonprefix(sorted(forms))
+                if not stem:
+                    continue
+                stems[(priority, stem)] = stems.get((priority, stem), frozenset()) | forms
+
+        # (radical, formes, intention) dans l'ordre de priorité ; des formes
+        # déjà reconnues par une entrée précédente ne sont pas recherchées à nouveau
+        table: List[Tuple[str, FrozenSet[str], str]] = []
+        known: FrozenSet[str] = frozenset()
+        for priority, stem in sorted(stems, key=lambda key: key[0]):
+            forms = stems[(priority, stem)]
+            if forms <= known:
+                continue
+            known |= forms
+            table.append((stem, forms, self.intents[priority]))
+        self._table: Tuple[Tuple[str, FrozenSet[str], str], ...] = tuple(table)
+
+    @classmethod
+    def from_env(cls) -> "IntentClassifier":
+        """Construit le classifieur avec les mots-clés supplémentaires de INTENT_PATTERNS_FILE (JSON)"""
+        patterns = [(intent, list(keywords)) for intent, keywords in DEFAULT_INTENT_PATTERNS]
+        path = os.getenv("INTENT_PATTERNS_FILE")
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    patterns.extend(cls._parse_extra_patterns(json.load(f)))
+            except Exception as e:
+                logger.error(f"Erreur chargement des mots-clés d'intention ({path}): {str(e)}")
+        return cls(patterns)
+
+    @staticmethod
+    def _parse_extra_patterns(extra: Dict[str, List[str]]) -> List[Tuple[str, List[str]]]:
+        # {"invoice_help": ["acompte", "avoir"], ...} ; une nouvelle intention passe après les existantes
+        return [(intent, [str(keyword) for keyword in keywords]) for intent, keywords in extra.items()]
+
+    def classify(self, message: Optional[str]) -> str:
+        """Retourne l'intention la plus prioritaire dont un mot-clé apparaît en mot entier"""
+        if not message:
+            return self.default
+        text = message.lower()
+        tail = _WORD_TAIL.match
+        for stem, forms, intent in self._table:
+            if stem in text:
+                start = text.find(stem)
+                while start != -1:
+                    if (start == 0 or not text[start - 1].isalpha()) and text[start:tail(text, start + len(stem)).end()] in forms:
+                        return intent
+                    start = text.find(stem, start + 1)
+        return self.default
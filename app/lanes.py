@@ -0,0 +1,99 @@
+# =====================================
+# app/lanes.py
+# =====================================
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class KeyedLaneScheduler:
+    """Ordonnanceur à files par clé (une file FIFO par utilisateur)
+
+    Les éléments d'une même clé sont traités dans l'ordre d'arrivée, jamais
+    en parallèle ; des clés différentes sont traitées en parallèle par au
+    plus `concurrency` tâches. Une file qui a été servie repasse en fin de
+    tour (équité entre utilisateurs) et est supprimée dès qu'elle est vide :
+    la mémoire reste proportionnelle au travail en attente, pas au nombre
+    d'utilisateurs déjà vus.
+    """
+
+    def __init__(self, handler: Callable[[Hashable, List], Awaitable[None]], concurrency: int, max_batch: int = 1):
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.max_batch = max(1, max_batch)
+        self._lanes: Dict[Hashable, Deque] = {}
+        # Clés en cours de traitement ou en attente d'une tâche
+        self._scheduled: set = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending = 0
+        self._running = 0
+
+    @property
+    def pending(self) -> int:
+        """Éléments soumis et pas encore terminés"""
+        return self._pending
+
+    @property
+    def lane_count(self) -> int:
+        """Nombre de files vivantes (utilisateurs avec du travail en attente)"""
+        return len(self._lanes)
+
+    @property
+    def busy(self) -> int:
+        """Tâches occupées (au plus concurrency)"""
+        return self._running
+
+    async def start(self):
+        """Démarre les tâches de traitement"""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        for key in self._lanes:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Arrête les tâches ; les éléments non traités sont abandonnés"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._lanes.clear()
+        self._scheduled.clear()
+        self._pending = 0
+        self._running = 0
+
+    def submit(self, key: Hashable, item):
+        """Ajoute un élément à la file de sa clé"""
+        self._lanes.setdefault(key, deque()).append(item)
+        self._pending += 1
+        if self._ready is not None and key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+
+    async def _run(self):
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes.get(key)
+            items = [lane.popleft() for _ in range(min(len(lane), self.max_batch))] if lane else []
+            self._running += 1
+            try:
+                if items:
+                    await self.handler(key, items)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur traitement de la file {key}: {str(e)}")
+            finally:
+                self._running -= 1
+                self._pending -= len(items)
+                if lane:
+                    # Reste du travail : retour en fin de tour
+                    self._ready.put_nowait(key)
+                else:
+                    self._lanes.pop(key, None)
+                    self._scheduled.discard(key)
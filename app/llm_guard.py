@@ -0,0 +1,210 @@
+# =====================================
+# app/llm_guard.py
+# =====================================
+# Garde des appels LLM : délai strict par requête, requête doublée
+# (optionnelle) quand la première tarde, et disjoncteur. Quand OpenAI est lent
+# ou en panne, le disjoncteur s'ouvre et les appels échouent immédiatement
+# (CircuitOpen) : l'appelant sert sa réponse de repli sans attendre. Après
+# LLM_BREAKER_OPEN_SECONDS, un seul appel réel sert de sonde ; son succès
+# referme le disjoncteur, son échec le rouvre pour une nouvelle période.
+#
+# Seul le temps passé dans l'appel au fournisseur compte pour le disjoncteur :
+# une requête qui attend encore une place d'appel à l'échéance (charge locale)
+# reçoit le repli (QueueTimeout) sans être comptée comme un échec d'OpenAI.
+#
+# État propre à chaque processus (pas de coordination entre workers gunicorn).
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from .metrics import LLM_BREAKER_REJECTED, LLM_BREAKER_TRANSITIONS, LLM_HEDGED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitOpen(Exception):
+    """Disjoncteur LLM ouvert : appel non tenté"""
+
+class QueueTimeout(asyncio.TimeoutError):
+    """Délai écoulé avant qu'une place d'appel se libère (non compté par le disjoncteur)"""
+
+class LLMGuard:
+    """Délai, requête doublée et disjoncteur autour d'un appel asynchrone
+
+    Un appel compte comme un échec s'il lève une erreur, dépasse le délai ou
+    dure plus de `slow_seconds`, mesurés à partir de l'entrée dans l'appel au
+    fournisseur (place obtenue) ; une échéance atteinte moins de
+    min(slow_seconds, deadline / 2) après l'entrée dans l'appel est imputée à
+    l'attente locale (QueueTimeout). Le disjoncteur s'ouvre quand, sur les
+    `window` derniers appels (au moins `min_calls`), la part d'échecs atteint
+    `failure_ratio`.
+    """
+
+    def __init__(self):
+        self.deadline = float(os.getenv("LLM_DEADLINE", "8"))
+        # 0 : pas de requête doublée (elle double le coût des appels lents)
+        self.hedge_after = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+        self.slow_seconds = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "5"))
+        self.failure_ratio = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+        self.min_calls = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+        self.open_seconds = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._outcomes = deque(maxlen=int(os.getenv("LLM_BREAKER_WINDOW", "20")))
+        self._probing = False
+
+        self.rejected = 0
+        self.hedged = 0
+        self.queue_timeouts = 0
+        self.trips = 0
+
+    def available(self) -> bool:
+        """Un appel serait-il tenté maintenant ? (sans effet de bord)"""
+        if self.state == CLOSED:
+            return True
+        if self._probing:
+            return False
+        return self.state == HALF_OPEN or time.monotonic() - self.opened_at >= self.open_seconds
+
+    def _admit(self) -> bool:
+        """Autorise l'appel ou lève CircuitOpen ; retourne True pour une sonde"""
+        if self.state == CLOSED:
+            return False
+        if self.available():
+            self._transition(HALF_OPEN)
+            self._probing = True
+            return True
+        self.rejected += 1
+        LLM_BREAKER_REJECTED.inc()
+        raise CircuitOpen(f"disjoncteur LLM ouvert ({self.state})")
+
+    async def run(self, call: Callable[[], Awaitable[T]], slots: Optional[asyncio.Semaphore] = None) -> T:
+        """Exécute call() (après obtention d'une place de `slots`) sous délai strict
+
+        Le délai couvre l'attente de la place et l'appel : asyncio.TimeoutError
+        au-delà, QueueTimeout si l'appel n'a pas commencé.
+        """
+        probe = self._admit()
+        # Instants d'entrée dans l'appel au fournisseur (requête doublée comprise)
+        started: List[float] = []
+
+        async def attempt() -> T:
+            if slots is None:
+                started.append(time.monotonic())
+                return await call()
+            async with slots:
+                started.append(time.monotonic())
+                return await call()
+
+        try:
+            # wait_for annule les appels encore en cours à l'échéance
+            result = await asyncio.wait_for(self._hedged(attempt, slots), timeout=self.deadline)
+        except asyncio.CancelledError:
+            # Annulation par l'appelant : ni succès ni échec du fournisseur
+            if probe:
+                self._probing = False
+            raise
+        except asyncio.TimeoutError:
+            if not started or time.monotonic() - started[0] < self._fair_share():
+                # Échéance consommée par l'attente d'une place (charge locale) :
+                # le fournisseur n'a pas eu le temps de répondre, il n'est pas en cause
+                if probe:
+                    self._probing = False
+                self.queue_timeouts += 1
+                raise QueueTimeout(f"délai LLM de {self.deadline}s consommé par l'attente d'une place") from None
+            self._record(False, probe)
+            raise
+        except Exception:
+            self._record(False, probe)
+            raise
+        self._record(time.monotonic() - started[0] <= self.slow_seconds, probe)
+        return result
+
+    async def _hedged(self, call: Callable[[], Awaitable[T]], slots: Optional[asyncio.Semaphore]) -> T:
+        """Relance une seconde requête si la première n'a pas répondu après hedge_after"""
+        if not self.hedge_after or self.hedge_after >= self.deadline:
+            return await call()
+        first = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        # Pas de seconde requête sans place libre (elle attendrait derrière les autres)
+        if done or (slots is not None and slots.locked()):
+            return await first
+        self.hedged += 1
+        LLM_HEDGED.inc()
+        second = asyncio.ensure_future(call())
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            # Première réponse valide retenue ; échec seulement si les deux échouent
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (first, second):
+                if not task.done():
+                    task.cancel()
+
+    def _fair_share(self) -> float:
+        """Temps d'appel au-delà duquel une échéance dépassée est imputée au fournisseur"""
+        return min(self.slow_seconds, self.deadline / 2)
+
+    def _record(self, ok: bool, probe: bool):
+        if probe:
+            self._probing = False
+            if ok:
+                self._outcomes.clear()
+                self._transition(CLOSED)
+            else:
+                self._open()
+            return
+        if self.state != CLOSED:
+            # Appel lancé avant l'ouverture : déjà pris en compte
+            return
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+            self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        if self.state == CLOSED:
+            self.trips += 1
+            logger.warning(
+                "Disjoncteur LLM ouvert : %d échecs sur %d appels, réponses de repli pendant %gs",
+                self._outcomes.count(False), len(self._outcomes), self.open_seconds
+            )
+        self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        if state == CLOSED:
+            logger.info("Disjoncteur LLM refermé")
+        self.state = state
+        LLM_BREAKER_TRANSITIONS.inc(state=state)
+
+    def status(self) -> dict:
+        """État exposé dans /health"""
+        return {
+            "state": self.state,
+            "available": self.available(),
+            "open_for_seconds": round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else None,
+            "recent_calls": len(self._outcomes),
+            "recent_failures": self._outcomes.count(False),
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "hedged": self.hedged,
+            "queue_timeouts": self.queue_timeouts,
+            "deadline": self.deadline,
+        }
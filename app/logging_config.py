@@ -0,0 +1,167 @@
+# =====================================
+# app/logging_config.py
+# =====================================
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+# Formats de numéros reconnus dans le texte (seuls les 2 derniers chiffres restent) :
+# international avec "+" (E.164, espaces tolérés), identifiant WhatsApp (indicatif
+# pays sans "+", chiffres seuls) et national français. Les autres suites de
+# chiffres (dates, montants, numéros de facture, durées) restent lisibles.
+PHONE_COUNTRY_CODES = ("33", "32", "41", "352", "212", "213", "216", "221", "225", "237")
+_PHONE_PATTERN = re.compile(
+    r"(?<![\w+.-])(?:"
+    r"\+\d(?:[ .]?\d){7,14}"
+    r"|(?:" + "|".join(PHONE_COUNTRY_CODES) + r")[1-9]\d{7,8}"
+    r"|0[1-9](?:[ .]?\d{2}){4}"
+    r")(?![\w.-]?\d)"
+)
+# Champs structurés contenant un numéro : masqués entièrement (2 derniers chiffres)
+PHONE_FIELDS = {"phone", "user_phone", "from", "to", "wa_id"}
+# Champs structurés jamais écrits en clair (contenu des messages)
+REDACTED_FIELDS = {"body", "message_body", "text", "payload", "response_body"}
+
+# Attributs standard d'un LogRecord (le reste vient de extra=)
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sampled"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def redact_phones(text: str) -> str:
+    """Masque les numéros de téléphone d'un texte"""
+    return _PHONE_PATTERN.sub(lambda m: _mask(m.group()), text)
+
+def _mask(text: str) -> str:
+    return "•" * 6 + re.sub(r"\D", "", text)[-2:]
+
+def _redact_value(key: str, value):
+    if key in REDACTED_FIELDS and value is not None:
+        return f"<masqué, {len(str(value))} car.>"
+    if key in PHONE_FIELDS and value is not None:
+        return _mask(str(value))
+    if isinstance(value, str):
+        return redact_phones(value)
+    return value
+
+class SamplingFilter(logging.Filter):
+    """Échantillonne les lignes répétitives DEBUG/INFO d'un même point d'appel
+
+    Les `burst` premières occurrences de chaque ligne de code sont gardées
+    dans chaque fenêtre de `window` secondes, puis une sur `every`. Les
+    avertissements et erreurs ne sont jamais échantillonnés. Le nombre de
+    lignes écartées est reporté dans le champ `sampled` de la suivante.
+    """
+
+    def __init__(self, burst: int, every: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.every = max(1, every)
+        self.window = window
+        # (fichier, ligne) -> [début de fenêtre, occurrences, écartées]
+        self._sites: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None or now - site[0] > self.window:
+            site = self._sites[(record.pathname, record.lineno)] = [now, 0, 0]
+        site[1] += 1
+        if site[1] <= self.burst or (site[1] - self.burst) % self.every == 0:
+            if site[2]:
+                record.sampled = site[2]
+                site[2] = 0
+            return True
+        site[2] += 1
+        return False
+
+class RedactingFilter(logging.Filter):
+    """Masque téléphones et contenus de messages (exécuté sur le thread d'écriture)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redact_phones(record.getMessage())
+        record.args = None
+        for key, value in list(vars(record).items()):
+            if key not in _RECORD_ATTRIBUTES:
+                setattr(record, key, _redact_value(key, value))
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement, champs extra= inclus"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES or key == "sampled":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui laisse la mise en forme au thread d'écriture
+
+    Le QueueHandler standard formate le message dans le thread appelant ;
+    ici l'enregistrement est transmis tel quel (même processus), le
+    formatage, le masquage et l'écriture se font hors de la boucle asyncio.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def configure_logging():
+    """Configure la journalisation selon LOG_LEVEL, LOG_FORMAT (json|text), LOG_ASYNC, LOG_REDACT et LOG_SAMPLE_*"""
+    global _listener
+    stop_logging()
+
+    level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    output = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    if os.getenv("LOG_REDACT", "true").lower() == "true":
+        output.addFilter(RedactingFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    if os.getenv("LOG_ASYNC", "true").lower() == "true":
+        log_queue = queue.SimpleQueue()
+        entry = DeferredQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        entry = output
+
+    entry.addFilter(SamplingFilter(
+        burst=int(os.getenv("LOG_SAMPLE_BURST", "20")),
+        every=int(os.getenv("LOG_SAMPLE_EVERY", "100")),
+        window=float(os.getenv("LOG_SAMPLE_WINDOW", "60"))
+    ))
+    root.addHandler(entry)
+
+def stop_logging():
+    """Écrit les lignes en attente et arrête le thread d'écriture"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
@@ -4,34 +4,183 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import PlainTextResponse, JSONResponse
 import os
+import hmac
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
 from dotenv import load_dotenv
-from .database import init_db
+from .database import init_db, close_db, pool_status, check_schema, ping_db, SCHEMA_VERSION
 from .whatsapp import WhatsAppHandler
 from .ai_coach import FacturationCoach
-from .database import get_db_sync
+from .outbox import OutboundQueue
+from .media import MediaPipeline
+from .worker import MessageWorkerPool
+from .reminders import ReminderScheduler
+from .coordination import Coordinator
+from .imports import InvoiceImporter
+from .metrics import REGISTRY, STAGE_SECONDS, WEBHOOK_REQUESTS, MESSAGES_RECEIVED, saturation
+from .logging_config import configure_logging, stop_logging
 import logging
 
-# Configuration
+# Configuration (aucune connexion ni client créé à l'import : tout démarre dans lifespan)
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# migrate : crée tables et migrations au démarrage (défaut)
+# check   : vérifie seulement le schéma, sans DDL (migrations lancées avant : python -m app.database)
+# off     : aucune vérification
+DB_SCHEMA_MODE = os.getenv("DB_SCHEMA_MODE", "migrate").lower()
+# Délai max du SELECT 1 de /ready
+READY_DB_TIMEOUT = float(os.getenv("READY_DB_TIMEOUT", "2"))
+# Seuil d'occupation au-delà duquel /health signale "degraded"
+HEALTH_SATURATION_THRESHOLD = float(os.getenv("HEALTH_SATURATION_THRESHOLD", "0.9"))
+
+class Services:
+    """Services de l'application, créés et démarrés par lifespan"""
+
+    def __init__(self):
+        # Partage du travail avec les autres processus (gunicorn.conf.py)
+        self.coordinator = Coordinator()
+        self.whatsapp = WhatsAppHandler()
+        self.media = MediaPipeline(self.whatsapp)
+        self.coach = FacturationCoach(self.media)
+        self.outbox = OutboundQueue(self.whatsapp, self.coordinator)
+        self.workers = MessageWorkerPool(self.coach, self.outbox, self.coordinator)
+        self.reminders = ReminderScheduler(self.outbox, self.coordinator)
+
+    async def start(self):
+        await self.coordinator.start()
+        # Clients HTTP (Graph API, OpenAI) ouverts au premier appel
+        await self.media.start()
+        await self.coach.start()
+        await self.outbox.start()
+        await self.workers.start()
+        await self.reminders.start()
+
+    async def stop(self):
+        await self.reminders.stop()
+        await self.workers.stop()
+        await self.coordinator.stop()
+        await self.outbox.stop()
+        await self.media.stop()
+        await self.whatsapp.aclose()
+        await self.coach.aclose()
+
+services: Optional[Services] = None
+# État de démarrage lu par /ready
+readiness = {"started": False, "schema": None, "startup_ms": None}
+
+async def _prepare_schema():
+    """Migre ou vérifie le schéma selon DB_SCHEMA_MODE"""
+    if DB_SCHEMA_MODE == "migrate":
+        await asyncio.to_thread(init_db)
+        readiness["schema"] = {"ok": True, "version": SCHEMA_VERSION, "expected": SCHEMA_VERSION, "missing_tables": []}
+    elif DB_SCHEMA_MODE == "check":
+        try:
+            readiness["schema"] = await check_schema()
+        except Exception as e:
+            # L'application démarre quand même : /ready reste à 503 jusqu'à ce que la base réponde
+            logger.error("Vérification du schéma impossible: %s", e)
+            return
+        if not readiness["schema"]["ok"]:
+            logger.error("Schéma de base de données non à jour: %s", readiness["schema"])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global services
+    configure_logging()
+    started = time.perf_counter()
+    await _prepare_schema()
+    services = Services()
+    await services.start()
+    readiness["started"] = True
+    readiness["startup_ms"] = round((time.perf_counter() - started) * 1000)
+    logger.info("Application démarrée en %d ms (schéma : %s)", readiness["startup_ms"], DB_SCHEMA_MODE)
+    try:
+        yield
+    finally:
+        readiness["started"] = False
+        await services.stop()
+        await close_db()
+        logger.info("Application arrêtée")
+        stop_logging()
+
 # Initialize FastAPI
 app = FastAPI(
     title="Coach Facturation IA",
     description="Assistant WhatsApp pour la gestion de facturation",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Initialize services
-whatsapp_handler = WhatsAppHandler()
-ai_coach = FacturationCoach()
+def saturation_report() -> dict:
+    """Occupation réelle des pools et files d'attente"""
+    db_pool = pool_status()
+    report = {"db_pool": dict(db_pool, saturation=saturation(db_pool.get("checked_out", 0), db_pool.get("capacity")))}
+    if services is None:
+        return report
+    workers, coach, whatsapp, outbox = services.workers, services.coach, services.whatsapp, services.outbox
+    report.update({
+        "workers": {
+            "busy": workers.lanes.busy,
+            "concurrency": workers.concurrency,
+            "pending": workers.lanes.pending,
+            "max_pending": workers.max_pending,
+            "user_lanes": workers.lanes.lane_count,
+            "saturation": saturation(workers.lanes.pending, workers.max_pending),
+        },
+        "llm": {
+            "in_flight": coach.llm_in_flight,
+            "max_concurrency": coach.llm_max_concurrency,
+            "saturation": saturation(coach.llm_in_flight, coach.llm_max_concurrency),
+        },
+        "whatsapp": {
+            "in_flight": whatsapp.in_flight,
+            "max_concurrency": whatsapp.max_concurrency,
+            "saturation": saturation(whatsapp.in_flight, whatsapp.max_concurrency),
+        },
+        "outbox": {
+            "queue_depth": outbox.queue_depth,
+            "sent": outbox.sent,
+            "retried": outbox.retried,
+            "dead_lettered": outbox.dead_lettered,
+        },
+        "conversation_log": {
+            "queue_depth": coach.conversation_log.queue_depth,
+            "max_buffered": coach.conversation_log.max_buffered,
+            "dropped": coach.conversation_log.dropped,
+            "saturation": saturation(coach.conversation_log.queue_depth, coach.conversation_log.max_buffered),
+        },
+    })
+    return report
 
-# Initialize database on startup
-@app.on_event("startup")
-async def startup_event():
-    init_db()
-    logger.info("Application démarrée - Base de données initialisée")
+# Jauges lues à chaque export /metrics (ignorées tant que les services ne sont pas démarrés)
+REGISTRY.gauge("coach_db_pool_connections", "Connexions du pool asynchrone", lambda: [
+    ({"state": state}, pool_status().get(key, 0)) for state, key in (("checked_out", "checked_out"), ("capacity", "capacity"))
+])
+REGISTRY.gauge("coach_worker_messages", "Messages réservés par les workers", lambda: [
+    ({"state": "pending"}, services.workers.lanes.pending),
+    ({"state": "processing_lanes"}, services.workers.lanes.busy),
+])
+REGISTRY.gauge("coach_worker_user_lanes", "Files utilisateur vivantes", lambda: services.workers.lanes.lane_count)
+REGISTRY.gauge("coach_llm_in_flight", "Appels OpenAI en cours", lambda: services.coach.llm_in_flight)
+REGISTRY.gauge("coach_llm_breaker_open", "Disjoncteur LLM (0 fermé, 1 sonde en cours, 2 ouvert)", lambda: {
+    "closed": 0, "half_open": 1, "open": 2
+}[services.coach.llm_guard.state])
+REGISTRY.gauge("coach_whatsapp_in_flight", "Appels Graph API en cours", lambda: services.whatsapp.in_flight)
+REGISTRY.gauge("coach_outbox_messages", "File d'envoi WhatsApp", lambda: [
+    ({"state": "queued"}, services.outbox.queue_depth),
+    ({"state": "sent"}, services.outbox.sent),
+    ({"state": "retried"}, services.outbox.retried),
+    ({"state": "dead_lettered"}, services.outbox.dead_lettered),
+])
+REGISTRY.gauge("coach_conversation_log_queue_depth", "Échanges en attente d'écriture", lambda: services.coach.conversation_log.queue_depth)
+REGISTRY.gauge("coach_llm_cache", "Cache des conseils LLM", lambda: [
+    ({"state": key}, value) for key, value in services.coach.advice_cache.stats().items() if key in ("size", "hits", "misses", "coalesced", "shared_hits", "evictions")
+])
+REGISTRY.gauge("coach_shards_owned", "Partitions d'utilisateurs détenues par ce processus", lambda: len(services.coordinator.owned))
+REGISTRY.gauge("coach_cluster_members", "Processus vivants (baux member)", lambda: services.coordinator.members)
 
 @app.get("/")
 async def webhook_verify_and_home(request: Request):
@@ -58,51 +207,115 @@ async def webhook_verify_and_home(request: Request):
 @app.post("/")
 async def webhook_message_handler(request: Request):
     """Traitement des messages WhatsApp"""
+    if services is None or not readiness["started"]:
+        # Démarrage en cours : Meta renverra le webhook
+        WEBHOOK_REQUESTS.inc(outcome="not_ready")
+        return PlainTextResponse("Starting", status_code=503)
     try:
         webhook_data = await request.json()
-        logger.info(f"Message WhatsApp reçu: {webhook_data}")
         
-        parsed_message = whatsapp_handler.parse_webhook_message(webhook_data)
+        with STAGE_SECONDS.time(stage="webhook_parse"):
+            parsed_messages = services.whatsapp.parse_webhook_messages(webhook_data)
         
-        if not parsed_message:
-            logger.info("Pas de message à traiter")
+        if not parsed_messages:
+            logger.debug("Webhook sans message à traiter")
+            WEBHOOK_REQUESTS.inc(outcome="no_message")
             return PlainTextResponse("OK", status_code=200)
         
-        user_phone = parsed_message["from"]
-        message_body = parsed_message["body"]
-        media_url = parsed_message["media_url"]
-        
-        logger.info(f"Message reçu de {user_phone}: {message_body}")
-        
-        # Traiter le message avec l'IA
-        response_message = await ai_coach.process_message(
-            user_phone=user_phone,
-            message=message_body,
-            media_url=media_url
-        )
+        for parsed_message in parsed_messages:
+            MESSAGES_RECEIVED.inc(type=parsed_message["type"] or "unknown")
+            logger.debug(
+                "Message reçu",
+                extra={"phone": parsed_message["from"], "type": parsed_message["type"], "body_len": len(parsed_message["body"] or "")}
+            )
         
-        # Envoyer la réponse
-        await whatsapp_handler.send_message(
-            to=user_phone,
-            message=response_message
-        )
+        # Persister les messages : le traitement IA et l'envoi des réponses
+        # sont faits par les workers, Meta reçoit son 200 immédiatement
+        with STAGE_SECONDS.time(stage="enqueue"):
+            await services.workers.enqueue(parsed_messages)
         
-        logger.info(f"Réponse envoyée à {user_phone}")
+        WEBHOOK_REQUESTS.inc(outcome="accepted")
         return PlainTextResponse("OK", status_code=200)
         
     except Exception as e:
-        logger.error(f"Erreur webhook WhatsApp: {str(e)}")
+        logger.error("Erreur webhook WhatsApp: %s", e)
+        WEBHOOK_REQUESTS.inc(outcome="error")
         return PlainTextResponse("Error", status_code=500)
 
+def _check_import_token(request: Request):
+    """Authentification Bearer IMPORT_API_TOKEN (import désactivé si absent)"""
+    expected = os.getenv("IMPORT_API_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=503, detail="Import désactivé (IMPORT_API_TOKEN non configuré)")
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Token invalide", headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/invoices/import")
+async def import_invoices(request: Request, user_phone: str, format: Optional[str] = None):
+    """Import en flux de factures (CSV avec en-tête ou NDJSON) pour un utilisateur
+
+    curl -H "Authorization: Bearer $IMPORT_API_TOKEN" -H "Content-Type: text/csv"
+         --data-binary @factures.csv "https://.../invoices/import?user_phone=33612345678"
+    """
+    _check_import_token(request)
+    if format is None:
+        content_type = request.headers.get("Content-Type", "")
+        format = "ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv"
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format attendu : csv ou ndjson")
+    importer = InvoiceImporter(user_phone.replace("whatsapp:", "").replace("+", "").strip(), format)
+    report = await importer.run(request.stream())
+    # Rapport toujours renvoyé ; 422 si rien n'a pu être importé à cause d'erreurs
+    status_code = 422 if report["aborted"] or (report["failed"] and not report["imported"] and not report["duplicates"]) else 200
+    return JSONResponse(report, status_code=status_code)
+
 @app.get("/health")
 async def health_check():
-    """Endpoint de santé pour UptimeRobot"""
+    """Endpoint de santé pour UptimeRobot (vivacité : ne dépend pas de la base, voir /ready)"""
+    report = saturation_report()
+    saturated = [
+        name for name, section in report.items()
+        if (section.get("saturation") or 0) >= HEALTH_SATURATION_THRESHOLD
+    ]
+    # Toujours 200 (UptimeRobot) : la saturation est signalée dans le corps
     return JSONResponse({
-        "status": "healthy", 
+        "status": "degraded" if saturated else "healthy",
         "service": "facturation-coach",
-        "message": "Service opérationnel"
+        "message": f"Saturation : {', '.join(saturated)}" if saturated else "Service opérationnel",
+        "saturation": report,
+        "llm_cache": services.coach.advice_cache.stats() if services is not None else None,
+        "llm_guard": services.coach.llm_guard.status() if services is not None else None,
+        "coordination": services.coordinator.status() if services is not None else None
     })
 
+@app.get("/ready")
+async def readiness_check():
+    """Prêt à recevoir du trafic : services démarrés, base joignable, schéma à jour"""
+    checks = {"services": services is not None and readiness["started"]}
+    checks["database"] = await ping_db(READY_DB_TIMEOUT)
+    if DB_SCHEMA_MODE != "off":
+        schema = readiness["schema"] or {}
+        if checks["database"] and not schema.get("ok"):
+            # Migrations éventuellement appliquées depuis : nouvelle vérification (lecture seule)
+            try:
+                schema = readiness["schema"] = await check_schema()
+            except Exception as e:
+                logger.warning("Vérification du schéma impossible: %s", e)
+        checks["schema"] = bool(schema.get("ok"))
+    ready = all(checks.values())
+    return JSONResponse({
+        "status": "ready" if ready else "not_ready",
+        "checks": checks,
+        "schema": readiness["schema"],
+        "startup_ms": readiness["startup_ms"]
+    }, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Métriques au format texte Prometheus"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.head("/health")
 async def health_head():
     return PlainTextResponse("", status_code=200)
@@ -0,0 +1,144 @@
+# =====================================
+# app/media.py
+# =====================================
+import os
+import asyncio
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import insert, select
+from .database import get_async_db
+from .imaging import preprocess_image
+from .models import Invoice
+from .summaries import InvoiceChange, apply_invoice_changes
+
+logger = logging.getLogger(__name__)
+
+class MediaTooLarge(Exception):
+    """Média au-delà de MEDIA_MAX_BYTES"""
+
+@dataclass
+class MediaIngestResult:
+    """Facture créée (ou retrouvée) à partir d'une photo"""
+    invoice_id: int
+    duplicate: bool
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+class MediaPipeline:
+    """Réception des photos de factures envoyées sur WhatsApp
+
+    L'identifiant de média est résolu via la Graph API, puis le fichier est
+    téléchargé en flux vers un fichier temporaire par blocs de taille fixe
+    (jamais entièrement en mémoire, taille plafonnée). Empreinte, décodage
+    et réduction tournent dans un pool de processus, hors de la boucle
+    asyncio. Le résultat est enregistré comme facture brouillon ; une photo
+    déjà reçue par le même utilisateur renvoie la facture existante.
+    """
+
+    def __init__(self, whatsapp_handler):
+        self.whatsapp_handler = whatsapp_handler
+        self.spool_dir = os.getenv("MEDIA_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "facturation-media"))
+        self.storage_dir = os.getenv("MEDIA_STORAGE_DIR", "./media")
+        self.max_bytes = int(os.getenv("MEDIA_MAX_BYTES", str(10 * 1024 * 1024)))
+        self.chunk_size = int(os.getenv("MEDIA_CHUNK_SIZE", "65536"))
+        self.max_dimension = int(os.getenv("MEDIA_MAX_DIMENSION", "1600"))
+        self.process_workers = int(os.getenv("MEDIA_PROCESS_WORKERS", "2"))
+        self._download_slots = asyncio.Semaphore(int(os.getenv("MEDIA_MAX_CONCURRENCY", "4")))
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def start(self):
+        """Prépare le répertoire temporaire (le pool de processus est créé au premier média)"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    async def stop(self):
+        """Arrête le pool de processus"""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn : pas de copie des connexions et threads du processus web
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def ingest(self, user_phone: str, media_id: str) -> MediaIngestResult:
+        """Télécharge, traite et enregistre une photo de facture"""
+        info = await self.whatsapp_handler.get_media_info(media_id)
+        if int(info.get("file_size") or 0) > self.max_bytes:
+            raise MediaTooLarge(f"{info.get('file_size')} octets")
+
+        spool_path = await self._download(info["url"])
+        try:
+            processed = await asyncio.get_running_loop().run_in_executor(
+                self._executor(), preprocess_image,
+                spool_path, self.storage_dir, self.max_dimension, info.get("mime_type")
+            )
+        finally:
+            try:
+                os.unlink(spool_path)
+            except FileNotFoundError:
+                pass  # déplacé vers le stockage
+
+        if info.get("sha256") and info["sha256"].lower() != processed["sha256"]:
+            logger.warning(f"Empreinte du média {media_id} différente de celle annoncée par Meta")
+        if processed["error"]:
+            logger.warning(f"Média {media_id} conservé sans traitement: {processed['error']}")
+        return await self._save_invoice(user_phone, media_id, processed)
+
+    async def _download(self, url: str) -> str:
+        """Télécharge en flux vers un fichier temporaire ; retourne son chemin"""
+        client = await self.whatsapp_handler.start()
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, suffix=".part")
+        received = 0
+        try:
+            with os.fdopen(fd, "wb") as spool:
+                async with self._download_slots:
+                    async with client.stream("GET", url, headers=self.whatsapp_handler.auth_headers()) as response:
+                        response.raise_for_status()
+                        if int(response.headers.get("Content-Length") or 0) > self.max_bytes:
+                            raise MediaTooLarge(f"{response.headers['Content-Length']} octets")
+                        async for chunk in response.aiter_bytes(self.chunk_size):
+                            received += len(chunk)
+                            if received > self.max_bytes:
+                                raise MediaTooLarge(f"plus de {self.max_bytes} octets")
+                            spool.write(chunk)
+            return path
+        except BaseException:
+            os.unlink(path)
+            raise
+
+    async def _save_invoice(self, user_phone: str, media_id: str, processed: dict) -> MediaIngestResult:
+        async with get_async_db() as db:
+            existing = (await db.execute(
+                select(Invoice.id)
+                .where(Invoice.user_phone == user_phone, Invoice.media_sha256 == processed["sha256"])
+                .limit(1)
+            )).scalar()
+            if existing is not None:
+                return MediaIngestResult(existing, True, processed["width"], processed["height"])
+
+            invoice_id = (await db.execute(
+                insert(Invoice)
+                .values(
+                    user_phone=user_phone,
+                    invoice_date=datetime.now(),
+                    status="draft",
+                    reminder_level=0,
+                    media_id=media_id,
+                    media_sha256=processed["sha256"],
+                    media_path=processed["path"]
+                )
+                .returning(Invoice.id)
+            )).scalar_one()
+            await apply_invoice_changes(db, [InvoiceChange(user_phone, None, None, None, "draft")])
+            await db.commit()
+        return MediaIngestResult(invoice_id, False, processed["width"], processed["height"])
@@ -0,0 +1,214 @@
+# =====================================
+# app/metrics.py
+# =====================================
+# Métriques en mémoire (compteurs, histogrammes, jauges) exposées au format
+# texte Prometheus sur /metrics. Sans dépendance : tout est mis à jour depuis
+# la boucle asyncio, donc sans verrou.
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Secondes : de la milliseconde (parse, intention) à la dizaine de secondes (LLM)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    """Compteur monotone, éventuellement étiqueté"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Histogram:
+    """Histogramme à seaux cumulés (format Prometheus)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # clé d'étiquettes -> [compte par seau..., somme, total]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Mesure la durée du bloc (utilisable autour d'un await)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return int(series[-1]) if series else 0
+
+    def samples(self) -> Iterable[str]:
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {int(series[-1])}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {int(series[-1])}"
+
+GaugeValue = Union[float, Iterable[Tuple[Dict[str, str], float]]]
+
+class Gauge:
+    """Jauge lue au moment de l'export (taille de file, connexions utilisées...)"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], GaugeValue]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def samples(self) -> Iterable[str]:
+        try:
+            value = self.read()
+        except Exception:
+            return
+        if value is None:
+            return
+        if isinstance(value, (int, float)):
+            yield f"{self.name} {_format_value(value)}"
+            return
+        for labels, sample in value:
+            yield f"{self.name}{_format_labels(list(labels), list(labels.values()))} {_format_value(sample)}"
+
+class MetricsRegistry:
+    """Ensemble des métriques exportées"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram, Gauge]] = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None and not isinstance(metric, Gauge):
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], GaugeValue]) -> Gauge:
+        """Déclare (ou remplace) une jauge calculée à l'export"""
+        return self._register(Gauge(name, help, read))
+
+    def render(self) -> str:
+        """Export au format texte Prometheus 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# ---------- Métriques du chemin de traitement ----------
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "coach_stage_duration_seconds",
+    "Durée des étapes du traitement d'un message",
+    ["stage"]
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    "coach_handler_duration_seconds",
+    "Durée de génération d'une réponse par intention",
+    ["handler"]
+)
+LLM_SECONDS = REGISTRY.histogram(
+    "coach_llm_request_duration_seconds",
+    "Durée des appels OpenAI (attente de place incluse)",
+    ["outcome"]
+)
+LLM_BREAKER_TRANSITIONS = REGISTRY.counter(
+    "coach_llm_breaker_transitions",
+    "Changements d'état du disjoncteur LLM",
+    ["state"]
+)
+LLM_BREAKER_REJECTED = REGISTRY.counter(
+    "coach_llm_breaker_rejected",
+    "Appels OpenAI non tentés (disjoncteur ouvert, réponse de repli)"
+)
+LLM_HEDGED = REGISTRY.counter(
+    "coach_llm_hedged_requests",
+    "Secondes requêtes OpenAI lancées après LLM_HEDGE_AFTER"
+)
+DB_COMMIT_SECONDS = REGISTRY.histogram(
+    "coach_db_commit_duration_seconds",
+    "Durée des COMMIT des sessions asynchrones"
+)
+WHATSAPP_SEND_SECONDS = REGISTRY.histogram(
+    "coach_whatsapp_send_duration_seconds",
+    "Durée des appels d'envoi Graph API",
+    ["status"]
+)
+WEBHOOK_REQUESTS = REGISTRY.counter(
+    "coach_webhook_requests",
+    "Webhooks reçus",
+    ["outcome"]
+)
+MESSAGES_RECEIVED = REGISTRY.counter(
+    "coach_messages_received",
+    "Messages WhatsApp reçus",
+    ["type"]
+)
+
+def saturation(used: float, capacity: Optional[float]) -> Optional[float]:
+    """Taux d'occupation arrondi (None si capacité inconnue ou nulle)"""
+    if not capacity:
+        return None
+    return round(used / capacity, 3)
@@ -1,7 +1,7 @@
 # =====================================
 # app/models.py
 # =====================================
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -29,10 +29,24 @@ class Invoice(Base):
     amount = Column(Float)
     invoice_date = Column(DateTime)
     due_date = Column(DateTime)
-    status = Column(String, default="sent")  # sent, paid, overdue, cancelled
+    status = Column(String, default="sent")  # draft, sent, paid, overdue, cancelled
+    reminder_level = Column(Integer, default=0)  # 0 aucune, 1 J+7, 2 J+15, 3 J+30
+    last_reminder_at = Column(DateTime)
+    # Photo de la facture reçue sur WhatsApp (empreinte SHA-256 : dédoublonnage)
+    media_id = Column(String)
+    media_sha256 = Column(String)
+    media_path = Column(String)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        Index("ix_invoices_status_due_date", "status", "due_date"),
+        Index("ix_invoices_reminder_scan", "status", "reminder_level", "due_date", "id"),
+        Index("ix_invoices_user_phone_media_sha256", "user_phone", "media_sha256"),
+        Index("ix_invoices_user_phone_status_due_date", "user_phone", "status", "due_date"),
+        Index("ix_invoices_user_phone_invoice_number", "user_phone", "invoice_number"),
+    )
+
 class Conversation(Base):
     __tablename__ = "conversations"
     
@@ -43,12 +57,95 @@ class Conversation(Base):
     message_type = Column(String)  # text, image, document
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index("ix_conversations_user_phone_created_at", "user_phone", "created_at"),
+    )
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_phone = Column(String, unique=True, index=True)
+    summary = Column(Text)
+    # Échanges résumés jusqu'à cette date (created_at du dernier échange intégré)
+    summarized_until = Column(DateTime)
+    exchange_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
 class PendingMessage(Base):
     __tablename__ = "pending_messages"
     
     id = Column(Integer, primary_key=True, index=True)
+    # Identifiant WhatsApp (wamid) : une redistribution par Meta est ignorée
+    message_id = Column(String, unique=True, index=True)
     user_phone = Column(String, index=True)
     message = Column(Text)
     media_url = Column(String)
     received_at = Column(DateTime, default=func.now())
     processed = Column(Boolean, default=False)
+    # Réservation par un worker (bail expirant => reprise après crash/redémarrage)
+    claimed_by = Column(String, index=True)
+    claimed_at = Column(DateTime)
+    attempts = Column(Integer, default=0)
+    # Empreinte du numéro : répartit les utilisateurs entre processus (voir coordination)
+    shard_key = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_pending_messages_processed_id", "processed", "id"),
+    )
+
+class OutgoingMessage(Base):
+    """Message WhatsApp à envoyer, supprimé une fois remis (voir OutboundQueue)"""
+    __tablename__ = "outbound_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_phone = Column(String, index=True)
+    message = Column(Text)
+    attempts = Column(Integer, default=0)
+    last_status = Column(Integer)
+    last_error = Column(Text)
+    # Réservation par le processus qui l'envoie (bail renouvelé, reprise après crash)
+    claimed_by = Column(String, index=True)
+    claimed_at = Column(DateTime, index=True)
+    created_at = Column(DateTime, default=func.now())
+
+class FailedMessage(Base):
+    __tablename__ = "failed_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_phone = Column(String, index=True)
+    message = Column(Text)
+    attempts = Column(Integer, default=0)
+    last_status = Column(Integer)  # code HTTP de la dernière tentative (vide : erreur réseau)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=func.now())
+
+class Lease(Base):
+    """Bail expirant détenu par un processus (partition d'utilisateurs, rôle de leader, présence)"""
+    __tablename__ = "leases"
+    
+    name = Column(String, primary_key=True)
+    holder = Column(String, index=True)
+    expires_at = Column(DateTime, index=True)
+
+class SharedCacheEntry(Base):
+    """Réponses LLM partagées entre processus"""
+    __tablename__ = "shared_cache"
+    
+    key = Column(String, primary_key=True)
+    value = Column(Text)
+    expires_at = Column(DateTime, index=True)
+
+class InvoiceSummary(Base):
+    """Résumé de facturation par utilisateur, tenu à jour à chaque création ou changement de statut"""
+    __tablename__ = "invoice_summaries"
+    
+    user_phone = Column(String, primary_key=True)
+    invoice_count = Column(Integer, default=0, nullable=False)
+    draft_count = Column(Integer, default=0, nullable=False)
+    outstanding_count = Column(Integer, default=0, nullable=False)  # sent + overdue
+    outstanding_amount = Column(Float, default=0.0, nullable=False)
+    overdue_count = Column(Integer, default=0, nullable=False)
+    overdue_amount = Column(Float, default=0.0, nullable=False)
+    next_due_date = Column(DateTime)  # plus proche échéance des factures "sent"
+    updated_at = Column(DateTime, default=func.now())
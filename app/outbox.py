@@ -0,0 +1,376 @@
+# =====================================
+# app/outbox.py
+# =====================================
+import os
+import time
+import uuid
+import random
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import delete, insert, or_, select, update
+from .database import get_async_db
+from .models import FailedMessage, OutgoingMessage
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class OutboundMessage:
+    """Message en attente d'envoi (id : ligne outbound_messages)"""
+    to: str
+    message: str
+    id: Optional[int] = None
+    attempts: int = 0
+    last_status: Optional[int] = None
+    last_error: str = ""
+
+class TokenBucket:
+    """Limiteur de débit : rate jetons par seconde, au plus burst d'avance"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Attend qu'un jeton soit disponible puis le consomme"""
+        # Verrou : les attentes sont servies dans l'ordre d'arrivée
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def penalize(self, seconds: float):
+        """Suspend la distribution de jetons (réponse 429 de Meta)"""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+class OutboundQueue:
+    """File d'envoi des messages WhatsApp, limitée en débit et avec reprise
+
+    Chaque destinataire a sa file FIFO : ses messages partent dans l'ordre,
+    un destinataire en attente de nouvelle tentative ne bloque pas les autres.
+    Le débit est borné par un seau à jetons par numéro expéditeur
+    (phone_number_id), dont chaque processus reçoit une part égale. Les réponses 429 / 5xx et les erreurs réseau sont
+    retentées avec un délai exponentiel aléatoire (full jitter) ; les
+    messages qui échouent définitivement sont enregistrés dans failed_messages.
+
+    La file est durable : un message est d'abord écrit dans outbound_messages,
+    dans la transaction qui le produit (add), puis confié à l'envoi après le
+    commit (submit). La ligne n'est supprimée qu'une fois le message remis.
+    Chaque processus renouvelle la réservation des lignes qu'il détient ;
+    celles d'un processus disparu (crash, redéploiement) ou rendues à l'arrêt
+    sont reprises par un processus vivant.
+    """
+
+    def __init__(self, whatsapp_handler, coordinator=None):
+        self.whatsapp_handler = whatsapp_handler
+        # Plusieurs processus : le débit autorisé est partagé entre processus vivants
+        self.coordinator = coordinator
+        self.rate = float(os.getenv("WHATSAPP_RATE_PER_SECOND", "20"))
+        self.burst = int(os.getenv("WHATSAPP_RATE_BURST", "40"))
+        self.concurrency = int(os.getenv("OUTBOX_CONCURRENCY", str(whatsapp_handler.max_concurrency)))
+        self.max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+        self.retry_base = float(os.getenv("OUTBOX_RETRY_BASE", "1.0"))
+        self.retry_max = float(os.getenv("OUTBOX_RETRY_MAX", "60"))
+        self.drain_timeout = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "10"))
+        # Réservation des lignes : renouvelée tous les claim_timeout / 3 par le
+        # processus vivant, reprise par un autre au-delà de claim_timeout
+        self.claim_timeout = float(os.getenv("OUTBOX_CLAIM_TIMEOUT", "60"))
+        self.recover_batch = int(os.getenv("OUTBOX_RECOVER_BATCH", "500"))
+        self.holder = uuid.uuid4().hex
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lanes: Dict[str, Deque[OutboundMessage]] = {}
+        # Destinataires dont un message est en cours d'envoi ou en attente de reprise
+        self._busy: Set[str] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._retry_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._depth = 0
+        self._idle: Optional[asyncio.Event] = None
+
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Nombre de messages pas encore envoyés (en file ou en attente de reprise)"""
+        return self._depth
+
+    async def start(self):
+        """Démarre les tâches d'envoi"""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._sender_loop()) for _ in range(self.concurrency)]
+        # Messages ajoutés avant le démarrage
+        for phone in self._lanes:
+            self._busy.add(phone)
+            self._ready.put_nowait(phone)
+        if self._depth:
+            self._idle.clear()
+        # Messages non remis d'une exécution précédente, puis reprise périodique
+        self._tasks.append(asyncio.create_task(self._claim_loop()))
+
+    async def stop(self):
+        """Laisse partir les messages en file (drain_timeout au plus) puis rend les autres
+
+        Les messages non envoyés restent dans outbound_messages, réservation
+        levée : un autre processus ou le prochain démarrage les envoie.
+        """
+        if self._tasks and self._depth:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{self._depth} messages non envoyés à l'arrêt")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+
+        remaining = [item.id for lane in self._lanes.values() for item in lane]
+        self._lanes.clear()
+        self._busy.clear()
+        self._depth = 0
+        try:
+            async with get_async_db() as db:
+                await db.execute(
+                    update(OutgoingMessage)
+                    .where(OutgoingMessage.claimed_by == self.holder)
+                    .values(claimed_by=None, claimed_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            if remaining:
+                logger.warning(f"{len(remaining)} messages non envoyés à l'arrêt, rendus pour reprise")
+        except Exception as e:
+            # Réservations reprises après claim_timeout
+            logger.error(f"Erreur libération des messages à envoyer: {str(e)}")
+
+    async def add(self, db, messages: Iterable[Tuple[str, str]]) -> List[OutboundMessage]:
+        """Enregistre des messages (destinataire, texte) dans la transaction de l'appelant
+
+        À transmettre à submit() après le commit : un message n'est jamais
+        envoyé sans être enregistré, ni perdu si le processus s'arrête avant.
+        """
+        rows = [
+            {"user_phone": to, "message": message, "attempts": 0, "claimed_by": self.holder, "claimed_at": datetime.now()}
+            for to, message in messages
+        ]
+        if not rows:
+            return []
+        # Ids dans l'ordre des lignes fournies (sinon non garanti en insertion multiple)
+        ids = (await db.execute(
+            insert(OutgoingMessage).returning(OutgoingMessage.id, sort_by_parameter_order=True), rows
+        )).scalars().all()
+        return [OutboundMessage(to=row["user_phone"], message=row["message"], id=row_id) for row, row_id in zip(rows, ids)]
+
+    def submit(self, items: Iterable[OutboundMessage]):
+        """Confie des messages enregistrés à l'envoi (file FIFO de chaque destinataire)"""
+        for item in items:
+            self._lanes.setdefault(item.to, deque()).append(item)
+            self._depth += 1
+            if self._idle is not None:
+                self._idle.clear()
+            if self._ready is not None and item.to not in self._busy:
+                self._busy.add(item.to)
+                self._ready.put_nowait(item.to)
+
+    def _bucket(self) -> TokenBucket:
+        key = self.whatsapp_handler.phone_number_id or "default"
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        members = self.coordinator.members if self.coordinator is not None else 1
+        bucket.rate = self.rate / members
+        bucket.burst = max(1, self.burst // members)
+        return bucket
+
+    def _backoff(self, attempts: int, retry_after: Optional[float]) -> float:
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** (attempts - 1)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _release(self, phone: str):
+        """Passe au message suivant du destinataire, ou libère sa file"""
+        lane = self._lanes.get(phone)
+        if lane:
+            self._ready.put_nowait(phone)
+            return
+        self._lanes.pop(phone, None)
+        self._busy.discard(phone)
+        if not self._depth:
+            self._idle.set()
+
+    def _resume(self, phone: str):
+        self._retry_handles.pop(phone, None)
+        self._ready.put_nowait(phone)
+
+    async def _sender_loop(self):
+        while True:
+            phone = await self._ready.get()
+            lane = self._lanes.get(phone)
+            if not lane:
+                self._release(phone)
+                continue
+            item = lane[0]
+            try:
+                bucket = self._bucket()
+                await bucket.acquire()
+                result = await self.whatsapp_handler.deliver(item.to, item.message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = None
+                item.last_error = str(e)[:500]
+
+            item.attempts += 1
+            if result is not None and result.ok:
+                await self._acknowledge(item)
+                lane.popleft()
+                self._depth -= 1
+                self.sent += 1
+                self._release(phone)
+                continue
+
+            if result is not None:
+                item.last_status, item.last_error = result.status, result.error
+            retryable = result is None or result.retryable
+            if retryable and item.attempts < self.max_attempts:
+                await self._record_attempt(item)
+                delay = self._backoff(item.attempts, result.retry_after if result else None)
+                if result is not None and result.status == 429:
+                    # Limite atteinte pour ce numéro : tous ses envois ralentissent
+                    bucket.penalize(delay)
+                self.retried += 1
+                logger.warning(
+                    "Envoi WhatsApp échoué (statut %s), nouvelle tentative %d/%d dans %.1fs",
+                    item.last_status, item.attempts + 1, self.max_attempts, delay
+                )
+                self._retry_handles[phone] = asyncio.get_running_loop().call_later(delay, self._resume, phone)
+                continue
+
+            lane.popleft()
+            self._depth -= 1
+            await self._dead_letter([item])
+            self._release(phone)
+
+    # ---------- Accès base ----------
+
+    async def _acknowledge(self, item: OutboundMessage):
+        """Message remis : sa ligne est supprimée"""
+        try:
+            async with get_async_db() as db:
+                await db.execute(delete(OutgoingMessage).where(OutgoingMessage.id == item.id))
+                await db.commit()
+        except Exception as e:
+            # Ligne restante : le message sera renvoyé à la reprise (au moins une fois)
+            logger.error(f"Erreur suppression d'un message envoyé: {str(e)}")
+
+    async def _record_attempt(self, item: OutboundMessage):
+        """Tentative échouée conservée : le nombre d'essais survit à un redémarrage"""
+        try:
+            async with get_async_db() as db:
+                await db.execute(
+                    update(OutgoingMessage)
+                    .where(OutgoingMessage.id == item.id)
+                    .values(attempts=item.attempts, last_status=item.last_status, last_error=item.last_error)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Erreur enregistrement d'une tentative d'envoi: {str(e)}")
+
+    async def _claim_loop(self):
+        """Renouvelle les réservations de ce processus et reprend les messages orphelins"""
+        while True:
+            try:
+                await self._renew_and_recover()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur reprise des messages à envoyer: {str(e)}")
+            await asyncio.sleep(self.claim_timeout / 3)
+
+    async def _renew_and_recover(self) -> int:
+        now = datetime.now()
+        stale_before = now - timedelta(seconds=self.claim_timeout)
+        orphaned = or_(OutgoingMessage.claimed_at == None, OutgoingMessage.claimed_at < stale_before)  # noqa: E711
+        async with get_async_db() as db:
+            await db.execute(
+                update(OutgoingMessage)
+                .where(OutgoingMessage.claimed_by == self.holder)
+                .values(claimed_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            ids = (await db.execute(
+                select(OutgoingMessage.id).where(orphaned).order_by(OutgoingMessage.id).limit(self.recover_batch)
+            )).scalars().all()
+            recovered = []
+            if ids:
+                # Réservation conditionnelle : un autre processus a pu reprendre ces lignes
+                recovered = (await db.execute(
+                    update(OutgoingMessage)
+                    .where(OutgoingMessage.id.in_(ids), orphaned)
+                    .values(claimed_by=self.holder, claimed_at=now)
+                    .returning(OutgoingMessage.id, OutgoingMessage.user_phone, OutgoingMessage.message,
+                               OutgoingMessage.attempts, OutgoingMessage.last_status, OutgoingMessage.last_error)
+                    .execution_options(synchronize_session=False)
+                )).all()
+            await db.commit()
+        # Lignes déjà en mémoire (renouvellement manqué, base indisponible) : pas de doublon
+        held = {item.id for lane in self._lanes.values() for item in lane}
+        recovered = [row for row in recovered if row.id not in held]
+        if recovered:
+            logger.info(f"{len(recovered)} messages non remis repris")
+            self.submit(
+                OutboundMessage(
+                    to=row.user_phone, message=row.message, id=row.id, attempts=row.attempts or 0,
+                    last_status=row.last_status, last_error=row.last_error or ""
+                )
+                for row in sorted(recovered, key=lambda row: row.id)
+            )
+        return len(recovered)
+
+    async def _dead_letter(self, items: List[OutboundMessage]):
+        if not items:
+            return
+        self.dead_lettered += len(items)
+        logger.error(f"{len(items)} messages WhatsApp abandonnés (enregistrés dans failed_messages)")
+        try:
+            async with get_async_db() as db:
+                # Ligne déplacée : même transaction que l'enregistrement de l'échec
+                await db.execute(delete(OutgoingMessage).where(OutgoingMessage.id.in_([item.id for item in items])))
+                await db.execute(insert(FailedMessage), [
+                    {
+                        "user_phone": item.to,
+                        "message": item.message,
+                        "attempts": item.attempts,
+                        "last_status": item.last_status,
+                        "last_error": item.last_error,
+                    }
+                    for item in items
+                ])
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Erreur enregistrement des messages abandonnés: {str(e)}")
@@ -0,0 +1,170 @@
+# =====================================
+# app/reminders.py
+# =====================================
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import and_, or_, select, update
+from .database import get_async_db
+from .models import Invoice
+from .summaries import InvoiceChange, apply_invoice_changes, mark_overdue
+
+logger = logging.getLogger(__name__)
+
+# (niveau, jours après échéance, modèle de relance)
+REMINDER_LEVELS = [
+    (1, 7, '**J+7 après échéance - Relance douce :**\n"Bonjour, j\'espère que tout va bien. Je me permets de vous rappeler que la facture n°{number} était due le {due}. Pourriez-vous me confirmer le règlement ? Merci !"'),
+    (2, 15, '**J+15 - Relance ferme :**\n"Bonjour, la facture n°{number} reste impayée depuis 15 jours. Merci de procéder au règlement sous 48h ou de m\'indiquer la date prévue."'),
+    (3, 30, '**J+30 - Relance finale :**\n"Dernière relance avant mise en demeure. Facture n°{number} impayée depuis 1 mois. Règlement exigé sous 8 jours."'),
+]
+
+# Statuts encore à encaisser
+OPEN_STATUSES = ("sent", "overdue")
+
+def passed_reminder_level(due_date: Optional[datetime], now: Optional[datetime] = None) -> int:
+    """Dernier niveau de relance dont le délai est déjà écoulé (même règle que run_once)
+
+    Une facture enregistrée déjà en retard (import) part de ce niveau : seule
+    la relance suivante lui sera envoyée, pas la série en rafale.
+    """
+    if due_date is None:
+        return 0
+    now = now or datetime.now()
+    passed = 0
+    for level, days, _ in REMINDER_LEVELS:
+        if due_date <= now - timedelta(days=days):
+            passed = level
+    return passed
+
+class ReminderScheduler:
+    """Détection périodique des factures échues et envoi des relances J+7 / J+15 / J+30
+
+    À chaque passage, les factures "sent" échues passent d'abord en
+    "overdue" (résumés à jour même sans relances) ; les relances ne sont
+    envoyées que si REMINDERS_ENABLED.
+
+    Chaque recherche est un parcours d'intervalle sur l'index
+    (status, reminder_level, due_date, id), paginé par clé. L'avancée de
+    reminder_level et l'enregistrement de la relance dans la file d'envoi
+    durable forment une transaction : une relance n'est jamais envoyée deux
+    fois, ni perdue si le processus s'arrête avant l'envoi.
+    """
+
+    def __init__(self, outbox, coordinator=None):
+        self.outbox = outbox
+        # Plusieurs processus : seul le leader (voir Coordinator) scanne les factures
+        self.coordinator = coordinator
+        self.enabled = os.getenv("REMINDERS_ENABLED", "true").lower() == "true"
+        self.interval = float(os.getenv("REMINDER_SCAN_INTERVAL", "3600"))
+        self.batch_size = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Démarre le planificateur"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Arrête le planificateur"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Met en file d'envoi toutes les relances dues ; retourne leur nombre"""
+        now = now or datetime.now()
+        sent = 0
+        # Du plus haut niveau au plus bas : une facture très en retard reçoit
+        # directement la relance adaptée, pas toute la série
+        for level, days, template in reversed(REMINDER_LEVELS):
+            cutoff = now - timedelta(days=days)
+            for status in OPEN_STATUSES:
+                for previous_level in range(level):
+                    sent += await self._process_range(status, previous_level, level, cutoff, template, now)
+        if sent:
+            logger.info(f"{sent} relances de paiement mises en file d'envoi")
+        return sent
+
+    async def _process_range(self, status: str, previous_level: int, level: int, cutoff: datetime, template: str, now: datetime) -> int:
+        sent = 0
+        last_key = None
+        while True:
+            invoices = await self._claim_page(status, previous_level, level, cutoff, last_key, now, template)
+            if invoices is None:
+                return sent
+            last_key, outbound = invoices
+            # Enregistrées : la file d'envoi gère débit, reprises et échecs définitifs
+            self.outbox.submit(outbound)
+            sent += len(outbound)
+
+    async def _claim_page(self, status: str, previous_level: int, level: int, cutoff: datetime, last_key, now: datetime, template: str):
+        """Lit une page (pagination par clé) et réserve ses factures ; None quand l'intervalle est épuisé"""
+        conditions = [
+            Invoice.status == status,
+            Invoice.reminder_level == previous_level,
+            Invoice.due_date <= cutoff,
+        ]
+        if last_key is not None:
+            last_due, last_id = last_key
+            conditions.append(or_(Invoice.due_date > last_due, and_(Invoice.due_date == last_due, Invoice.id > last_id)))
+
+        async with get_async_db() as db:
+            page = (await db.execute(
+                select(Invoice.id, Invoice.due_date)
+                .where(*conditions)
+                .order_by(Invoice.due_date, Invoice.id)
+                .limit(self.batch_size)
+            )).all()
+            if not page:
+                return None
+
+            # Réservation conditionnelle : seules les factures encore au niveau
+            # précédent sont retournées (un autre processus a pu passer avant)
+            claimed = (await db.execute(
+                update(Invoice)
+                .where(Invoice.id.in_([row.id for row in page]), Invoice.status == status, Invoice.reminder_level == previous_level)
+                .values(reminder_level=level, last_reminder_at=now, status="overdue")
+                .returning(Invoice.id, Invoice.user_phone, Invoice.invoice_number, Invoice.client_name, Invoice.amount, Invoice.due_date)
+                .execution_options(synchronize_session=False)
+            )).all()
+            # Passage en retard : résumé mis à jour dans la même transaction
+            await apply_invoice_changes(db, [
+                InvoiceChange(row.user_phone, row.amount, row.due_date, status, "overdue") for row in claimed
+            ])
+            outbound = await self.outbox.add(db, [(row.user_phone, self._format(row._asdict(), template)) for row in claimed])
+            await db.commit()
+
+        last_key = (page[-1].due_date, page[-1].id)
+        return last_key, outbound
+
+    @staticmethod
+    def _format(invoice: dict, template: str) -> str:
+        number = invoice["invoice_number"] or str(invoice["id"])
+        due = invoice["due_date"].strftime("%d/%m/%Y") if invoice["due_date"] else "?"
+        amount = f"{invoice['amount']:.2f} €" if invoice["amount"] is not None else "montant non renseigné"
+        return f"""⏰ **Facture n°{number} en retard**
+Client : {invoice['client_name'] or 'non renseigné'} • {amount} • échéance {due}
+
+Voici le message à envoyer à ton client :
+{template.format(number=number, due=due)}
+
+💡 **Astuce :** Toujours rester professionnel et garder une trace écrite !"""
+
+    async def _loop(self):
+        while True:
+            if self.coordinator is not None and not self.coordinator.is_leader:
+                # Rôle revérifié au prochain renouvellement des baux
+                await asyncio.sleep(self.coordinator.renew_interval)
+                continue
+            try:
+                await mark_overdue()
+                if self.enabled:
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur planificateur de relances: {str(e)}")
+            await asyncio.sleep(self.interval)
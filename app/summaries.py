@@ -0,0 +1,204 @@
+# =====================================
+# app/summaries.py
+# =====================================
+import sys
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import and_, bindparam, case, delete, func, insert, select, update
+from .database import close_db, get_async_db, insert_ignore_conflicts
+from .models import Invoice, InvoiceSummary
+
+logger = logging.getLogger(__name__)
+
+# Statuts encore à encaisser (voir reminders.OPEN_STATUSES) ; "sent" : pas encore échue,
+# passée à "overdue" par mark_overdue dès le lendemain de l'échéance
+OUTSTANDING_STATUSES = ("sent", "overdue")
+
+_COUNTERS = ("invoice_count", "draft_count", "outstanding_count", "outstanding_amount", "overdue_count", "overdue_amount")
+
+@dataclass
+class InvoiceChange:
+    """Création (old_status None) ou changement de statut d'une facture"""
+    user_phone: str
+    amount: Optional[float]
+    due_date: Optional[datetime]
+    old_status: Optional[str]
+    new_status: str
+
+def overdue_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Début du jour : une facture "sent" échue avant cette date est en retard"""
+    return (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _count(totals: Dict[str, float], status: Optional[str], amount: float, sign: int):
+    """Ajoute (sign=1) ou retire (sign=-1) la part d'une facture selon son statut"""
+    if status is None:
+        return
+    totals["invoice_count"] += sign
+    if status == "draft":
+        totals["draft_count"] += sign
+    elif status in OUTSTANDING_STATUSES:
+        totals["outstanding_count"] += sign
+        totals["outstanding_amount"] += sign * amount
+        if status == "overdue":
+            totals["overdue_count"] += sign
+            totals["overdue_amount"] += sign * amount
+
+def summary_deltas(changes: Iterable[InvoiceChange]) -> Dict[str, Dict[str, float]]:
+    """Variations des compteurs par utilisateur"""
+    deltas: Dict[str, Dict[str, float]] = {}
+    for change in changes:
+        if change.old_status == change.new_status:
+            continue
+        totals = deltas.get(change.user_phone)
+        if totals is None:
+            totals = deltas[change.user_phone] = dict.fromkeys(_COUNTERS, 0)
+        _count(totals, change.old_status, change.amount or 0.0, -1)
+        _count(totals, change.new_status, change.amount or 0.0, 1)
+    return deltas
+
+async def apply_invoice_changes(db, changes: List[InvoiceChange]):
+    """Répercute créations et changements de statut sur les résumés
+
+    À appeler dans la transaction qui écrit les factures (avant le commit) :
+    facture et résumé sont validés ensemble. Les compteurs sont incrémentés
+    en SQL (sûr entre processus) ; la prochaine échéance (à partir
+    d'aujourd'hui) n'est recalculée que pour les utilisateurs dont une facture
+    "sent" apparaît ou disparaît, par une recherche sur l'index
+    (user_phone, status, due_date).
+    """
+    deltas = summary_deltas(changes)
+    if not deltas:
+        return
+    table = InvoiceSummary.__table__
+    await db.execute(
+        insert_ignore_conflicts(InvoiceSummary, ["user_phone"]),
+        [dict(dict.fromkeys(_COUNTERS, 0), user_phone=phone) for phone in deltas]
+    )
+    await db.execute(
+        update(table)
+        .where(table.c.user_phone == bindparam("phone"))
+        .values(
+            updated_at=func.now(),
+            **{name: table.c[name] + bindparam(f"d_{name}") for name in _COUNTERS}
+        ),
+        [dict(phone=phone, **{f"d_{name}": value for name, value in totals.items()}) for phone, totals in deltas.items()]
+    )
+
+    due_changed = {
+        change.user_phone for change in changes
+        if change.old_status != change.new_status and "sent" in (change.old_status, change.new_status)
+    }
+    today = overdue_cutoff()
+    for phone in due_changed:
+        # Requête par utilisateur, sans GROUP BY : MIN lu en une recherche d'index
+        next_due = (await db.execute(
+            select(func.min(Invoice.due_date))
+            .where(Invoice.user_phone == phone, Invoice.status == "sent", Invoice.due_date >= today)
+        )).scalar()
+        await db.execute(update(table).where(table.c.user_phone == phone).values(next_due_date=next_due))
+
+async def mark_overdue(now: Optional[datetime] = None, batch_size: int = 500) -> int:
+    """Passe en "overdue" les factures "sent" échues avant aujourd'hui ; retourne leur nombre
+
+    Parcours de l'index (status, due_date) par pages ; chaque page et la mise
+    à jour des résumés forment une transaction. Indépendant des relances
+    (exécuté même avec REMINDERS_ENABLED=false, voir ReminderScheduler).
+    """
+    cutoff = overdue_cutoff(now)
+    moved = 0
+    while True:
+        async with get_async_db() as db:
+            ids = (await db.execute(
+                select(Invoice.id)
+                .where(Invoice.status == "sent", Invoice.due_date < cutoff)
+                .order_by(Invoice.due_date, Invoice.id)
+                .limit(batch_size)
+            )).scalars().all()
+            if not ids:
+                break
+            # Conditionnelle : une facture payée entre-temps reste payée
+            changed = (await db.execute(
+                update(Invoice)
+                .where(Invoice.id.in_(ids), Invoice.status == "sent")
+                .values(status="overdue")
+                .returning(Invoice.user_phone, Invoice.amount, Invoice.due_date)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await apply_invoice_changes(db, [
+                InvoiceChange(row.user_phone, row.amount, row.due_date, "sent", "overdue") for row in changed
+            ])
+            await db.commit()
+        moved += len(changed)
+    if moved:
+        logger.info("%d factures passées en retard", moved)
+    return moved
+
+async def get_summary(user_phone: str) -> Optional[dict]:
+    """Résumé de facturation d'un utilisateur (une ligne, aucune agrégation)"""
+    async with get_async_db() as db:
+        row = (await db.execute(
+            select(InvoiceSummary).where(InvoiceSummary.user_phone == user_phone)
+        )).scalar_one_or_none()
+        if row is None:
+            return None
+        return {name: getattr(row, name) for name in _COUNTERS + ("next_due_date", "updated_at")}
+
+def rebuild_statements(user_phone: Optional[str] = None, now: Optional[datetime] = None):
+    """DELETE puis INSERT ... SELECT recalculant les résumés depuis la table invoices
+
+    Mêmes règles que la mise à jour incrémentale : le retard est le statut
+    "overdue" (mark_overdue au préalable), la prochaine échéance la plus
+    proche des factures "sent" à partir d'aujourd'hui.
+    """
+    outstanding = Invoice.status.in_(OUTSTANDING_STATUSES)
+    overdue = Invoice.status == "overdue"
+    upcoming = and_(Invoice.status == "sent", Invoice.due_date >= overdue_cutoff(now))
+    aggregate = (
+        select(
+            Invoice.user_phone,
+            func.count(Invoice.id),
+            func.count(case((Invoice.status == "draft", 1))),
+            func.count(case((outstanding, 1))),
+            func.coalesce(func.sum(case((outstanding, Invoice.amount))), 0.0),
+            func.count(case((overdue, 1))),
+            func.coalesce(func.sum(case((overdue, Invoice.amount))), 0.0),
+            func.min(case((upcoming, Invoice.due_date))),
+            func.now(),
+        )
+        .where(Invoice.user_phone != None)  # noqa: E711
+        .group_by(Invoice.user_phone)
+    )
+    clear = delete(InvoiceSummary)
+    if user_phone is not None:
+        aggregate = aggregate.where(Invoice.user_phone == user_phone)
+        clear = clear.where(InvoiceSummary.user_phone == user_phone)
+    fill = insert(InvoiceSummary).from_select(["user_phone", *_COUNTERS, "next_due_date", "updated_at"], aggregate)
+    return clear, fill
+
+async def rebuild_summaries(user_phone: Optional[str] = None) -> int:
+    """Recalcule les résumés (réparation) ; retourne le nombre de lignes écrites"""
+    await mark_overdue()
+    clear, fill = rebuild_statements(user_phone)
+    async with get_async_db() as db:
+        # Une transaction : les lecteurs voient l'ancien résumé ou le nouveau
+        await db.execute(clear)
+        result = await db.execute(fill)
+        await db.commit()
+    logger.info("%d résumés de facturation reconstruits", result.rowcount)
+    return result.rowcount
+
+async def _main(argv: List[str]):
+    user_phone = argv[0] if argv else None
+    try:
+        count = await rebuild_summaries(user_phone)
+    finally:
+        await close_db()
+    print(f"{count} résumé(s) reconstruit(s)" + (f" pour {user_phone}" if user_phone else ""))
+
+if __name__ == "__main__":
+    # python -m app.summaries [numéro] : reconstruit tous les résumés ou celui d'un utilisateur
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,145 @@
+# =====================================
+# app/users.py
+# =====================================
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from sqlalchemy import bindparam, select, update
+from .cache import LRUCache
+from .database import get_async_db, insert_ignore_conflicts
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class UserProfile:
+    """Copie détachée d'un utilisateur, conservée en cache"""
+    id: int
+    phone: str
+    name: Optional[str]
+    business_type: Optional[str]
+
+class UserStore:
+    """Cache des utilisateurs par téléphone avec écriture différée de last_active
+
+    Les profils sont servis depuis un cache LRU borné ; les absents sont
+    chargés en une requête et créés par un upsert sûr en concurrence.
+    Les dates de dernière activité sont fusionnées en mémoire puis écrites
+    par lots à intervalle régulier.
+    """
+
+    def __init__(self):
+        self.cache = LRUCache(
+            max_size=int(os.getenv("USER_CACHE_SIZE", "5000")),
+            ttl=float(os.getenv("USER_CACHE_TTL", "600"))
+        )
+        self.flush_interval = float(os.getenv("LAST_ACTIVE_FLUSH_INTERVAL", "30"))
+        self._last_active: Dict[str, datetime] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    async def start(self):
+        """Démarre l'écriture périodique des last_active"""
+        if self._flush_task is None:
+            self._stopping = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Arrête l'écriture périodique et écrit les dernières dates en attente
+
+        La boucle n'est pas annulée : une écriture en cours se termine avant
+        l'écriture finale.
+        """
+        if self._flush_task is not None:
+            self._stopping.set()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def get_many(self, db, phones: Iterable[str]) -> Dict[str, UserProfile]:
+        """Obtient ou crée les utilisateurs (cache, puis une requête pour les absents)"""
+        profiles = {}
+        missing = []
+        for phone in set(phones):
+            profile = self.cache.get(phone)
+            if profile is None:
+                missing.append(phone)
+            else:
+                profiles[phone] = profile
+
+        if missing:
+            loaded = await self._load(db, missing)
+            to_create = [phone for phone in missing if phone not in loaded]
+            if to_create:
+                # Upsert : un utilisateur créé en parallèle par un autre worker est ignoré
+                await db.execute(
+                    insert_ignore_conflicts(User, ["phone"]),
+                    [{"phone": phone, "business_type": "unknown"} for phone in to_create]
+                )
+                await db.commit()
+                loaded.update(await self._load(db, to_create))
+            for phone, profile in loaded.items():
+                self.cache.set(phone, profile)
+                profiles[phone] = profile
+
+        return profiles
+
+    async def _load(self, db, phones: list) -> Dict[str, UserProfile]:
+        rows = await db.execute(
+            select(User.id, User.phone, User.name, User.business_type).where(User.phone.in_(phones))
+        )
+        return {row.phone: UserProfile(row.id, row.phone, row.name, row.business_type) for row in rows}
+
+    def invalidate(self, phone: str):
+        """Retire un utilisateur du cache (après modification de son profil)"""
+        self.cache.pop(phone)
+
+    def touch(self, phones: Iterable[str], when: Optional[datetime] = None):
+        """Enregistre en mémoire la dernière activité (écrite au prochain flush)"""
+        when = when or datetime.now()
+        for phone in phones:
+            previous = self._last_active.get(phone)
+            if previous is None or previous < when:
+                self._last_active[phone] = when
+
+    async def flush(self) -> int:
+        """Écrit les last_active en attente (un seul UPDATE par lot)"""
+        if not self._last_active:
+            return 0
+        # Échange avant toute attente : touch() ne peut pas s'intercaler
+        pending, self._last_active = self._last_active, {}
+        try:
+            await self._write_last_active(pending)
+            return len(pending)
+        except Exception as e:
+            # Remettre les dates non écrites (sans écraser une date plus récente)
+            for phone, when in pending.items():
+                self.touch([phone], when)
+            logger.error(f"Erreur écriture last_active: {str(e)}")
+            return 0
+        except BaseException:
+            # Annulation pendant l'écriture : dates remises avant de propager
+            for phone, when in pending.items():
+                self.touch([phone], when)
+            raise
+
+    async def _write_last_active(self, pending: Dict[str, datetime]):
+        async with get_async_db() as db:
+            users = User.__table__
+            await db.execute(
+                update(users)
+                .where(users.c.phone == bindparam("b_phone"))
+                .values(last_active=bindparam("b_last_active")),
+                [{"b_phone": phone, "b_last_active": when} for phone, when in pending.items()]
+            )
+            await db.commit()
+
+    async def _flush_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush()
@@ -2,14 +2,38 @@
 # app/whatsapp.py
 # =====================================
 import os
-import requests
-from typing import Optional
+import asyncio
+from typing import TYPE_CHECKING, List, Optional
 import logging
-import json
 import hashlib  # LOG: empreinte du token
+import time
+from dataclasses import dataclass
+from .metrics import WHATSAPP_SEND_SECONDS
+
+if TYPE_CHECKING:
+    import httpx
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class SendResult:
+    """Résultat d'une tentative d'envoi"""
+    ok: bool
+    status: Optional[int] = None  # None : erreur réseau ou délai dépassé
+    error: str = ""
+    retry_after: Optional[float] = None
+
+    @property
+    def retryable(self) -> bool:
+        """Limitation de débit, erreur serveur ou réseau : une nouvelle tentative peut réussir"""
+        return not self.ok and (self.status is None or self.status == 429 or self.status >= 500)
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
 class WhatsAppHandler:
     def __init__(self):
         self.access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
@@ -18,7 +42,18 @@ class WhatsAppHandler:
         self.business_account_id = os.getenv("WHATSAPP_BUSINESS_ACCOUNT_ID")
         
         # NOTE: on ne change pas ta version (v18.0), on la LOG uniquement
-        self.base_url = f"https://graph.facebook.com/v18.0/{self.phone_number_id}"
+        # WHATSAPP_GRAPH_URL : permet de pointer vers un faux serveur Graph en test
+        self.graph_url = os.getenv("WHATSAPP_GRAPH_URL", "https://graph.facebook.com").rstrip("/") + "/v18.0"
+        self.base_url = f"{self.graph_url}/{self.phone_number_id}"
+        
+        # Client HTTP asynchrone partagé (connexions keep-alive réutilisées)
+        self.connect_timeout = float(os.getenv("WHATSAPP_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(os.getenv("WHATSAPP_READ_TIMEOUT", "30"))
+        self.max_concurrency = int(os.getenv("WHATSAPP_MAX_CONCURRENCY", "10"))
+        # Créé par start() : httpx n'est importé qu'au premier appel
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._send_slots = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0  # appels Graph API en cours (saturation de _send_slots)
         
         if not all([self.access_token, self.phone_number_id]):
             logger.warning("Configuration WhatsApp Cloud API incomplète")
@@ -37,11 +72,51 @@ class WhatsAppHandler:
             if "v18.0" in self.base_url:
                 logger.warning("[WA:init] API version détectée: v18.0 (info)")
 
+    async def start(self):
+        """Ouvre le pool de connexions vers la Graph API (au premier appel)"""
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        """Ferme le pool de connexions"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def auth_headers(self) -> dict:
+        """En-tête d'authentification Graph API"""
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    async def get_media_info(self, media_id: str) -> dict:
+        """Résout un identifiant de média : url de téléchargement, mime_type, file_size, sha256"""
+        client = await self.start()
+        async with self._send_slots:
+            self.in_flight += 1
+            try:
+                response = await client.get(f"{self.graph_url}/{media_id}", headers=self.auth_headers())
+            finally:
+                self.in_flight -= 1
+        response.raise_for_status()
+        return response.json()
+
     async def send_message(self, to: str, message: str) -> bool:
         """Envoie un message WhatsApp via Cloud API"""
+        result = await self.deliver(to, message)
+        return result.ok
+
+    async def deliver(self, to: str, message: str) -> "SendResult":
+        """Envoie un message (une tentative) et retourne le détail du résultat"""
         if not self.access_token:
             logger.error("Token WhatsApp non configuré")
-            return False
+            return SendResult(ok=False, error="token non configuré")
         
         clean_to = to.replace("whatsapp:", "").replace("+", "")
             
@@ -58,39 +133,44 @@ class WhatsAppHandler:
             "text": {"body": message}
         }
         
-        # ==== LOG AVANT APPEL ====
-        try:
-            payload_txt = json.dumps(data, ensure_ascii=False)
-        except Exception:
-            payload_txt = "<payload non sérialisable>"
-        logger.warning("[WA:send] POST %s | to_raw=%s | to_clean=%s | payload=%s", url, to, clean_to, payload_txt)
+        # Contenu du message jamais journalisé (voir logging_config)
+        logger.debug("[WA:send] POST %s", url, extra={"phone": clean_to, "body_len": len(message)})
 
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-
-            # ==== LOG APRÈS APPEL (toujours) ====
+            client = await self.start()
+            status = "error"
+            started = time.perf_counter()
             try:
-                body_text = response.text
-            except Exception:
-                body_text = "<no-text>"
-            logger.warning("[WA:send] status=%s | ok=%s", response.status_code, response.ok)
-            logger.warning("[WA:send] response_body=%s", body_text)
-
-            # Si erreur HTTP, on log déjà le corps exact, puis on raise pour conserver le comportement actuel
-            response.raise_for_status()
+                async with self._send_slots:
+                    self.in_flight += 1
+                    try:
+                        response = await client.post(url, headers=headers, json=data)
+                    finally:
+                        self.in_flight -= 1
+                status = response.status_code
+            finally:
+                WHATSAPP_SEND_SECONDS.observe(time.perf_counter() - started, status=status)
+
+            logger.debug("[WA:send] status=%s", response.status_code)
+
+            # Corps de la réponse journalisé seulement en cas d'erreur
+            if response.is_error:
+                text = response.text
+                logger.error("[WA:send] HTTPError status=%s body=%s", response.status_code, text[:500])
+                return SendResult(
+                    ok=False,
+                    status=response.status_code,
+                    error=text[:500],
+                    retry_after=_parse_retry_after(response.headers.get("Retry-After"))
+                )
             
             result = response.json()
-            logger.info("Message envoyé - ID: %s", result.get('messages', [{}])[0].get('id', 'unknown'))
-            return True
+            logger.debug("Message envoyé - ID: %s", result.get('messages', [{}])[0].get('id', 'unknown'))
+            return SendResult(ok=True, status=response.status_code)
             
-        except requests.HTTPError as e:
-            status = getattr(e.response, "status_code", "unknown")
-            text = getattr(e.response, "text", str(e))
-            logger.error("[WA:send] HTTPError status=%s body=%s", status, text)
-            return False
         except Exception as e:
             logger.error("Erreur envoi WhatsApp (Exception): %s", str(e))
-            return False
+            return SendResult(ok=False, error=str(e)[:500])
     
     def verify_webhook(self, mode: str, token: str, challenge: str) -> Optional[str]:
         """Vérifie le webhook WhatsApp lors de la configuration"""
@@ -102,25 +182,37 @@ class WhatsAppHandler:
             return None
     
     def parse_webhook_message(self, webhook_data: dict) -> Optional[dict]:
-        """Parse les données du webhook WhatsApp"""
-        try:
-            # LOG pour distinguer 'messages' vs 'statuses'
-            try:
-                logger.warning("[WA:webhook] keys=%s", list(webhook_data.keys()))
-            except Exception:
-                pass
+        """Parse les données du webhook WhatsApp (premier message uniquement)"""
+        messages = self.parse_webhook_messages(webhook_data)
+        return messages[0] if messages else None
 
-            entry = webhook_data.get("entry", [{}])[0]
-            changes = entry.get("changes", [{}])[0]
-            value = changes.get("value", {})
+    def parse_webhook_messages(self, webhook_data: dict) -> List[dict]:
+        """Parse tous les messages d'un webhook WhatsApp (Meta regroupe entrées, changements et messages)"""
+        parsed_messages = []
+        try:
+            for entry in webhook_data.get("entry") or []:
+                for changes in entry.get("changes") or []:
+                    value = changes.get("value", {})
+                    
+                    messages = value.get("messages")
+                    if not messages:
+                        logger.debug("[WA:webhook] pas de 'messages' (probablement un status). value_keys=%s", list(value.keys()))
+                        continue
+                    
+                    for message in messages:
+                        parsed_data = self._parse_message(message)
+                        if parsed_data:
+                            parsed_messages.append(parsed_data)
             
-            messages = value.get("messages")
-            if not messages:
-                logger.warning("[WA:webhook] pas de 'messages' (probablement un status). value_keys=%s", list(value.keys()))
-                return None
-                
-            message = messages[0]
+            return parsed_messages
             
+        except Exception as e:
+            logger.error("Erreur parsing webhook: %s", str(e))
+            return parsed_messages
+
+    def _parse_message(self, message: dict) -> Optional[dict]:
+        """Parse un message individuel du webhook"""
+        try:
             parsed_data = {
                 "message_id": message.get("id"),
                 "from": message.get("from"),
@@ -136,10 +228,10 @@ class WhatsAppHandler:
                 parsed_data["media_url"] = message.get("image", {}).get("id")
                 parsed_data["body"] = message.get("image", {}).get("caption", "")
 
-            logger.warning("[WA:webhook] parsed from=%s type=%s body_len=%d", parsed_data["from"], parsed_data["type"], len(parsed_data["body"] or ""))
+            logger.debug("[WA:webhook] message type=%s body_len=%d", parsed_data["type"], len(parsed_data["body"] or ""), extra={"phone": parsed_data["from"]})
 
             return parsed_data
             
         except Exception as e:
-            logger.error("Erreur parsing webhook: %s", str(e))
+            logger.error("Erreur parsing message: %s", str(e))
             return None
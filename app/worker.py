@@ -0,0 +1,341 @@
+# =====================================
+# app/worker.py
+# =====================================
+import os
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Set
+from sqlalchemy import or_, select, update
+from .database import get_async_db, insert_ignore_conflicts
+from .coordination import shard_key
+from .models import PendingMessage
+from .cache import RecentIdSet
+from .lanes import KeyedLaneScheduler
+
+logger = logging.getLogger(__name__)
+
+class MessageWorkerPool:
+    """File d'attente durable des messages entrants (table pending_messages)
+
+    Le webhook se contente d'insérer les messages puis répond 200 ;
+    un répartiteur réserve les lignes par lots et les répartit par
+    utilisateur : les messages d'un utilisateur sont traités dans l'ordre,
+    ceux d'utilisateurs différents en parallèle (WORKER_CONCURRENCY au plus).
+    Une réservation expirée (crash, redémarrage) est reprise automatiquement.
+    Avec plusieurs processus, chacun ne réserve que les messages des
+    partitions d'utilisateurs qu'il détient (voir Coordinator).
+    """
+
+    def __init__(self, coach, outbox, coordinator=None):
+        self.coach = coach
+        self.outbox = outbox
+        self.coordinator = coordinator
+        self.concurrency = int(os.getenv("WORKER_CONCURRENCY", "4"))
+        self.batch_size = int(os.getenv("WORKER_BATCH_SIZE", "20"))
+        self.poll_interval = float(os.getenv("WORKER_POLL_INTERVAL", "2.0"))
+        self.claim_timeout = float(os.getenv("WORKER_CLAIM_TIMEOUT", "300"))
+        self.max_attempts = int(os.getenv("WORKER_MAX_ATTEMPTS", "3"))
+        # Délai avant nouvelle tentative d'un lot en erreur (base indisponible...)
+        self.retry_delay = float(os.getenv("WORKER_RETRY_DELAY", "30"))
+        # Attente des traitements en cours à l'arrêt (sous GUNICORN_GRACEFUL_TIMEOUT)
+        self.drain_timeout = float(os.getenv("WORKER_DRAIN_TIMEOUT", "10"))
+
+        # Identifiants WhatsApp récemment reçus : filtre O(1) des redistributions
+        # avant tout accès base (l'index unique message_id couvre les redémarrages
+        # et les autres processus)
+        self.recent_message_ids = RecentIdSet(int(os.getenv("DEDUP_CACHE_SIZE", "10000")))
+
+        # Messages réservés en mémoire au plus (contre-pression sur le répartiteur)
+        self.max_pending = int(os.getenv("WORKER_MAX_PENDING", str(self.concurrency * self.batch_size)))
+
+        self.lanes = KeyedLaneScheduler(self._handle, self.concurrency, max_batch=self.batch_size)
+        self._pending_items: Dict[int, dict] = {}
+        self._wakeup: asyncio.Event = None
+        self._tasks: List[asyncio.Task] = []
+
+        if coordinator is not None:
+            coordinator.add_busy_source(self._busy_shards)
+            coordinator.on_change(self._wake)
+
+    def _busy_shards(self) -> Set[int]:
+        return {item["shard_key"] % self.coordinator.shards for item in self._pending_items.values()}
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        """Démarre le répartiteur et les workers"""
+        self._wakeup = asyncio.Event()
+        await self.lanes.start()
+        self._tasks = [asyncio.create_task(self._dispatch_loop())]
+        logger.info(f"Pool de workers démarré ({self.concurrency} workers)")
+
+    async def stop(self):
+        """Cesse de réserver, laisse finir les lots en cours (drain_timeout au plus) puis rend les autres
+
+        Les messages non terminés redeviennent réservables aussitôt : un autre
+        processus ou le prochain démarrage les traite sans attendre claim_timeout.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._pending_items:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.drain_timeout
+            while self._pending_items and loop.time() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+
+        # Relevés avant l'annulation des lots en cours (qui les retire de _pending_items)
+        remaining = list(self._pending_items.values())
+        await self.lanes.stop()
+        self._pending_items.clear()
+        if not remaining:
+            return
+        try:
+            await self._release(remaining)
+            logger.warning(f"{len(remaining)} messages non traités à l'arrêt, rendus pour reprise")
+        except Exception as e:
+            # Réservations reprises après claim_timeout
+            logger.error(f"Erreur libération des messages en attente: {str(e)}")
+
+    async def enqueue(self, parsed_messages: List[dict]) -> int:
+        """Persiste les messages reçus (une transaction, doublons ignorés) et réveille le répartiteur"""
+        new_messages = []
+        new_ids = set()
+        for parsed_message in parsed_messages:
+            message_id = parsed_message.get("message_id")
+            if message_id:
+                if message_id in self.recent_message_ids or message_id in new_ids:
+                    logger.debug("Message %s déjà reçu, ignoré", message_id)
+                    continue
+                new_ids.add(message_id)
+            new_messages.append(parsed_message)
+
+        if not new_messages:
+            return 0
+        await self._insert_pending(new_messages)
+        # Mémorisés seulement une fois persistés : un échec laisse Meta renvoyer le message
+        for message_id in new_ids:
+            self.recent_message_ids.add(message_id)
+        self._wake()
+        return len(new_messages)
+
+    # ---------- Accès base ----------
+
+    async def _insert_pending(self, parsed_messages: List[dict]):
+        async with get_async_db() as db:
+            # Un message_id déjà présent en base (redistribution après redémarrage) est ignoré
+            await db.execute(
+                insert_ignore_conflicts(PendingMessage, ["message_id"]),
+                [
+                    {
+                        "message_id": parsed_message.get("message_id"),
+                        "user_phone": parsed_message["from"],
+                        "shard_key": shard_key(parsed_message["from"]),
+                        "message": parsed_message["body"],
+                        "media_url": parsed_message["media_url"],
+                        "received_at": datetime.now(),
+                        "processed": False,
+                        "attempts": 0,
+                    }
+                    for parsed_message in parsed_messages
+                ]
+            )
+            await db.commit()
+
+    async def _claim_batch(self, limit: int) -> List[dict]:
+        """Réserve atomiquement un lot de messages (sûr entre plusieurs processus)"""
+        token = uuid.uuid4().hex
+        now = datetime.now()
+        stale_before = now - timedelta(seconds=self.claim_timeout)
+        claimable = [
+            PendingMessage.processed == False,  # noqa: E712
+            or_(PendingMessage.claimed_at == None, PendingMessage.claimed_at < stale_before),  # noqa: E711
+        ]
+        if self.coordinator is not None:
+            owned = self.coordinator.owned
+            if not owned:
+                return []
+            shards = [(PendingMessage.shard_key % self.coordinator.shards).in_(owned)]
+            if 0 in owned:
+                # Lignes antérieures à la partition
+                shards.append(PendingMessage.shard_key == None)  # noqa: E711
+            claimable.append(or_(*shards))
+        async with get_async_db() as db:
+            ids = (await db.execute(
+                select(PendingMessage.id).where(*claimable).order_by(PendingMessage.id).limit(limit)
+            )).scalars().all()
+            if not ids:
+                return []
+            await db.execute(
+                update(PendingMessage)
+                .where(PendingMessage.id.in_(ids), *claimable)
+                .values(claimed_by=token, claimed_at=now, attempts=PendingMessage.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            rows = (await db.execute(
+                select(PendingMessage).where(PendingMessage.claimed_by == token).order_by(PendingMessage.id)
+            )).scalars().all()
+            return [
+                {
+                    "id": row.id,
+                    "claim": token,
+                    "user_phone": row.user_phone,
+                    "shard_key": row.shard_key if row.shard_key is not None else 0,
+                    "message": row.message or "",
+                    "media_url": row.media_url,
+                    "attempts": row.attempts or 0,
+                }
+                for row in rows
+            ]
+
+    @staticmethod
+    def _processed_update(batch: List[dict]):
+        """Passage à traité des messages encore réservés par ce lot (ids retournés)"""
+        return (
+            update(PendingMessage)
+            .where(
+                PendingMessage.id.in_([item["id"] for item in batch]),
+                PendingMessage.claimed_by.in_({item["claim"] for item in batch})
+            )
+            .values(processed=True)
+            .returning(PendingMessage.id)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def _mark_processed(self, batch: List[dict]):
+        async with get_async_db() as db:
+            await db.execute(self._processed_update(batch))
+            await db.commit()
+
+    async def _complete(self, batch: List[dict], responses: List[str]):
+        """Réponses enregistrées dans la file d'envoi et messages marqués traités, en une transaction
+
+        Seuls les messages dont la réservation tient encore reçoivent leur
+        réponse (une réservation expirée a pu être reprise ailleurs).
+        """
+        async with get_async_db() as db:
+            processed = set((await db.execute(self._processed_update(batch))).scalars().all())
+            outbound = await self.outbox.add(db, [
+                (item["user_phone"], response) for item, response in zip(batch, responses) if item["id"] in processed
+            ])
+            await db.commit()
+        self.outbox.submit(outbound)
+        return len(outbound)
+
+    async def _release_for_retry(self, batch: List[dict]):
+        """Réservation raccourcie : le lot redevient réservable après retry_delay"""
+        retry_at = datetime.now() - timedelta(seconds=max(0.0, self.claim_timeout - self.retry_delay))
+        async with get_async_db() as db:
+            await db.execute(
+                update(PendingMessage)
+                .where(
+                    PendingMessage.id.in_([item["id"] for item in batch]),
+                    PendingMessage.claimed_by.in_({item["claim"] for item in batch}),
+                    PendingMessage.processed == False  # noqa: E712
+                )
+                .values(claimed_at=retry_at)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _release(self, items: List[dict]):
+        """Lève la réservation de messages non terminés (arrêt du processus)
+
+        Un message jamais confié au coach récupère la tentative comptée par sa réservation.
+        """
+        async with get_async_db() as db:
+            for started in (True, False):
+                batch = [item for item in items if item.get("started", False) == started]
+                if not batch:
+                    continue
+                values = {"claimed_by": None, "claimed_at": None}
+                if not started:
+                    values["attempts"] = PendingMessage.attempts - 1
+                await db.execute(
+                    update(PendingMessage)
+                    .where(
+                        PendingMessage.id.in_([item["id"] for item in batch]),
+                        PendingMessage.claimed_by.in_({item["claim"] for item in batch}),
+                        PendingMessage.processed == False  # noqa: E712
+                    )
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+
+    # ---------- Boucles asynchrones ----------
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                room = min(self.batch_size, self.max_pending - self.lanes.pending)
+                batch = await self._claim_batch(room) if room > 0 else []
+                for item in batch:
+                    waiting = self._pending_items.get(item["id"])
+                    if waiting is not None:
+                        # Réservation expirée puis reprise alors que le message attend encore ici
+                        waiting["claim"] = item["claim"]
+                        continue
+                    self._pending_items[item["id"]] = item
+                    self.lanes.submit(item["user_phone"], item)
+                if batch:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur réservation des messages en attente: {str(e)}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _handle(self, phone: str, batch: List[dict]):
+        """Traite les messages en attente d'un utilisateur (dans l'ordre de réception)"""
+        for item in batch:
+            item["started"] = True
+        try:
+            await self._process(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur traitement lot de {len(batch)} messages: {str(e)}")
+            abandoned = [item for item in batch if item["attempts"] >= self.max_attempts]
+            retried = [item for item in batch if item["attempts"] < self.max_attempts]
+            try:
+                if abandoned:
+                    logger.error(f"{len(abandoned)} messages abandonnés après {self.max_attempts} tentatives")
+                    await self._mark_processed(abandoned)
+                if retried:
+                    await self._release_for_retry(retried)
+            except Exception as e:
+                # Base toujours indisponible : reprise après claim_timeout
+                logger.error(f"Erreur mise à jour des messages en échec: {str(e)}")
+        finally:
+            for item in batch:
+                self._pending_items.pop(item["id"], None)
+            # De la place s'est libérée : le répartiteur peut réserver la suite
+            self._wakeup.set()
+
+    async def _process(self, batch: List[dict]):
+        # Erreurs propagées tant qu'une tentative reste : le lot est repris après
+        # claim_timeout ; à la dernière, les messages en erreur reçoivent l'excuse
+        retry_left = any(item["attempts"] < self.max_attempts for item in batch)
+        response_messages = await self.coach.process_messages(batch, raise_errors=retry_left)
+
+        # File d'envoi durable : ordre conservé par destinataire,
+        # débit et reprises gérés par OutboundQueue
+        queued = await self._complete(batch, response_messages)
+        logger.debug("%d réponses mises en file d'envoi", queued)
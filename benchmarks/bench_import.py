@@ -0,0 +1,135 @@
+# =====================================
+# benchmarks/bench_import.py
+# =====================================
+"""Banc de l'import en flux de factures (POST /invoices/import)
+
+Lance l'application dans un processus uvicorn séparé (base SQLite
+temporaire), puis envoie un fichier CSV ou NDJSON généré à la volée (jamais
+entièrement en mémoire, quelques lignes invalides incluses). Pendant
+l'import, la mémoire résidente du serveur est échantillonnée : elle doit
+rester stable quelle que soit la taille du fichier.
+
+    python -m benchmarks.bench_import [--rows 100000] [--format csv] [--error-rate 0.001]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.bench_startup import ROOT, free_port
+
+TOKEN = "bench-import-token"
+
+def rss_kb(pid: int) -> int:
+    """Mémoire résidente d'un processus (Linux)"""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+def generate_rows(count: int, fmt: str, error_rate: float, seed: int = 7):
+    """Lignes de factures réalistes (formats de dates et montants variés)"""
+    rng = random.Random(seed)
+    if fmt == "csv":
+        yield "Numéro;Client;Montant;Date;Échéance;Statut\n"
+    statuses = ["envoyée", "payée", "en retard", "sent", "paid", ""]
+    for index in range(count):
+        day, month = rng.randint(1, 28), rng.randint(1, 12)
+        amount = rng.uniform(50, 5000)
+        invalid = rng.random() < error_rate
+        if fmt == "csv":
+            amount_text = "n/a" if invalid else f"{amount:,.2f}".replace(",", " ").replace(".", ",")
+            yield f"F-{index:07d};\"Client {index % 500}\";{amount_text};{day:02d}/{month:02d}/2024;2024-{month:02d}-{day:02d};{rng.choice(statuses)}\n"
+        else:
+            amount_value = "n/a" if invalid else round(amount, 2)
+            yield (
+                f'{{"invoice_number": "F-{index:07d}", "client": "Client {index % 500}", "amount": "{amount_value}", '
+                f'"date": "{day:02d}/{month:02d}/2024", "due_date": "2024-{month:02d}-{day:02d}", "status": "{rng.choice(statuses)}"}}\n'
+            )
+
+async def body(count: int, fmt: str, error_rate: float, block_rows: int = 500):
+    block = []
+    for line in generate_rows(count, fmt, error_rate):
+        block.append(line)
+        if len(block) >= block_rows:
+            yield "".join(block).encode()
+            block = []
+            await asyncio.sleep(0)
+    if block:
+        yield "".join(block).encode()
+
+async def run(args):
+    import httpx
+
+    workdir = tempfile.mkdtemp(prefix="bench-import-")
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'import.db')}",
+        "MEDIA_STORAGE_DIR": os.path.join(workdir, "media"),
+        "IMPORT_API_TOKEN": TOKEN,
+        "REMINDERS_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+        "PYTHONPATH": ROOT,
+        # Cache de pages et mmap SQLite (64 Mo / 256 Mo par défaut) réduits : sinon
+        # comptés dans la mémoire résidente, ils masquent celle de l'import
+        "SQLITE_CACHE_SIZE_KB": str(args.sqlite_cache_kb),
+        "SQLITE_MMAP_SIZE": "0",
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    samples = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+            for _ in range(300):
+                try:
+                    if (await client.get("/ready")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.05)
+            baseline = rss_kb(server.pid)
+
+            async def sample():
+                while True:
+                    samples.append(rss_kb(server.pid))
+                    await asyncio.sleep(0.05)
+
+            sampler = asyncio.create_task(sample())
+            started = time.perf_counter()
+            response = await client.post(
+                "/invoices/import",
+                params={"user_phone": "33600000000", "format": args.format},
+                headers={"Authorization": f"Bearer {TOKEN}", "Content-Type": "text/csv" if args.format == "csv" else "application/x-ndjson"},
+                content=body(args.rows, args.format, args.error_rate)
+            )
+            elapsed = time.perf_counter() - started
+            sampler.cancel()
+            report = response.json()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    print(f"Import {args.format} : {args.rows} lignes en {elapsed:.2f}s ({args.rows / elapsed:,.0f} lignes/s), statut HTTP {response.status_code}")
+    print(f"  importées={report['imported']}  doublons={report['duplicates']}  erreurs={report['failed']}  (serveur : {report['duration_ms']} ms)")
+    if report["errors"]:
+        print(f"  première erreur : ligne {report['errors'][0]['line']} : {report['errors'][0]['error']}")
+    print(f"  mémoire serveur : {baseline / 1024:.1f} Mo au repos, pic {max(samples or [baseline]) / 1024:.1f} Mo (+{(max(samples or [baseline]) - baseline) / 1024:.1f} Mo)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="nombre de factures envoyées")
+    parser.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    parser.add_argument("--error-rate", type=float, default=0.001, help="proportion de lignes invalides")
+    parser.add_argument("--sqlite-cache-kb", type=int, default=2000, help="cache de pages SQLite du serveur")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
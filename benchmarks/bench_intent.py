@@ -0,0 +1,173 @@
+# =====================================
+# benchmarks/bench_intent.py
+# =====================================
+"""Micro-benchmark du classifieur d'intention
+
+Compare l'ancienne détection (quatre parcours any(...) sur des listes
+reconstruites à chaque appel) au classifieur compilé de app/intent.py, à
+intentions égales : l'ancienne fonction ne connaît pas invoice_summary, le
+classifieur de production (qui la teste en plus) est mesuré à part.
+
+    python -m benchmarks.bench_intent [--repeat 5] [--size 20000]
+"""
+import argparse
+import random
+import time
+
+from app.intent import DEFAULT_INTENT_PATTERNS, IntentClassifier
+
+# Intentions de l'ancienne fonction (invoice_summary est venue après)
+ORIGINAL_PATTERNS = [(intent, keywords) for intent, keywords in DEFAULT_INTENT_PATTERNS if intent != "invoice_summary"]
+
+CORPUS = [
+    "Bonjour !",
+    "Salut, je m'appelle Marie, je suis graphiste freelance",
+    "coucou 😊",
+    "Hello, tu peux m'aider ?",
+    "Comment faire une facture ?",
+    "comment faire une facture pour un client à l'étranger",
+    "Je dois envoyer un devis demain, qu'est-ce que je mets dedans ?",
+    "Quelles mentions obligatoires sur une facture d'auto-entrepreneur ?",
+    "Mon client ne m'a toujours pas payé",
+    "J'ai trois factures impayées depuis deux mois",
+    "Comment relancer un client sans le vexer ?",
+    "Le paiement est en retard de 15 jours, que faire ?",
+    "Tu peux me faire un rappel pour la facture 2024-031 ?",
+    "Quelle stratégie pour être payé plus vite ?",
+    "Un conseil pour fixer mes tarifs ?",
+    "J'ai besoin d'aide pour ma trésorerie",
+    "Est-ce que je dois facturer la TVA ?",
+    "Mes clients paient toujours à 60 jours",
+    "Je voudrais passer à la facturation électronique",
+    "Merci beaucoup !",
+    "Ok super",
+    "Quel temps fait-il demain ?",
+    "Tu connais un bon comptable à Lyon ?",
+    "Il faut que je plaide ma cause auprès de la banque",
+    "La clientèle est calme ce mois-ci",
+    "they said hey",
+    "Peux-tu me donner le récap de mes devis en cours ?",
+    "Relance envoyée hier, toujours rien",
+    "Aidez-moi svp",
+    "Je te rappelle que le client n'a toujours pas payé",
+    "Combien de temps pour relancer après l'échéance ?",
+    "Je suis plombier, comment je facture un déplacement ?",
+]
+
+# Vocabulaire métier qu'on ajouterait via INTENT_PATTERNS_FILE
+EXTRA_PATTERNS = {
+    "payment_reminder": ["mise en demeure", "recouvrement", "injonction", "pénalités", "échéance", "huissier",
+                         "litige", "contentieux", "indemnité forfaitaire", "lettre recommandée"],
+    "invoice_help": ["acompte", "avoir", "tva", "siret", "mentions obligatoires", "numérotation", "auto-entrepreneur",
+                     "micro-entreprise", "bon de commande", "escompte", "autoliquidation", "note de frais",
+                     "facture électronique", "chorus", "remise", "ristourne", "franchise en base", "hors taxe",
+                     "toutes taxes comprises", "conditions générales", "délai de paiement", "virement"],
+    "business_advice": ["trésorerie", "tarif", "prix", "prospection", "marge", "rentabilité", "négociation",
+                        "devis signé", "fidélisation", "chiffre d'affaires", "budget", "prévisionnel", "banque",
+                        "prêt", "subvention", "urssaf", "impôts", "comptable", "expert-comptable", "bilan"],
+}
+
+def legacy_analyze_message_intent(message: str) -> str:
+    """Détection d'intention d'origine (FacturationCoach._analyze_message_intent)"""
+    message_lower = message.lower()
+
+    greeting_patterns = ["salut", "bonjour", "bonsoir", "hello", "coucou", "hey"]
+    invoice_patterns = ["facture", "devis", "facturation", "client", "paiement", "relance"]
+    reminder_patterns = ["rappel", "relance", "retard", "impayé", "relancer"]
+    advice_patterns = ["conseil", "aide", "comment", "que faire", "stratégie"]
+
+    if any(pattern in message_lower for pattern in greeting_patterns):
+        return "greeting"
+    elif any(pattern in message_lower for pattern in reminder_patterns):
+        return "payment_reminder"
+    elif any(pattern in message_lower for pattern in invoice_patterns):
+        return "invoice_help"
+    elif any(pattern in message_lower for pattern in advice_patterns):
+        return "business_advice"
+    else:
+        return "general"
+
+def legacy_with_extra_patterns(message: str) -> str:
+    """Ancienne approche (any(...) par liste) étendue au vocabulaire EXTRA_PATTERNS"""
+    message_lower = message.lower()
+
+    greeting_patterns = ["salut", "bonjour", "bonsoir", "hello", "coucou", "hey"]
+    invoice_patterns = ["facture", "devis", "facturation", "client", "paiement", "relance"] + EXTRA_PATTERNS["invoice_help"]
+    reminder_patterns = ["rappel", "relance", "retard", "impayé", "relancer"] + EXTRA_PATTERNS["payment_reminder"]
+    advice_patterns = ["conseil", "aide", "comment", "que faire", "stratégie"] + EXTRA_PATTERNS["business_advice"]
+
+    if any(pattern in message_lower for pattern in greeting_patterns):
+        return "greeting"
+    elif any(pattern in message_lower for pattern in reminder_patterns):
+        return "payment_reminder"
+    elif any(pattern in message_lower for pattern in invoice_patterns):
+        return "invoice_help"
+    elif any(pattern in message_lower for pattern in advice_patterns):
+        return "business_advice"
+    else:
+        return "general"
+
+def build_corpus(size: int, seed: int = 42) -> list:
+    """Corpus de messages réalistes (variantes de casse et de ponctuation)"""
+    rng = random.Random(seed)
+    variants = []
+    for _ in range(size):
+        message = rng.choice(CORPUS)
+        if rng.random() < 0.3:
+            message = message.upper() if rng.random() < 0.2 else message.capitalize()
+        if rng.random() < 0.3:
+            message += rng.choice([" ?", " !!", " merci", " stp", " 🙏"])
+        variants.append(message)
+    return variants
+
+def compare(funcs: list, corpus: list, repeat: int) -> list:
+    """Meilleur temps moyen par message de chaque fonction, mesurées en alternance
+
+    L'alternance expose les fonctions comparées aux mêmes variations de charge
+    de la machine.
+    """
+    best = [float("inf")] * len(funcs)
+    for _ in range(repeat):
+        for index, func in enumerate(funcs):
+            started = time.perf_counter()
+            for message in corpus:
+                func(message)
+            best[index] = min(best[index], time.perf_counter() - started)
+    return [elapsed / len(corpus) * 1e6 for elapsed in best]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--size", type=int, default=20000)
+    args = parser.parse_args()
+
+    production = IntentClassifier()
+    classifier = IntentClassifier(ORIGINAL_PATTERNS)
+    extended = IntentClassifier(ORIGINAL_PATTERNS + IntentClassifier._parse_extra_patterns(EXTRA_PATTERNS))
+    corpus = build_corpus(args.size)
+    # Messages longs : plusieurs phrases envoyées d'un bloc
+    long_corpus = [" ".join(corpus[i:i + 8]) for i in range(0, len(corpus), 8)]
+
+    print(f"Corpus : {len(corpus)} messages, {args.repeat} répétitions")
+    scenarios = (
+        ("messages courts, mots-clés d'origine", corpus, legacy_analyze_message_intent, classifier),
+        ("messages longs, mots-clés d'origine", long_corpus, legacy_analyze_message_intent, classifier),
+        ("messages courts, vocabulaire étendu", corpus, legacy_with_extra_patterns, extended),
+        ("messages longs, vocabulaire étendu", long_corpus, legacy_with_extra_patterns, extended),
+        ("messages courts, classifieur de production (+ invoice_summary)", corpus, legacy_analyze_message_intent, production),
+        ("messages longs, classifieur de production (+ invoice_summary)", long_corpus, legacy_analyze_message_intent, production),
+    )
+    for label, messages, legacy, compiled in scenarios:
+        legacy_us, compiled_us = compare([legacy, compiled.classify], messages, args.repeat)
+        print(f"{label} :")
+        print(f"  ancien classifieur  : {legacy_us:8.3f} µs/message")
+        print(f"  classifieur (mots)  : {compiled_us:8.3f} µs/message  (x{legacy_us / compiled_us:.2f})")
+
+    print("\nDifférences de classification (limites de mot) :")
+    for message in CORPUS:
+        before, after = legacy_analyze_message_intent(message), classifier.classify(message)
+        if before != after:
+            print(f"  {message!r}: {before} -> {after}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# =====================================
+# benchmarks/bench_startup.py
+# =====================================
+"""Mesure du démarrage à froid (ce que voit le healthcheck Railway)
+
+Dans des processus neufs, à chaque essai :
+- durée de `import app.main` (aucun client ni connexion ne doit être créé) ;
+- durée entre le lancement d'uvicorn et la première réponse 200 de /ready
+  (lifespan : migrations SQLite, démarrage des services, SELECT 1).
+
+Le code de sortie vaut 1 si la médiane du temps jusqu'à /ready dépasse le
+budget : utilisable en CI pour empêcher les régressions du démarrage.
+
+    python -m benchmarks.bench_startup [--runs 5] [--budget-ms 1500] [--schema-mode migrate]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import tempfile
+import urllib.request
+import urllib.error
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import sys, time
+started = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - started
+heavy = [name for name in ("openai", "httpx") if name in sys.modules]
+print(f"{elapsed * 1000:.1f} {','.join(heavy)}")
+"""
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def environment(workdir: str, schema_mode: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        "MEDIA_STORAGE_DIR": os.path.join(workdir, "media"),
+        "MEDIA_SPOOL_DIR": os.path.join(workdir, "spool"),
+        "DB_SCHEMA_MODE": schema_mode,
+        "REMINDERS_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+        "PYTHONPATH": ROOT,
+    })
+    return env
+
+def measure_import(env: dict) -> tuple:
+    """Durée d'import de app.main (ms) et SDK lourds chargés à l'import"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(output[0]), output[1] if len(output) > 1 else ""
+
+def measure_ready(env: dict, timeout: float) -> float:
+    """Lance uvicorn et attend le premier 200 de /ready ; retourne la durée (ms)"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn arrêté (code {process.returncode}) : {process.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except (urllib.error.URLError, ConnectionError, OSError):
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"/ready pas prêt après {timeout}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def summary(values) -> str:
+    return f"médiane={statistics.median(values):7.1f} ms  min={min(values):7.1f} ms  max={max(values):7.1f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="nombre d'essais (processus neufs)")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="budget de la médiane lancement -> /ready")
+    parser.add_argument("--schema-mode", default="migrate", choices=("migrate", "check", "off"))
+    parser.add_argument("--timeout", type=float, default=30, help="attente max de /ready par essai (s)")
+    args = parser.parse_args()
+
+    import_times, ready_times, heavy = [], [], set()
+    for _ in range(args.runs):
+        # Base neuve à chaque essai : le premier démarrage d'un déploiement
+        with tempfile.TemporaryDirectory(prefix="bench-startup-") as workdir:
+            env = environment(workdir, args.schema_mode)
+            if args.schema_mode == "check":
+                # Migrations jouées avant le démarrage, comme en déploiement
+                subprocess.run([sys.executable, "-m", "app.database"], cwd=ROOT, env=env, check=True, capture_output=True)
+            elapsed, loaded = measure_import(env)
+            import_times.append(elapsed)
+            heavy.update(filter(None, loaded.split(",")))
+            ready_times.append(measure_ready(env, args.timeout))
+
+    ready_median = statistics.median(ready_times)
+    print(f"Démarrage à froid ({args.runs} essais, schéma : {args.schema_mode})")
+    print(f"  import app.main              {summary(import_times)}")
+    print(f"  lancement -> /ready 200      {summary(ready_times)}")
+    if heavy:
+        print(f"  SDK chargés à l'import : {', '.join(sorted(heavy))} (devraient l'être au premier appel)")
+    verdict = "OK" if ready_median <= args.budget_ms else "DÉPASSÉ"
+    print(f"Budget {args.budget_ms:.0f} ms : {verdict} ({ready_median:.0f} ms)")
+    sys.exit(0 if ready_median <= args.budget_ms else 1)
+
+if __name__ == "__main__":
+    main()
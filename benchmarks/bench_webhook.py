@@ -0,0 +1,347 @@
+# =====================================
+# benchmarks/bench_webhook.py
+# =====================================
+"""Banc de charge du webhook WhatsApp (POST /)
+
+Rejoue des webhooks réalistes (texte, image, statut seul, lots de messages)
+contre app.main:app servie par uvicorn, avec de faux serveurs Graph API et
+OpenAI locaux à latence injectable. Tout tourne dans un seul processus :
+aucun appel réseau externe, base SQLite temporaire.
+
+Mesures :
+- débit et latence p50/p95/p99 de POST / (ce que voit Meta) ;
+- latence de bout en bout message -> réponse reçue par le faux Graph ;
+- temps par étape du chemin chaud (parse, db, intent, llm, media, send).
+
+    python -m benchmarks.bench_webhook [--requests 2000] [--concurrency 50] [--users 200]
+        [--graph-latency-ms 80] [--llm-latency-ms 800] [--jitter 0.3]
+        [--mix text=70,image=5,status=15,batch=10]
+"""
+import os
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import itertools
+from collections import defaultdict, deque
+
+from benchmarks.bench_intent import CORPUS
+
+# Étapes instrumentées : (module, classe, méthode, étape)
+STAGES = [
+    ("app.whatsapp", "WhatsAppHandler", "parse_webhook_messages", "parse"),
+    ("app.worker", "MessageWorkerPool", "_insert_pending", "db"),
+    ("app.worker", "MessageWorkerPool", "_claim_batch", "db"),
+    ("app.worker", "MessageWorkerPool", "_complete", "db"),
+    ("app.users", "UserStore", "get_many", "db"),
+    ("app.context", "ConversationContextBuilder", "build", "db"),
+    ("app.conversation_log", "ConversationLogWriter", "_insert", "db"),
+    ("app.intent", "IntentClassifier", "classify", "intent"),
+    ("app.ai_coach", "FacturationCoach", "_complete", "llm"),
+    ("app.media", "MediaPipeline", "ingest", "media"),
+    ("app.whatsapp", "WhatsAppHandler", "deliver", "send"),
+]
+
+FAKE_IMAGE = os.urandom(48 * 1024)
+
+def percentile(values: list, q: float) -> float:
+    """Percentile par rang le plus proche (values non vide)"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+# ---------- Instrumentation ----------
+
+def instrument(stage_times: dict):
+    """Enveloppe les méthodes du chemin chaud pour mesurer chaque étape"""
+    import importlib
+    for module_name, class_name, method_name, stage in STAGES:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        original = getattr(cls, method_name)
+        if asyncio.iscoroutinefunction(original):
+            async def wrapper(*args, __original=original, __stage=stage, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await __original(*args, **kwargs)
+                finally:
+                    stage_times[__stage].append(time.perf_counter() - started)
+        else:
+            def wrapper(*args, __original=original, __stage=stage, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return __original(*args, **kwargs)
+                finally:
+                    stage_times[__stage].append(time.perf_counter() - started)
+        setattr(cls, method_name, wrapper)
+
+# ---------- Faux serveurs ----------
+
+class ReplyTracker:
+    """Associe chaque réponse reçue par le faux Graph au message qui l'a provoquée (FIFO par utilisateur)"""
+
+    def __init__(self):
+        self.expected = defaultdict(deque)
+        self.latencies = []
+        self.unexpected = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self.expected.values())
+
+    def expect(self, phone: str):
+        self.expected[phone].append(time.perf_counter())
+
+    def received(self, phone: str):
+        queue = self.expected.get(phone)
+        if queue:
+            self.latencies.append(time.perf_counter() - queue.popleft())
+        else:
+            self.unexpected += 1
+
+async def simulated_latency(mean_ms: float, jitter: float):
+    if mean_ms > 0:
+        await asyncio.sleep(mean_ms / 1000 * random.uniform(1 - jitter, 1 + jitter))
+
+def build_fake_graph(base_url: str, latency_ms: float, jitter: float, tracker: ReplyTracker):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import Response
+
+    fake = FastAPI()
+    ids = itertools.count()
+
+    @fake.post("/v18.0/{phone_number_id}/messages")
+    async def send(phone_number_id: str, request: Request):
+        payload = await request.json()
+        await simulated_latency(latency_ms, jitter)
+        tracker.received(payload["to"])
+        return {"messaging_product": "whatsapp", "messages": [{"id": f"wamid.out.{next(ids)}"}]}
+
+    @fake.get("/v18.0/{media_id}")
+    async def media_info(media_id: str):
+        await simulated_latency(latency_ms, jitter)
+        return {"url": f"{base_url}/files/{media_id}", "mime_type": "image/jpeg", "file_size": len(FAKE_IMAGE), "id": media_id}
+
+    @fake.get("/files/{media_id}")
+    async def media_file(media_id: str):
+        await simulated_latency(latency_ms, jitter)
+        # Contenu propre à chaque média : pas de dédoublonnage
+        return Response(FAKE_IMAGE + media_id.encode(), media_type="image/jpeg")
+
+    return fake
+
+def build_fake_openai(latency_ms: float, jitter: float):
+    from fastapi import FastAPI
+
+    fake = FastAPI()
+    ids = itertools.count()
+
+    @fake.post("/v1/chat/completions")
+    async def completions():
+        await simulated_latency(latency_ms, jitter)
+        return {
+            "id": f"chatcmpl-{next(ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-3.5-turbo",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Conseil simulé : facture dès la livraison et indique l'échéance."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+        }
+
+    return fake
+
+async def serve(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error"))
+    # Les signaux restent gérés par asyncio.run (Ctrl+C)
+    server.install_signal_handlers = lambda: None
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+# ---------- Webhooks rejoués ----------
+
+class PayloadFactory:
+    """Webhooks au format Meta, avec les messages attendant une réponse"""
+
+    def __init__(self, users: int, mix: dict, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.phones = [f"3360000{i:04d}" for i in range(users)]
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.ids = itertools.count()
+
+    def _message(self, phone: str, kind: str) -> dict:
+        message = {"from": phone, "id": f"wamid.in.{next(self.ids)}", "timestamp": str(int(time.time())), "type": kind}
+        if kind == "image":
+            message["image"] = {"id": f"media{next(self.ids)}", "mime_type": "image/jpeg", "caption": ""}
+        else:
+            message["text"] = {"body": self.rng.choice(CORPUS)}
+        return message
+
+    @staticmethod
+    def _envelope(value: dict) -> dict:
+        value = {"messaging_product": "whatsapp", "metadata": {"display_phone_number": "33100000000", "phone_number_id": "bench"}, **value}
+        return {"object": "whatsapp_business_account", "entry": [{"id": "bench", "changes": [{"field": "messages", "value": value}]}]}
+
+    def next(self):
+        """Retourne (kind, payload, téléphones qui attendent une réponse)"""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        phone = self.rng.choice(self.phones)
+        if kind == "status":
+            status = {"id": f"wamid.out.{next(self.ids)}", "status": "delivered", "timestamp": str(int(time.time())), "recipient_id": phone}
+            return kind, self._envelope({"statuses": [status]}), []
+        if kind == "batch":
+            messages = [self._message(self.rng.choice(self.phones), "text") for _ in range(self.rng.randint(2, 5))]
+        else:
+            messages = [self._message(phone, kind)]
+        contacts = [{"profile": {"name": "Bench"}, "wa_id": m["from"]} for m in messages]
+        return kind, self._envelope({"contacts": contacts, "messages": messages}), [m["from"] for m in messages]
+
+# ---------- Rapport ----------
+
+def print_latencies(label: str, values: list):
+    if not values:
+        print(f"  {label:<28} aucune mesure")
+        return
+    ms = [v * 1000 for v in values]
+    print(f"  {label:<28} n={len(ms):<6} p50={percentile(ms, 50):8.1f} ms  p95={percentile(ms, 95):8.1f} ms  "
+          f"p99={percentile(ms, 99):8.1f} ms  max={max(ms):8.1f} ms")
+
+def report(args, elapsed: float, webhook_latencies: dict, errors: int, tracker: ReplyTracker, stage_times: dict, coach):
+    total = sum(len(values) for values in webhook_latencies.values())
+    print(f"\nWebhooks : {total} envoyés en {elapsed:.2f}s ({total / elapsed:.1f} req/s), {errors} erreurs, concurrence {args.concurrency}")
+    print("Latence POST / :")
+    print_latencies("tous", [v for values in webhook_latencies.values() for v in values])
+    for kind in sorted(webhook_latencies):
+        print_latencies(kind, webhook_latencies[kind])
+
+    print("Latence message -> réponse envoyée :")
+    print_latencies("bout en bout", tracker.latencies)
+    if tracker.pending:
+        print(f"  {tracker.pending} réponses non reçues avant --drain-timeout")
+
+    print("Temps par étape (appels individuels) :")
+    for stage in ("parse", "db", "intent", "llm", "media", "send"):
+        values = stage_times.get(stage, [])
+        if values:
+            print_latencies(f"{stage} (total {sum(values):.2f}s)", values)
+    print(f"Cache LLM : {coach.advice_cache.stats()}")
+    from app.metrics import HANDLER_SECONDS
+    questions = HANDLER_SECONDS.count(handler="invoice_help")
+    stats = coach.advice_cache.stats()
+    served = stats["hits"] + stats["coalesced"] + stats["shared_hits"]
+    if questions:
+        print(f"Questions facturation : {questions}, servies par le cache : {served} ({served / questions:.0%})")
+
+# ---------- Exécution ----------
+
+def configure_environment(args, workdir: str, graph_url: str, openai_url: str):
+    """Variables lues par l'application : à fixer avant d'importer app.main"""
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "WHATSAPP_ACCESS_TOKEN": "bench-token",
+        "WHATSAPP_PHONE_NUMBER_ID": "bench",
+        "WHATSAPP_GRAPH_URL": graph_url,
+        "OPENAI_API_KEY": "bench-key",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "MEDIA_STORAGE_DIR": os.path.join(workdir, "media"),
+        "MEDIA_SPOOL_DIR": os.path.join(workdir, "spool"),
+        "WORKER_POLL_INTERVAL": "0.2",
+        "REMINDERS_ENABLED": "false",
+        # Journalisation configurée au démarrage de l'application (lifespan)
+        "LOG_LEVEL": "ERROR",
+    })
+    os.environ.setdefault("WHATSAPP_RATE_PER_SECOND", "1000")
+    os.environ.setdefault("WHATSAPP_RATE_BURST", "1000")
+
+async def run(args):
+    tracker = ReplyTracker()
+    stage_times = defaultdict(list)
+    graph_port, openai_port, app_port = free_port(), free_port(), free_port()
+    graph_url, openai_url = f"http://127.0.0.1:{graph_port}", f"http://127.0.0.1:{openai_port}"
+
+    workdir = tempfile.mkdtemp(prefix="bench-webhook-")
+    configure_environment(args, workdir, graph_url, openai_url)
+
+    from app import main as app_main
+    instrument(stage_times)
+
+    servers = [
+        await serve(build_fake_graph(graph_url, args.graph_latency_ms, args.jitter, tracker), graph_port),
+        await serve(build_fake_openai(args.llm_latency_ms, args.jitter), openai_port),
+        await serve(app_main.app, app_port),
+    ]
+    # Démarrage terminé : on ne garde que les mesures du banc
+    stage_times.clear()
+
+    import httpx
+    factory = PayloadFactory(args.users, parse_mix(args.mix))
+    webhook_latencies = defaultdict(list)
+    errors = 0
+    remaining = itertools.count()
+
+    async def client_loop(client):
+        nonlocal errors
+        while next(remaining) < args.requests:
+            kind, payload, phones = factory.next()
+            for phone in phones:
+                tracker.expect(phone)
+            started = time.perf_counter()
+            try:
+                response = await client.post("/", json=payload)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            webhook_latencies[kind].append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    deadline = time.perf_counter() + args.drain_timeout
+    while tracker.pending and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+    report(args, elapsed, webhook_latencies, errors, tracker, stage_times, app_main.services.coach)
+
+    for server, task in reversed(servers):
+        server.should_exit = True
+        await task
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="nombre de webhooks envoyés")
+    parser.add_argument("--concurrency", type=int, default=50, help="requêtes simultanées")
+    parser.add_argument("--users", type=int, default=200, help="nombre d'expéditeurs distincts")
+    parser.add_argument("--graph-latency-ms", type=float, default=80, help="latence simulée de la Graph API")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="latence simulée d'OpenAI")
+    parser.add_argument("--jitter", type=float, default=0.3, help="variation relative des latences simulées")
+    parser.add_argument("--mix", default="text=70,image=5,status=15,batch=10", help="répartition des webhooks")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="attente max des réponses après l'envoi")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# =====================================
+# gunicorn.conf.py
+# =====================================
+# Mode multi-processus : gunicorn -c gunicorn.conf.py app.main:app
+#
+# Chaque worker est un processus uvicorn complet (boucle asyncio, services).
+# Ce qui doit être commun passe par la base (voir app/coordination.py) :
+# partitions d'utilisateurs, rôle de leader des relances, débit d'envoi
+# WhatsApp, cache des réponses LLM ; les doublons Meta sont écartés par
+# l'index unique des messages en attente.
+#
+# Connexions base : chaque worker a son pool (DB_POOL_SIZE + DB_MAX_OVERFLOW),
+# à multiplier par WEB_CONCURRENCY pour rester sous la limite du serveur.
+import os
+import asyncio
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Nombre fixe par défaut : dans un conteneur, cpu_count() donne souvent les
+# CPU de l'hôte et non la limite du conteneur
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Plafond optionnel : connexions autorisées par le serveur Postgres pour
+# l'application (max_connections moins la marge des autres clients)
+_db_max_connections = int(os.getenv("DB_MAX_CONNECTIONS", "0"))
+if _db_max_connections:
+    _per_worker = int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    workers = max(1, min(workers, _db_max_connections // _per_worker))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Un worker muet (boucle bloquée) plus de `timeout` secondes est remplacé
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+# Arrêt : temps laissé au lifespan pour vider la file d'envoi et rendre les baux
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Pas de preload : l'import de app.main ne crée ni client ni connexion,
+# chaque worker démarre ses services dans son propre lifespan
+preload_app = False
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+def on_starting(server):
+    """Migrations une seule fois, dans le maître, avant de lancer les workers"""
+    if os.getenv("DB_SCHEMA_MODE", "migrate").lower() != "migrate":
+        return
+    from app.database import init_db, close_db
+    init_db()
+    # Pas de connexion ouverte héritée par les workers
+    asyncio.run(close_db())
+    # Les workers vérifient seulement le schéma (aucun DDL concurrent)
+    os.environ["DB_SCHEMA_MODE"] = "check"
@@ -0,0 +1,21 @@
+# =====================================
+# tests/conftest.py
+# =====================================
+# Base SQLite temporaire, fixée avant tout import de l'application
+#
+#     python -m pytest -q
+import os
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix="coach-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'tests.db')}"
+os.environ.setdefault("MEDIA_STORAGE_DIR", os.path.join(_workdir, "media"))
+os.environ.setdefault("LLM_CACHE_SHARED", "false")
+
+import pytest
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    """Schéma créé une fois (migrations comprises)"""
+    from app.database import init_db
+    init_db()
@@ -0,0 +1,26 @@
+# =====================================
+# tests/test_context.py
+# =====================================
+import pytest
+
+from app.context import depends_on_history
+
+@pytest.mark.parametrize("message", [
+    "Comment faire une facture ?",
+    "Quelles mentions obligatoires sur une facture d'auto-entrepreneur ?",
+    "Est-ce que je dois facturer la TVA ?",
+    "Comment relancer un client sans le vexer ?",
+])
+def test_standalone_questions_use_the_generic_cached_answer(message):
+    assert not depends_on_history(message)
+
+@pytest.mark.parametrize("message", [
+    "Et pour un client à l'étranger ?",
+    "pourquoi ?",
+    "Tu m'as dit de relancer à J+7, je le fais comment ?",
+    "Je lui envoie ça par mail ou par courrier ?",
+    "Ok et si ce client ne répond toujours pas ?",
+    "Tu peux reprendre ton conseil avec un exemple ?",
+])
+def test_follow_ups_get_the_conversation_history(message):
+    assert depends_on_history(message)
@@ -0,0 +1,63 @@
+# =====================================
+# tests/test_conversation_log.py
+# =====================================
+import asyncio
+
+from sqlalchemy import func, select
+
+from app.conversation_log import ConversationLogWriter
+from app.database import close_db, get_async_db
+from app.models import Conversation
+
+def _slow_insert(writer, delay):
+    """Écriture réelle précédée d'une attente (base lente)"""
+    started = asyncio.Event()
+    insert = writer._insert
+
+    async def slow(rows):
+        started.set()
+        await asyncio.sleep(delay)
+        await insert(rows)
+
+    writer._insert = slow
+    return started
+
+async def _count(phone):
+    async with get_async_db() as db:
+        return (await db.execute(select(func.count()).where(Conversation.user_phone == phone))).scalar_one()
+
+async def _stop_during_insert(monkeypatch, phone):
+    monkeypatch.setenv("CONVERSATION_FLUSH_ROWS", "3")
+    writer = ConversationLogWriter()
+    started = _slow_insert(writer, 0.2)
+    await writer.start()
+    try:
+        for i in range(3):
+            writer.add(phone, f"message {i}", f"réponse {i}")
+        await asyncio.wait_for(started.wait(), timeout=5)
+        # Arrivés pendant l'écriture du premier lot
+        writer.add(phone, "message 3", "réponse 3")
+        writer.add(phone, "message 4", "réponse 4")
+        await writer.stop()
+        return writer, await _count(phone)
+    finally:
+        await close_db()
+
+def test_stop_waits_for_the_insert_in_progress(monkeypatch):
+    writer, count = asyncio.run(_stop_during_insert(monkeypatch, "33600000301"))
+    assert count == 5
+    assert writer.queue_depth == 0
+
+async def _cancel_flush(phone):
+    writer = ConversationLogWriter()
+    started = _slow_insert(writer, 10)
+    writer.add(phone, "message", "réponse")
+    task = asyncio.create_task(writer.flush())
+    await started.wait()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return writer
+
+def test_cancelled_flush_keeps_the_rows():
+    writer = asyncio.run(_cancel_flush("33600000302"))
+    assert [row["message"] for row in writer.pending_for("33600000302")] == ["message"]
@@ -0,0 +1,83 @@
+# =====================================
+# tests/test_imports.py
+# =====================================
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.database import close_db, get_async_db
+from app.imports import InvoiceImporter
+from app.models import Invoice
+from app.reminders import ReminderScheduler, passed_reminder_level
+from app.summaries import get_summary
+
+class RecordingOutbox:
+    def __init__(self):
+        self.messages = []
+
+    async def add(self, db, messages):
+        return list(messages)
+
+    def submit(self, items):
+        self.messages.extend(items)
+
+async def _body(text: str):
+    yield text.encode()
+
+def _csv(rows):
+    return "numero;montant;echeance;statut\n" + "".join(
+        f"{number};{amount};{due:%d/%m/%Y};{status}\n" for number, amount, due, status in rows
+    )
+
+def test_passed_reminder_level():
+    now = datetime(2024, 6, 30)
+    assert passed_reminder_level(None, now) == 0
+    assert passed_reminder_level(now - timedelta(days=6), now) == 0
+    assert passed_reminder_level(now - timedelta(days=7), now) == 1
+    assert passed_reminder_level(now - timedelta(days=20), now) == 2
+    assert passed_reminder_level(now - timedelta(days=400), now) == 3
+
+def test_importing_old_unpaid_invoices_does_not_flood_reminders():
+    phone = "33600000401"
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    old = [(f"OLD-{i}", "100", today - timedelta(days=400), "envoyée") for i in range(500)]
+    recent = [("REC-1", "50", today - timedelta(days=10), "envoyée"), ("NEW-1", "70", today + timedelta(days=5), "envoyée")]
+
+    async def scenario():
+        report = await InvoiceImporter(phone, "csv").run(_body(_csv(old + recent)))
+        outbox = RecordingOutbox()
+        scheduler = ReminderScheduler(outbox)
+        sent_now = await scheduler.run_once()
+        # Six jours plus tard, la facture échue depuis 10 jours atteint J+15
+        sent_later = await scheduler.run_once(datetime.now() + timedelta(days=6))
+        summary = await get_summary(phone)
+        async with get_async_db() as db:
+            levels = dict((await db.execute(
+                select(Invoice.invoice_number, Invoice.reminder_level).where(Invoice.user_phone == phone)
+            )).all())
+        await close_db()
+        return report, sent_now, sent_later, outbox.messages, summary, levels
+
+    report, sent_now, sent_later, messages, summary, levels = asyncio.run(scenario())
+    assert report["imported"] == 502
+    assert sent_now == 0
+    assert sent_later == 1 and "REC-1" in messages[0][1]
+    assert levels["OLD-0"] == 3 and levels["NEW-1"] == 0
+    assert summary["overdue_count"] == 501
+    assert summary["next_due_date"] == today + timedelta(days=5)
+
+def test_reimport_reports_duplicates():
+    phone = "33600000402"
+    rows = [("A-1", "10", datetime(2030, 1, 1), "payée"), ("A-2", "n/a", datetime(2030, 1, 1), "payée")]
+
+    async def scenario():
+        first = await InvoiceImporter(phone, "csv").run(_body(_csv(rows)))
+        second = await InvoiceImporter(phone, "csv").run(_body(_csv(rows)))
+        await close_db()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert (first["imported"], first["failed"]) == (1, 1)
+    assert (second["imported"], second["duplicates"], second["failed"]) == (0, 1, 1)
+    assert second["errors"][0]["line"] == 3
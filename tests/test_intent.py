@@ -0,0 +1,61 @@
+# =====================================
+# tests/test_intent.py
+# =====================================
+import json
+
+import pytest
+
+from app.intent import DEFAULT_INTENT_PATTERNS, KEYWORD_FORMS, IntentClassifier
+
+classifier = IntentClassifier()
+
+def _intent_of(keyword):
+    return next(intent for intent, keywords in DEFAULT_INTENT_PATTERNS if keyword in keywords)
+
+@pytest.mark.parametrize("keyword,form", [
+    (keyword, form) for keyword, forms in KEYWORD_FORMS.items() for form in (keyword,) + forms
+])
+def test_every_listed_inflection_is_recognized(keyword, form):
+    assert classifier.classify(f"Voilà : {form.capitalize()} ?") == _intent_of(keyword)
+
+@pytest.mark.parametrize("message,intent", [
+    ("Aidez-moi svp", "business_advice"),
+    ("je te rappelle", "payment_reminder"),
+    ("Tu peux m'aider ?", "business_advice"),
+    ("J'ai trois factures impayées", "payment_reminder"),
+    ("Est-ce que je dois facturer la TVA ?", "invoice_help"),
+    ("Mes clientes paient à 60 jours", "invoice_help"),
+    ("Qui me doit encore de l'argent ?", "invoice_summary"),
+    ("J'ai besoin de l’aide d'un expert", "business_advice"),
+    ("Facture n°2024-031", "invoice_help"),
+])
+def test_inflected_forms_in_messages(message, intent):
+    assert classifier.classify(message) == intent
+
+@pytest.mark.parametrize("message", [
+    "La clientèle est calme ce mois-ci",
+    "Il faut que je plaide ma cause auprès de la banque",
+    "They said nothing",
+    "Merci beaucoup !",
+    "",
+    None,
+])
+def test_keywords_inside_other_words_do_not_match(message):
+    assert classifier.classify(message) == "general"
+
+def test_highest_priority_intent_wins():
+    assert classifier.classify("Bonjour, une question sur ma facture") == "greeting"
+    assert classifier.classify("Relance pour la facture du client") == "payment_reminder"
+    assert classifier.classify("Comment faire une facture ?") == "invoice_help"
+
+def test_extra_patterns_from_config(tmp_path, monkeypatch):
+    path = tmp_path / "intents.json"
+    path.write_text(json.dumps({"invoice_help": ["acompte"], "tax": ["urssaf"]}), encoding="utf-8")
+    monkeypatch.setenv("INTENT_PATTERNS_FILE", str(path))
+
+    configured = IntentClassifier.from_env()
+
+    assert configured.classify("Deux acomptes reçus") == "invoice_help"
+    assert configured.classify("Déclaration Urssaf") == "tax"
+    # Une nouvelle intention passe après les intentions existantes
+    assert configured.classify("Un conseil pour l'urssaf ?") == "business_advice"
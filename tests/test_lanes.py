@@ -0,0 +1,69 @@
+# =====================================
+# tests/test_lanes.py
+# =====================================
+import asyncio
+import random
+
+from app.lanes import KeyedLaneScheduler
+
+class Recorder:
+    """Gestionnaire qui rend la main pendant le traitement et note l'ordre observé"""
+
+    def __init__(self, seed=7):
+        self.rng = random.Random(seed)
+        self.processed = {}
+        self.active = {}
+        self.overlap_same_key = False
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, key, items):
+        if self.active.get(key):
+            self.overlap_same_key = True
+        self.active[key] = True
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            for _ in range(self.rng.randint(1, 4)):
+                await asyncio.sleep(0)
+            self.processed.setdefault(key, []).extend(items)
+        finally:
+            self.running -= 1
+            self.active[key] = False
+
+async def _run(concurrency, max_batch, keys, per_key):
+    recorder = Recorder()
+    lanes = KeyedLaneScheduler(recorder, concurrency, max_batch=max_batch)
+    await lanes.start()
+    try:
+        # Soumissions entrelacées, dont certaines pendant le traitement
+        for i in range(per_key):
+            for key in keys:
+                lanes.submit(key, (key, i))
+            if i % 3 == 0:
+                await asyncio.sleep(0)
+        for _ in range(1000):
+            if lanes.pending == 0:
+                break
+            await asyncio.sleep(0)
+        return recorder, (lanes.lane_count, lanes.pending)
+    finally:
+        await lanes.stop()
+
+def test_items_of_a_key_are_handled_in_order_and_never_in_parallel():
+    keys = [f"336000007{i:02d}" for i in range(6)]
+    recorder, _ = asyncio.run(_run(concurrency=3, max_batch=1, keys=keys, per_key=20))
+    assert recorder.processed == {key: [(key, i) for i in range(20)] for key in keys}
+    assert not recorder.overlap_same_key
+    # Clés différentes traitées en parallèle, sans dépasser concurrency
+    assert recorder.max_running == 3
+
+def test_batches_keep_the_order_within_a_key():
+    keys = ["33600000801", "33600000802"]
+    recorder, _ = asyncio.run(_run(concurrency=2, max_batch=5, keys=keys, per_key=12))
+    assert recorder.processed == {key: [(key, i) for i in range(12)] for key in keys}
+    assert not recorder.overlap_same_key
+
+def test_lanes_are_dropped_once_empty():
+    _, (lane_count, pending) = asyncio.run(_run(concurrency=2, max_batch=1, keys=["a", "b"], per_key=3))
+    assert lane_count == 0 and pending == 0
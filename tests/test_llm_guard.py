@@ -0,0 +1,48 @@
+# =====================================
+# tests/test_llm_guard.py
+# =====================================
+import asyncio
+
+import pytest
+
+from app.llm_guard import CircuitOpen, LLMGuard, QueueTimeout
+
+@pytest.fixture
+def guard(monkeypatch):
+    monkeypatch.setenv("LLM_DEADLINE", "1")
+    monkeypatch.setenv("LLM_BREAKER_MIN_CALLS", "3")
+    monkeypatch.setenv("LLM_BREAKER_SLOW_SECONDS", "0.5")
+    monkeypatch.setenv("LLM_BREAKER_OPEN_SECONDS", "0.2")
+    return LLMGuard()
+
+def _provider(latency):
+    async def call():
+        await asyncio.sleep(latency)
+        return "ok"
+    return call
+
+async def _burst(guard, calls, concurrency, latency):
+    slots = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(guard.run(_provider(latency), slots=slots) for _ in range(calls)), return_exceptions=True)
+
+def test_local_queueing_does_not_trip_the_breaker(guard):
+    results = asyncio.run(_burst(guard, 12, 2, 0.3))
+    assert sum(result == "ok" for result in results) == 6
+    assert all(isinstance(result, QueueTimeout) for result in results if result != "ok")
+    assert guard.state == "closed"
+    assert guard.queue_timeouts == 6 and guard.status()["recent_failures"] == 0
+
+def test_provider_timeouts_trip_the_breaker_then_a_probe_recovers(guard):
+    async def scenario():
+        results = await _burst(guard, 3, 3, 2)
+        state_after_timeouts = guard.state
+        with pytest.raises(CircuitOpen):
+            await guard.run(_provider(0))
+        await asyncio.sleep(0.25)
+        probe = await guard.run(_provider(0))
+        return results, state_after_timeouts, probe
+
+    results, state_after_timeouts, probe = asyncio.run(scenario())
+    assert all(isinstance(result, asyncio.TimeoutError) and not isinstance(result, QueueTimeout) for result in results)
+    assert state_after_timeouts == "open"
+    assert probe == "ok" and guard.state == "closed"
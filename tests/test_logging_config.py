@@ -0,0 +1,39 @@
+# =====================================
+# tests/test_logging_config.py
+# =====================================
+import logging
+
+import pytest
+
+from app.logging_config import RedactingFilter, redact_phones
+
+@pytest.mark.parametrize("text", [
+    "Relance du 2024-03-31",
+    "2024.03.31 12:00:00",
+    "facture F-2024-000123",
+    "durée 123456789 ms",
+    "epoch 1697000000000",
+    "montant 12345678.50",
+])
+def test_non_phone_numbers_stay_readable(text):
+    assert redact_phones(text) == text
+
+@pytest.mark.parametrize("text, expected", [
+    ("de +33 6 12 34 56 78", "de ••••••78"),
+    ("whatsapp:+33612345678", "whatsapp:••••••78"),
+    ("+14155552671", "••••••71"),
+    ("id 33612345678", "id ••••••78"),
+    ("tel 06 12 34 56 78", "tel ••••••78"),
+    ("[parameters: ('33612345678', 5)]", "[parameters: ('••••••78', 5)]"),
+])
+def test_known_phone_formats_are_masked(text, expected):
+    assert redact_phones(text) == expected
+
+def test_structured_phone_field_is_masked():
+    record = logging.LogRecord("t", logging.INFO, __file__, 1, "envoi %s", ("ok",), None)
+    record.phone = "4915112345678"
+    record.body = "Bonjour"
+    RedactingFilter().filter(record)
+    assert record.phone == "••••••78"
+    assert record.body == "<masqué, 7 car.>"
+    assert record.getMessage() == "envoi ok"
@@ -0,0 +1,144 @@
+# =====================================
+# tests/test_media.py
+# =====================================
+# MediaPipeline contre une Graph API locale (httpx.MockTransport) qui sert
+# une vraie photo JPEG.
+import asyncio
+import hashlib
+import io
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+from PIL import Image
+from sqlalchemy import select
+
+from app.database import close_db, get_async_db
+from app.media import MediaPipeline, MediaTooLarge
+from app.models import Invoice
+from app.summaries import get_summary
+from app.whatsapp import WhatsAppHandler
+
+GRAPH = "http://graph.test"
+
+def _jpeg(width=2400, height=1200) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+class FakeGraph:
+    """Résolution des identifiants de média puis téléchargement des fichiers"""
+
+    def __init__(self, files, chunk_size=4096, announce_size=True):
+        self.files = files
+        self.chunk_size = chunk_size
+        self.announce_size = announce_size
+        self.chunks_sent = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.startswith("/v18.0/"):
+            media_id = path.rsplit("/", 1)[-1]
+            content = self.files[media_id]
+            return httpx.Response(200, json={
+                "url": f"{GRAPH}/files/{media_id}",
+                "mime_type": "image/jpeg",
+                "sha256": hashlib.sha256(content).hexdigest(),
+                "file_size": len(content) if self.announce_size else None,
+            })
+        content = self.files[path.rsplit("/", 1)[-1]]
+        # Corps en flux, sans Content-Length (comme un transfert chunked)
+        return httpx.Response(200, content=self._stream(content))
+
+    async def _stream(self, content: bytes):
+        for start in range(0, len(content), self.chunk_size):
+            self.chunks_sent += 1
+            yield content[start:start + self.chunk_size]
+
+def _pipeline(monkeypatch, tmp_path, graph, **env):
+    monkeypatch.setenv("WHATSAPP_GRAPH_URL", GRAPH)
+    monkeypatch.setenv("MEDIA_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setenv("MEDIA_STORAGE_DIR", str(tmp_path / "media"))
+    monkeypatch.setenv("MEDIA_PROCESS_WORKERS", "1")
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    whatsapp = WhatsAppHandler()
+    whatsapp._client = httpx.AsyncClient(transport=httpx.MockTransport(graph))
+    return MediaPipeline(whatsapp)
+
+async def _invoices(phone):
+    async with get_async_db() as db:
+        return (await db.execute(select(Invoice).where(Invoice.user_phone == phone))).scalars().all()
+
+async def _ingest(pipeline, calls):
+    await pipeline.start()
+    try:
+        return [await pipeline.ingest(phone, media_id) for phone, media_id in calls]
+    finally:
+        await pipeline.stop()
+        await pipeline.whatsapp_handler.aclose()
+
+def test_photo_becomes_a_draft_invoice(monkeypatch, tmp_path):
+    phone = "33600000501"
+    pipeline = _pipeline(monkeypatch, tmp_path, FakeGraph({"m1": _jpeg()}))
+
+    async def scenario():
+        try:
+            [result] = await _ingest(pipeline, [(phone, "m1")])
+            return result, await _invoices(phone), await get_summary(phone)
+        finally:
+            await close_db()
+
+    result, invoices, summary = asyncio.run(scenario())
+    assert not result.duplicate
+    assert (result.width, result.height) == (1600, 800)
+    [invoice] = invoices
+    assert invoice.id == result.invoice_id
+    assert invoice.status == "draft" and invoice.media_id == "m1"
+    assert os.path.exists(invoice.media_path)
+    assert summary["invoice_count"] == 1 and summary["draft_count"] == 1
+    assert os.listdir(tmp_path / "spool") == []
+
+def test_same_photo_returns_the_existing_invoice(monkeypatch, tmp_path):
+    phone = "33600000502"
+    photo = _jpeg()
+    pipeline = _pipeline(monkeypatch, tmp_path, FakeGraph({"m1": photo, "m2": photo}))
+
+    async def scenario():
+        try:
+            results = await _ingest(pipeline, [(phone, "m1"), (phone, "m2")])
+            return results, await _invoices(phone), await get_summary(phone)
+        finally:
+            await close_db()
+
+    (first, second), invoices, summary = asyncio.run(scenario())
+    assert second.duplicate and second.invoice_id == first.invoice_id
+    assert len(invoices) == 1
+    assert summary["draft_count"] == 1
+
+def test_download_over_the_cap_is_aborted(monkeypatch, tmp_path):
+    phone = "33600000503"
+    photo = _jpeg()
+    # Taille non annoncée par la Graph API : seul le plafond du flux arrête le transfert
+    graph = FakeGraph({"m1": photo}, chunk_size=1024, announce_size=False)
+    pipeline = _pipeline(monkeypatch, tmp_path, graph, MEDIA_MAX_BYTES="4096", MEDIA_CHUNK_SIZE="1024")
+
+    async def scenario():
+        try:
+            with pytest.raises(MediaTooLarge):
+                await _ingest(pipeline, [(phone, "m1")])
+            return await _invoices(phone)
+        finally:
+            await close_db()
+
+    assert asyncio.run(scenario()) == []
+    assert len(photo) > 4096 * 2
+    assert graph.chunks_sent <= 6
+    assert os.listdir(tmp_path / "spool") == []
+
+def test_web_process_does_not_load_pillow():
+    # Sous-processus : les tests eux-mêmes importent Pillow
+    code = "import sys, app.main; sys.exit('PIL' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__))).returncode == 0
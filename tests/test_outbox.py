@@ -0,0 +1,124 @@
+# =====================================
+# tests/test_outbox.py
+# =====================================
+import asyncio
+
+from sqlalchemy import delete, select
+
+from app.database import close_db, get_async_db
+from app.models import FailedMessage, OutgoingMessage
+from app.outbox import OutboundQueue
+from app.whatsapp import SendResult
+
+class FakeWhatsApp:
+    max_concurrency = 2
+    phone_number_id = "test"
+
+    def __init__(self, status=200, delay=0.0):
+        self.status = status
+        self.delay = delay
+        self.delivered = []
+
+    async def deliver(self, to, message):
+        await asyncio.sleep(self.delay)
+        if self.status == 200:
+            self.delivered.append((to, message))
+            return SendResult(ok=True, status=200)
+        return SendResult(ok=False, status=self.status, error="refusé")
+
+async def _rows(model):
+    async with get_async_db() as db:
+        return (await db.execute(select(model))).scalars().all()
+
+async def _reset():
+    async with get_async_db() as db:
+        await db.execute(delete(OutgoingMessage))
+        await db.execute(delete(FailedMessage))
+        await db.commit()
+
+async def _wait(predicate, timeout=5.0):
+    for _ in range(int(timeout / 0.02)):
+        if predicate():
+            return
+        await asyncio.sleep(0.02)
+
+def test_messages_recorded_before_a_crash_are_sent_by_another_process(monkeypatch):
+    monkeypatch.setenv("OUTBOX_CLAIM_TIMEOUT", "0.3")
+
+    async def scenario():
+        await _reset()
+        crashed = OutboundQueue(FakeWhatsApp())
+        async with get_async_db() as db:
+            await crashed.add(db, [("33600000201", "un"), ("33600000201", "deux")])
+            await db.commit()
+        # Processus tué avant submit() : seules les lignes restent
+        survivor_whatsapp = FakeWhatsApp()
+        survivor = OutboundQueue(survivor_whatsapp)
+        await survivor.start()
+        await _wait(lambda: len(survivor_whatsapp.delivered) == 2)
+        await _wait(lambda: survivor.queue_depth == 0)
+        await survivor.stop()
+        remaining = await _rows(OutgoingMessage)
+        await close_db()
+        return survivor_whatsapp.delivered, remaining
+
+    delivered, remaining = asyncio.run(scenario())
+    assert delivered == [("33600000201", "un"), ("33600000201", "deux")]
+    assert remaining == []
+
+def test_unsent_messages_are_released_at_shutdown(monkeypatch):
+    monkeypatch.setenv("OUTBOX_DRAIN_TIMEOUT", "0")
+
+    async def scenario():
+        await _reset()
+        outbox = OutboundQueue(FakeWhatsApp(delay=10))
+        await outbox.start()
+        async with get_async_db() as db:
+            items = await outbox.add(db, [("33600000202", "en attente")])
+            await db.commit()
+        outbox.submit(items)
+        await outbox.stop()
+        rows = await _rows(OutgoingMessage)
+        failed = await _rows(FailedMessage)
+        await close_db()
+        return rows, failed
+
+    rows, failed = asyncio.run(scenario())
+    assert [(row.message, row.claimed_by) for row in rows] == [("en attente", None)]
+    assert failed == []
+
+def test_permanent_failure_moves_the_row_to_failed_messages():
+    async def scenario():
+        await _reset()
+        outbox = OutboundQueue(FakeWhatsApp(status=400))
+        await outbox.start()
+        async with get_async_db() as db:
+            items = await outbox.add(db, [("33600000203", "refusé")])
+            await db.commit()
+        outbox.submit(items)
+        await _wait(lambda: outbox.dead_lettered == 1)
+        await outbox.stop()
+        rows = await _rows(OutgoingMessage)
+        failed = await _rows(FailedMessage)
+        await close_db()
+        return rows, failed
+
+    rows, failed = asyncio.run(scenario())
+    assert rows == []
+    assert [(row.user_phone, row.last_status) for row in failed] == [("33600000203", 400)]
+
+def test_add_returns_each_message_with_its_own_row_id():
+    async def scenario():
+        await _reset()
+        queue = OutboundQueue(FakeWhatsApp())
+        messages = [(f"336000003{i:02d}", f"message {i}") for i in range(50)]
+        async with get_async_db() as db:
+            items = await queue.add(db, messages)
+            await db.commit()
+        stored = {row.id: (row.user_phone, row.message) for row in await _rows(OutgoingMessage)}
+        await close_db()
+        return items, stored
+
+    items, stored = asyncio.run(scenario())
+    assert [(item.to, item.message) for item in items] == [(f"336000003{i:02d}", f"message {i}") for i in range(50)]
+    assert all(stored[item.id] == (item.to, item.message) for item in items)
@@ -0,0 +1,110 @@
+# =====================================
+# tests/test_reminders.py
+# =====================================
+import asyncio
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+from app.database import close_db, get_async_db
+from app.models import Invoice, OutgoingMessage
+from app.outbox import OutboundQueue
+from app.reminders import ReminderScheduler
+
+NOW = datetime(2024, 6, 1, 10, 0)
+LEVEL_OF_TEMPLATE = {"J+7": 1, "J+15": 2, "J+30": 3}
+
+class IdleWhatsApp:
+    """File d'envoi jamais démarrée : seules les lignes outbound_messages comptent"""
+    max_concurrency = 1
+    phone_number_id = "test"
+
+async def _seed(phone, invoices):
+    async with get_async_db() as db:
+        await db.execute(delete(Invoice).where(Invoice.user_phone == phone))
+        await db.execute(delete(OutgoingMessage).where(OutgoingMessage.user_phone == phone))
+        await db.execute(insert(Invoice), [
+            {
+                "user_phone": phone, "invoice_number": number, "client_name": "Client", "amount": 100.0,
+                "due_date": NOW - timedelta(days=days_late), "status": status, "reminder_level": level,
+            }
+            for number, days_late, status, level in invoices
+        ])
+        await db.commit()
+
+async def _state(phone):
+    async with get_async_db() as db:
+        levels = dict((await db.execute(
+            select(Invoice.invoice_number, Invoice.reminder_level).where(Invoice.user_phone == phone)
+        )).all())
+        statuses = dict((await db.execute(
+            select(Invoice.invoice_number, Invoice.status).where(Invoice.user_phone == phone)
+        )).all())
+        messages = (await db.execute(
+            select(OutgoingMessage.message).where(OutgoingMessage.user_phone == phone)
+        )).scalars().all()
+    sent = Counter(
+        (re.search(r"Facture n°(\S+) en retard", message).group(1),
+         LEVEL_OF_TEMPLATE[re.search(r"\*\*(J\+\d+)", message).group(1)])
+        for message in messages
+    )
+    return levels, statuses, sent
+
+def test_concurrent_runs_send_each_reminder_once(monkeypatch):
+    monkeypatch.setenv("REMINDER_BATCH_SIZE", "2")
+    phone = "33600000601"
+    invoices = [
+        ("A", 40, "sent", 0),      # J+30 directement, pas la série
+        ("B", 20, "sent", 0),
+        ("C", 10, "sent", 0),
+        ("D", 3, "sent", 0),       # pas encore de relance
+        ("E", 40, "overdue", 2),   # J+15 déjà envoyée
+        ("F", 40, "overdue", 3),   # série terminée
+    ] + [(f"N{i}", 10, "sent", 0) for i in range(20)]
+
+    async def scenario():
+        try:
+            await _seed(phone, invoices)
+            first = ReminderScheduler(OutboundQueue(IdleWhatsApp()))
+            second = ReminderScheduler(OutboundQueue(IdleWhatsApp()))
+            counts = await asyncio.gather(first.run_once(NOW), second.run_once(NOW))
+            again = await first.run_once(NOW)
+            return counts, again, await _state(phone)
+        finally:
+            await close_db()
+
+    counts, again, (levels, statuses, sent) = asyncio.run(scenario())
+    expected = {("A", 3), ("B", 2), ("C", 1), ("E", 3)} | {(f"N{i}", 1) for i in range(20)}
+    assert set(sent) == expected
+    assert all(count == 1 for count in sent.values())
+    assert sum(counts) == len(expected) and again == 0
+    assert levels["A"] == 3 and levels["B"] == 2 and levels["C"] == 1 and levels["D"] == 0 and levels["F"] == 3
+    assert statuses["D"] == "sent" and statuses["C"] == "overdue"
+
+class FailingOutbox:
+    """Enregistrement impossible dans la file d'envoi"""
+
+    async def add(self, db, messages):
+        raise RuntimeError("file d'envoi indisponible")
+
+    def submit(self, items):
+        raise AssertionError("rien ne doit partir")
+
+def test_level_is_not_advanced_without_the_outbox_row():
+    phone = "33600000602"
+
+    async def scenario():
+        try:
+            await _seed(phone, [("A", 10, "sent", 0)])
+            with pytest.raises(RuntimeError):
+                await ReminderScheduler(FailingOutbox()).run_once(NOW)
+            return await _state(phone)
+        finally:
+            await close_db()
+
+    levels, statuses, sent = asyncio.run(scenario())
+    assert levels == {"A": 0} and statuses == {"A": "sent"}
+    assert not sent
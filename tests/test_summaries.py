@@ -0,0 +1,115 @@
+# =====================================
+# tests/test_summaries.py
+# =====================================
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+from app.database import close_db, get_async_db
+from app.models import Invoice, InvoiceSummary
+from app.summaries import (
+    InvoiceChange, apply_invoice_changes, get_summary, mark_overdue, rebuild_statements, summary_deltas,
+)
+
+TODAY = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _zero(**counters):
+    totals = dict.fromkeys(
+        ("invoice_count", "draft_count", "outstanding_count", "outstanding_amount", "overdue_count", "overdue_amount"), 0
+    )
+    totals.update(counters)
+    return totals
+
+@pytest.mark.parametrize("old, new, expected", [
+    (None, "sent", _zero(invoice_count=1, outstanding_count=1, outstanding_amount=100.0)),
+    (None, "draft", _zero(invoice_count=1, draft_count=1)),
+    (None, "overdue", _zero(invoice_count=1, outstanding_count=1, outstanding_amount=100.0, overdue_count=1, overdue_amount=100.0)),
+    ("sent", "overdue", _zero(overdue_count=1, overdue_amount=100.0)),
+    ("overdue", "paid", _zero(outstanding_count=-1, outstanding_amount=-100.0, overdue_count=-1, overdue_amount=-100.0)),
+    ("draft", "sent", _zero(draft_count=-1, outstanding_count=1, outstanding_amount=100.0)),
+])
+def test_summary_deltas(old, new, expected):
+    assert summary_deltas([InvoiceChange("u", 100.0, None, old, new)]) == {"u": expected}
+
+def test_summary_deltas_aggregates_per_user_and_skips_no_ops():
+    deltas = summary_deltas([
+        InvoiceChange("a", 10.0, None, None, "sent"),
+        InvoiceChange("a", 5.0, None, None, "sent"),
+        InvoiceChange("a", 7.0, None, "sent", "sent"),
+        InvoiceChange("b", None, None, None, "sent"),
+    ])
+    assert deltas["a"]["outstanding_count"] == 2 and deltas["a"]["outstanding_amount"] == 15.0
+    assert deltas["b"]["outstanding_amount"] == 0.0
+
+INVOICES = [
+    # (statut, montant, échéance en jours par rapport à aujourd'hui)
+    ("sent", 100.0, -400),
+    ("sent", 200.0, -1),
+    ("sent", 300.0, 0),
+    ("sent", 400.0, 10),
+    ("overdue", 50.0, -20),
+    ("draft", 10.0, 5),
+    ("paid", 999.0, -30),
+]
+
+async def _load(phone):
+    async with get_async_db() as db:
+        await db.execute(delete(Invoice).where(Invoice.user_phone == phone))
+        await db.execute(delete(InvoiceSummary).where(InvoiceSummary.user_phone == phone))
+        rows = [
+            {"user_phone": phone, "status": status, "amount": amount, "due_date": TODAY + timedelta(days=days), "reminder_level": 0}
+            for status, amount, days in INVOICES
+        ]
+        await db.execute(insert(Invoice), rows)
+        await apply_invoice_changes(db, [InvoiceChange(phone, r["amount"], r["due_date"], None, r["status"]) for r in rows])
+        await db.commit()
+
+async def _rebuilt(phone):
+    clear, fill = rebuild_statements(phone)
+    async with get_async_db() as db:
+        await db.execute(clear)
+        await db.execute(fill)
+        await db.commit()
+    return await get_summary(phone)
+
+def _counters(summary):
+    return {key: value for key, value in summary.items() if key != "updated_at"}
+
+def test_rebuild_matches_incremental_summary():
+    async def scenario():
+        await _load("33600000301")
+        incremental = await get_summary("33600000301")
+        rebuilt = await _rebuilt("33600000301")
+        await close_db()
+        return incremental, rebuilt
+
+    incremental, rebuilt = asyncio.run(scenario())
+    assert _counters(incremental) == _counters(rebuilt)
+    assert incremental["invoice_count"] == 7
+    assert incremental["outstanding_count"] == 5
+    assert incremental["overdue_count"] == 1
+    # Échéances passées exclues : prochaine échéance = aujourd'hui
+    assert incremental["next_due_date"] == TODAY
+
+def test_mark_overdue_moves_past_due_sent_invoices():
+    async def scenario():
+        await _load("33600000302")
+        moved = await mark_overdue()
+        summary = await get_summary("33600000302")
+        rebuilt = await _rebuilt("33600000302")
+        async with get_async_db() as db:
+            statuses = sorted((await db.execute(
+                select(Invoice.status).where(Invoice.user_phone == "33600000302")
+            )).scalars().all())
+        await close_db()
+        return moved, summary, rebuilt, statuses
+
+    moved, summary, rebuilt, statuses = asyncio.run(scenario())
+    assert moved >= 2
+    assert statuses == ["draft", "overdue", "overdue", "overdue", "paid", "sent", "sent"]
+    assert summary["overdue_count"] == 3 and summary["overdue_amount"] == 350.0
+    assert summary["outstanding_count"] == 5
+    assert summary["next_due_date"] == TODAY
+    assert _counters(summary) == _counters(rebuilt)
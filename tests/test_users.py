@@ -0,0 +1,45 @@
+# =====================================
+# tests/test_users.py
+# =====================================
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.database import close_db, get_async_db
+from app.models import User
+from app.users import UserStore
+
+async def _stop_during_write(monkeypatch, phones):
+    monkeypatch.setenv("LAST_ACTIVE_FLUSH_INTERVAL", "0.05")
+    store = UserStore()
+    async with get_async_db() as db:
+        await store.get_many(db, phones)
+
+    started = asyncio.Event()
+    write = store._write_last_active
+
+    async def slow(pending):
+        started.set()
+        await asyncio.sleep(0.2)
+        await write(pending)
+
+    store._write_last_active = slow
+    first, second = datetime(2024, 5, 1, 9, 0), datetime(2024, 5, 1, 9, 5)
+    await store.start()
+    try:
+        store.touch(phones[:1], first)
+        await asyncio.wait_for(started.wait(), timeout=5)
+        # Activité pendant l'écriture du premier lot
+        store.touch(phones[1:], second)
+        await store.stop()
+        async with get_async_db() as db:
+            rows = (await db.execute(select(User.phone, User.last_active).where(User.phone.in_(phones)))).all()
+        return dict(rows), first, second
+    finally:
+        await close_db()
+
+def test_stop_writes_every_pending_last_active(monkeypatch):
+    phones = ["33600000401", "33600000402"]
+    last_active, first, second = asyncio.run(_stop_during_write(monkeypatch, phones))
+    assert last_active == {phones[0]: first, phones[1]: second}
@@ -0,0 +1,114 @@
+# =====================================
+# tests/test_worker.py
+# =====================================
+import asyncio
+
+from sqlalchemy import select
+
+from app.database import close_db, get_async_db
+from app.models import PendingMessage
+from app.worker import MessageWorkerPool
+
+APOLOGY = "Désolé, j'ai rencontré un problème technique. Pouvez-vous réessayer ?"
+
+class FakeOutbox:
+    """Enregistrement dans la transaction du worker, envoi simulé"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def add(self, db, messages):
+        return list(messages)
+
+    def submit(self, items):
+        self.sent.extend(items)
+
+class FlakyCoach:
+    """Base indisponible au premier passage, puis réponse normale"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    async def process_messages(self, messages, raise_errors=False):
+        self.calls.append(raise_errors)
+        if self.failures:
+            self.failures -= 1
+            if raise_errors:
+                raise ConnectionError("base indisponible")
+            return [APOLOGY] * len(messages)
+        return [f"réponse à {m['message']}" for m in messages]
+
+async def _run(phone, failures, max_attempts, monkeypatch):
+    monkeypatch.setenv("WORKER_MAX_ATTEMPTS", str(max_attempts))
+    monkeypatch.setenv("WORKER_RETRY_DELAY", "0")
+    monkeypatch.setenv("WORKER_POLL_INTERVAL", "0.05")
+    coach, outbox = FlakyCoach(failures), FakeOutbox()
+    pool = MessageWorkerPool(coach, outbox)
+    await pool.start()
+    try:
+        await pool.enqueue([{"message_id": f"wamid.{phone}", "from": phone, "body": "bonjour", "media_url": None}])
+        for _ in range(100):
+            if outbox.sent:
+                break
+            await asyncio.sleep(0.05)
+        async with get_async_db() as db:
+            row = (await db.execute(select(PendingMessage).where(PendingMessage.user_phone == phone))).scalar_one()
+        return coach, outbox, row
+    finally:
+        await pool.stop()
+        await close_db()
+
+def test_infrastructure_error_is_retried(monkeypatch):
+    coach, outbox, row = asyncio.run(_run("33600000101", 1, 3, monkeypatch))
+    assert outbox.sent == [("33600000101", "réponse à bonjour")]
+    assert coach.calls == [True, True]
+    assert row.processed and row.attempts == 2
+
+def test_apology_only_on_last_attempt(monkeypatch):
+    coach, outbox, row = asyncio.run(_run("33600000102", 5, 2, monkeypatch))
+    assert outbox.sent == [("33600000102", APOLOGY)]
+    assert coach.calls == [True, False]
+    assert row.processed and row.attempts == 2
+
+class StuckCoach:
+    """Réponse qui n'arrive jamais (appel LLM en cours au moment de l'arrêt)"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def process_messages(self, messages, raise_errors=False):
+        self.started.set()
+        await asyncio.Event().wait()
+
+async def _stop_with_work_in_flight(monkeypatch):
+    monkeypatch.setenv("WORKER_CONCURRENCY", "1")
+    monkeypatch.setenv("WORKER_BATCH_SIZE", "1")
+    monkeypatch.setenv("WORKER_DRAIN_TIMEOUT", "0.1")
+    coach = StuckCoach()
+    pool = MessageWorkerPool(coach, FakeOutbox())
+    await pool.start()
+    try:
+        await pool.enqueue([
+            {"message_id": f"wamid.stop.{i}", "from": phone, "body": "bonjour", "media_url": None}
+            for i, phone in enumerate(["33600000201", "33600000201", "33600000202"])
+        ])
+        await asyncio.wait_for(coach.started.wait(), timeout=5)
+        for _ in range(100):
+            if len(pool._pending_items) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        async with get_async_db() as db:
+            return (await db.execute(
+                select(PendingMessage).where(PendingMessage.message_id.like("wamid.stop.%")).order_by(PendingMessage.id)
+            )).scalars().all()
+    finally:
+        await close_db()
+
+def test_stop_releases_claims(monkeypatch):
+    rows = asyncio.run(_stop_with_work_in_flight(monkeypatch))
+    assert len(rows) == 3
+    assert all(row.claimed_by is None and row.claimed_at is None and not row.processed for row in rows)
+    # Seul le message confié au coach garde sa tentative
+    assert [row.attempts for row in rows] == [1, 0, 0]